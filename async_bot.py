@@ -0,0 +1,732 @@
+"""
+Асинхронный режим работы бота (ASGI).
+
+Использует те же обработчики, тексты и парсеры, что и bot.py, но все
+внешние запросы (TheSportsDB, OpenAI, Telegram Bot API) выполняются
+асинхронно, поэтому один процесс обслуживает сотни заданий одновременно.
+
+Запуск:
+    uvicorn async_bot:app --host 0.0.0.0 --port $PORT
+"""
+import os
+import hmac
+import json
+import time
+import asyncio
+import logging
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+import httpx
+
+import bot
+import metrics
+import tracing
+import web_search
+import circuit_breaker
+import model_router
+import fallback_article
+import enrichment
+import update_dedup
+
+logger = logging.getLogger(__name__)
+
+# Максимальное количество одновременно обрабатываемых заданий в процессе
+ASYNC_MAX_CONCURRENT_JOBS = int(os.getenv("ASYNC_MAX_CONCURRENT_JOBS", 200))
+# Время ожидания завершения активных заданий при остановке (секунды)
+SHUTDOWN_TIMEOUT = 30
+# Таймаут запросов к Telegram Bot API (секунды)
+TELEGRAM_REQUEST_TIMEOUT = 30
+
+class TelegramAPIError(Exception):
+    """Ошибка, возвращенная Telegram Bot API."""
+
+class AsyncTelegramBot:
+    """Минимальный асинхронный клиент Telegram Bot API."""
+
+    def __init__(self, token):
+        self.base_url = f"{bot.TELEGRAM_API_URL}/bot{token}"
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=TELEGRAM_REQUEST_TIMEOUT,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+            )
+        return self._client
+
+    async def call(self, method, **params):
+        """
+        Вызывает метод Bot API.
+
+        Args:
+            method: Название метода (например, "sendMessage")
+            **params: Параметры метода, None-значения отбрасываются
+
+        Returns:
+            Поле result из ответа Telegram
+        """
+        payload = {key: value for key, value in params.items() if value is not None}
+        with metrics.TELEGRAM_REQUEST_DURATION.time(method=method), tracing.span("telegram", method=method):
+            response = await self._get_client().post(f"{self.base_url}/{method}", json=payload)
+        data = response.json()
+
+        if not data.get("ok"):
+            # При превышении лимитов Telegram сообщает, сколько нужно подождать
+            retry_after = data.get("parameters", {}).get("retry_after")
+            if retry_after:
+                logger.warning(f"Telegram ограничил частоту запросов, ждем {retry_after} сек.")
+                await asyncio.sleep(retry_after)
+                return await self.call(method, **params)
+            raise TelegramAPIError(data.get("description", "Неизвестная ошибка Telegram"))
+
+        return data.get("result")
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_markup=None):
+        """Отправляет текстовое сообщение в чат."""
+        return await self.call(
+            "sendMessage",
+            chat_id=chat_id,
+            text=text,
+            parse_mode=parse_mode,
+            reply_markup=reply_markup
+        )
+
+    async def set_webhook(self, url):
+        """Устанавливает webhook (с секретным токеном, см. bot.WEBHOOK_SECRET_TOKEN)."""
+        return await self.call("setWebhook", url=url, **bot.webhook_secret_kwargs())
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+async_bot = AsyncTelegramBot(bot.TELEGRAM_TOKEN)
+
+def build_keyboard(layout):
+    """Создает клавиатуру Bot API из раскладки подписей кнопок."""
+    return {
+        "keyboard": [[{"text": label} for label in row] for row in layout],
+        "resize_keyboard": True
+    }
+
+class AsyncMessage:
+    """Сообщение с асинхронным reply_text, аналог telegram.Message."""
+
+    def __init__(self, api, data):
+        self._api = api
+        self.text = data.get("text")
+        self.message_id = data.get("message_id")
+        self.chat_id = data.get("chat", {}).get("id")
+
+    async def reply_text(self, text, parse_mode=None, reply_markup=None):
+        return await self._api.send_message(self.chat_id, text, parse_mode=parse_mode, reply_markup=reply_markup)
+
+class AsyncUpdate:
+    """Входящее обновление, аналог telegram.Update для асинхронного режима."""
+
+    def __init__(self, update_id, message, effective_user):
+        self.update_id = update_id
+        self.message = message
+        self.effective_user = effective_user
+
+    @classmethod
+    def de_json(cls, data, api):
+        message_data = data.get("message")
+        if not message_data:
+            return cls(data.get("update_id"), None, None)
+
+        user_data = message_data.get("from", {})
+        effective_user = SimpleNamespace(id=user_data.get("id"), first_name=user_data.get("first_name", ""))
+        return cls(data.get("update_id"), AsyncMessage(api, message_data), effective_user)
+
+async def send_long_message(update, message):
+    """Отправляет сообщение, при необходимости разбивая его на части."""
+    for part in bot.split_message(message):
+        await update.message.reply_text(part, parse_mode='Markdown')
+
+async def setup_menu(update, context) -> None:
+    """Создает меню с кнопками команд."""
+    await update.message.reply_text("Меню команд бота:", reply_markup=build_keyboard(bot.MENU_KEYBOARD))
+
+async def example_command(update, context) -> None:
+    """Отправляет пример запроса для прогноза."""
+    await update.message.reply_text(bot.EXAMPLE_TEXT, parse_mode='Markdown')
+
+async def start(update, context) -> None:
+    """Отправляет приветственное сообщение при команде /start."""
+    welcome_text = bot.WELCOME_TEXT_TEMPLATE.format(user_first_name=update.effective_user.first_name)
+    await update.message.reply_text(welcome_text, parse_mode='Markdown', reply_markup=build_keyboard(bot.START_KEYBOARD))
+
+async def help_command(update, context) -> None:
+    """Отправляет помощь при команде /help."""
+    await update.message.reply_text(bot.HELP_TEXT, parse_mode='Markdown', reply_markup=build_keyboard(bot.HELP_KEYBOARD))
+
+async def cancel_processing(update, context) -> None:
+    """Отменяет обработку текущих сообщений пользователя."""
+    user_id = update.effective_user.id
+    # Отмена обращается к хранилищу заданий (SQLite) - не в цикле событий
+    canceled = await asyncio.to_thread(bot.cancel_user_messages, user_id)
+    # Отмененный ожидающий запрос пользователя должен завершиться
+    notify_user_jobs(user_id)
+    if canceled:
+        logger.info(f"Пользователь {user_id} отменил обработку своих сообщений.")
+        await update.message.reply_text(bot.CANCELED_TEXT)
+    else:
+        await update.message.reply_text(bot.NOTHING_TO_CANCEL_TEXT)
+
+async def search_match_info(match, profile=enrichment.FULL):
+    """Асинхронный поиск информации о матче (аналог bot.search_match_info)."""
+    with tracing.span("search_match_info", number=match.get('number', ''), profile=profile):
+        return await _search_match_info(match, profile)
+
+async def _search_match_info(match, profile):
+    try:
+        if match['is_all_matches']:
+            if profile == enrichment.NONE:
+                return bot.placeholder_tournament_matches(match['tournament'])
+            date_str = match.get('date', '21 марта')
+            matches = await web_search.async_search_matches_for_tournament(match['tournament'], date_str)
+            if not matches:
+                return bot.placeholder_tournament_matches(match['tournament'])
+            return matches
+
+        team1, team2 = bot.split_teams(match['teams'])
+        return await collect_match_info(match, team1, team2, profile)
+    except Exception as e:
+        logger.error(f"Ошибка при поиске информации о матче: {e}")
+        return bot.fallback_match_info(match)
+
+async def collect_match_info(match, team1, team2, profile):
+    """
+    Асинхронный вариант bot.collect_match_info.
+
+    Данные из локальной базы результатов (форма, личные встречи) читаются
+    из SQLite в отдельном потоке, чтобы не блокировать цикл событий.
+    """
+    if not enrichment.uses_api(profile):
+        return await asyncio.to_thread(
+            bot.build_local_match_info, team1, team2, match['tournament'], use_results=profile == enrichment.CACHED
+        )
+
+    # Данные обеих команд запрашиваются параллельно
+    try:
+        include_players = profile == enrichment.FULL
+        team1_info, team2_info = await asyncio.gather(
+            web_search.async_get_team_info(team1, include_players),
+            web_search.async_get_team_info(team2, include_players)
+        )
+    except Exception as e:
+        logger.warning(f"Не удалось получить данные о командах: {e}. Создаю заполнители.")
+        team1_info, team2_info = bot.placeholder_teams_info(team1, team2)
+
+    return await asyncio.to_thread(bot.build_match_info, match, team1, team2, team1_info, team2_info)
+
+async def create_chat_completion(openai_request, deadline=None, timing=None):
+    """Асинхронный вариант bot.create_chat_completion (метрики, предохранитель, таймаут от deadline)."""
+    prompt_tokens = bot.record_prompt_tokens(openai_request)
+    with tracing.span("openai", model=openai_request['model'], prompt_tokens=prompt_tokens):
+        async with bot.openai_limiter.async_slot():
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining < model_router.OPENAI_MIN_ATTEMPT_TIMEOUT:
+                    raise model_router.DeadlineExceeded(f"Осталось {remaining:.1f} с после ожидания слота OpenAI")
+                openai_request['request_timeout'] = remaining
+            if not bot.openai_breaker.allow():
+                raise circuit_breaker.CircuitOpenError("OpenAI временно недоступен")
+
+            started = time.perf_counter()
+            try:
+                response = await bot.get_openai().ChatCompletion.acreate(**openai_request)
+            except Exception as e:
+                if bot.is_openai_overload(e):
+                    bot.openai_limiter.record_overload()
+                bot.openai_breaker.record_failure()
+                metrics.OPENAI_REQUEST_DURATION.observe(time.perf_counter() - started, model=openai_request['model'], outcome="error")
+                raise
+            except BaseException:
+                # Задание отменено (asyncio.CancelledError) - пробный запрос не дал результата
+                bot.openai_breaker.record_canceled()
+                raise
+            finally:
+                if timing is not None:
+                    timing['seconds'] = time.perf_counter() - started
+
+    bot.openai_breaker.record_success()
+    metrics.OPENAI_REQUEST_DURATION.observe(time.perf_counter() - started, model=openai_request['model'], outcome="ok")
+    bot.record_token_usage(response, openai_request['model'])
+    return response
+
+async def _complete(match, min_symbols):
+    """Асинхронный вариант bot.request_prediction (выбор модели, таймауты, запасная статья)."""
+    router = model_router.router
+    deadline = time.monotonic() + router.deadline
+    model = router.choose(min_symbols, router.deadline)
+    while model is not None:
+        timing = {}
+        with tracing.span("route", model=model, timeout=round(deadline - time.monotonic(), 1)) as span:
+            try:
+                response = await create_chat_completion(bot.build_openai_request(match, min_symbols, model), deadline, timing)
+            except model_router.DeadlineExceeded:
+                if span is not None:
+                    span.attrs['outcome'] = model_router.OUTCOME_FALLBACK
+                break
+            except Exception as e:
+                if not bot.is_openai_timeout(e):
+                    router.record(model, timing.get('seconds', 0.0), 0, model_router.OUTCOME_ERROR)
+                    raise
+                router.record(model, timing['seconds'], model_router.expected_tokens(min_symbols), model_router.OUTCOME_TIMEOUT)
+                logger.warning(f"Таймаут модели {model} для матча {match['team1']} - {match['team2']}")
+                if span is not None:
+                    span.attrs['outcome'] = model_router.OUTCOME_TIMEOUT
+                model = router.choose(min_symbols, deadline - time.monotonic(), after=model)
+                continue
+            router.record(model, timing['seconds'], bot.completion_tokens(response, min_symbols), model_router.OUTCOME_OK)
+            if span is not None:
+                span.attrs['outcome'] = model_router.OUTCOME_OK
+        return {
+            'teams': f"{match['team1']} - {match['team2']}",
+            'prediction': response.choices[0].message['content'].strip()
+        }
+
+    router.record_fallback()
+    logger.warning(f"Время на прогноз для матча {match['team1']} - {match['team2']} истекло, используется запасная статья")
+    return fallback_article.build_article(match, min_symbols)
+
+async def generate_match_prediction(match_info, min_symbols):
+    """Асинхронная генерация прогноза (аналог bot.generate_match_prediction)."""
+    with tracing.span("generate_match_prediction", min_symbols=min_symbols):
+        return await _generate_match_prediction(match_info, min_symbols)
+
+async def _generate_match_prediction(match_info, min_symbols):
+    try:
+        if isinstance(match_info, list):
+            # Прогнозы на все матчи турнира запрашиваются параллельно
+            return list(await asyncio.gather(*(_complete(match, min_symbols) for match in match_info)))
+        return await _complete(match_info, min_symbols)
+    except Exception as e:
+        logger.error(f"Ошибка при генерации прогноза: {e}")
+        return bot.build_basic_prediction(match_info, min_symbols)
+
+def _job_id(update):
+    return f"{update.effective_user.id}_{update.message.message_id}"
+
+async def is_job_canceled(update):
+    """Отменено ли задание сообщения (/cancel или новым запросом пользователя)."""
+    job_id = _job_id(update)
+    if await asyncio.to_thread(bot.is_job_canceled, job_id):
+        logger.info(f"Задание {job_id} отменено пользователем, обработка остановлена")
+        return True
+    return False
+
+# Запросы, ожидающие очереди заданий пользователя (USER_JOB_POLICY=queue):
+# user_id -> asyncio.Event, которое устанавливается при изменении его заданий
+_user_job_events = {}
+
+def notify_user_jobs(user_id):
+    """Будит запросы пользователя, ожидающие очереди (после изменения его заданий)."""
+    event = _user_job_events.pop(user_id, None)
+    if event is not None:
+        event.set()
+
+async def acquire_user_job(update):
+    """
+    Асинхронный вариант bot.acquire_user_job.
+
+    Состояние заданий пользователей общее с bot (отмена, готовые прогнозы), но
+    очередь ожидается событием цикла, а не в потоке: ожидающие запросы не
+    занимают потоки asyncio.to_thread, нужные выполняющимся заданиям.
+
+    Returns:
+        dict: Готовые прогнозы заданий пользователя по ключам матчей или None,
+            если запрос, ожидая очереди, заменен более новым
+    """
+    job_id, user_id = _job_id(update), update.effective_user.id
+    await asyncio.to_thread(bot.cancel_stored_user_jobs, job_id, user_id, bot.USER_JOB_POLICY)
+
+    with bot.user_jobs_condition:
+        result, notice = bot.register_user_job(job_id, user_id, bot.USER_JOB_POLICY)
+    if result is bot.QUEUED:
+        # Ранее ожидавший запрос пользователя заменен этим
+        notify_user_jobs(user_id)
+    if notice:
+        await update.message.reply_text(notice)
+    if result is not bot.QUEUED:
+        return result
+
+    while True:
+        with bot.user_jobs_condition:
+            if not bot.is_user_job_queued(job_id, user_id):
+                return bot.finish_user_job_wait(job_id, user_id)
+            event = _user_job_events.setdefault(user_id, asyncio.Event())
+        await event.wait()
+
+def release_user_job(update):
+    """Асинхронный вариант bot.release_user_job (будит ожидающий запрос пользователя)."""
+    bot.release_user_job(_job_id(update), update.effective_user.id)
+    notify_user_jobs(update.effective_user.id)
+
+async def enrich_job_item(item, send):
+    """Асинхронный вариант bot.enrich_job_item."""
+    match = item['match']
+
+    profile = enrichment.profile_for(item['kind'])
+    if item['kind'] == 'simple':
+        return await collect_match_info(match, match['team1'], match['team2'], profile)
+
+    match_info = await search_match_info(match, profile)
+    if not match_info:
+        await send(bot.match_info_missing_text(item))
+    return match_info
+
+async def generate_job_item(item, match_info, send):
+    """Асинхронный вариант bot.generate_job_item."""
+    for text in bot.generation_messages(item):
+        await send(text)
+    return await generate_match_prediction(match_info, item['match']['min_symbols'])
+
+async def execute_job(update, items, outro, reuse=None):
+    """
+    Асинхронный вариант bot.execute_job.
+
+    Задание составляется теми же bot.build_structured_job и bot.build_simple_job,
+    а сообщения пользователю - теми же функциями bot, что и в синхронном режиме.
+    Элементы обрабатываются по очереди и не сохраняются в хранилище заданий.
+    Прогнозы матчей, уже готовые в других заданиях пользователя (словарь
+    reuse), не генерируются повторно. Обработка прекращается, если
+    пользователь отменил задание.
+    """
+    async def send(text, parse_mode=None):
+        await update.message.reply_text(text, parse_mode=parse_mode)
+
+    for item in items:
+        if await is_job_canceled(update):
+            return
+        try:
+            for text in item['messages']:
+                await send(text)
+            predictions = reuse.get(bot.match_key(item)) if reuse is not None else None
+            if predictions is not None:
+                logger.info(f"Прогноз для матча {item['position']} взят из предыдущего запроса")
+            else:
+                match_info = await enrich_job_item(item, send)
+                predictions = await generate_job_item(item, match_info, send)
+                if reuse is not None:
+                    reuse[bot.match_key(item)] = predictions
+        except Exception as e:
+            logger.error(f"Ошибка при обработке матча {item['position']} задания {_job_id(update)}: {e}")
+            await send(bot.job_item_error_text(item))
+            continue
+
+        for message in bot.format_job_item_result(item, predictions):
+            await send_long_message(update, message)
+
+    if await is_job_canceled(update):
+        return
+    for text in outro:
+        await send(text)
+
+async def process_matches(update, context, reuse=None) -> None:
+    """Обрабатывает сообщение в формате "@Get articles" и генерирует прогнозы."""
+    message_text = update.message.text
+
+    content = bot.extract_structured_content(message_text)
+    if content is None:
+        await update.message.reply_text(bot.FORMAT_ERROR_TEXT, parse_mode='Markdown')
+        return
+
+    await update.message.reply_text("🔍 Начинаю обработку данных из сообщения...")
+
+    max_matches = bot.extract_max_matches(message_text)
+
+    with metrics.PARSE_DURATION.time(format="structured"), tracing.span("parse", format="structured"):
+        date_blocks = bot.parse_match_text(content)
+    if not date_blocks:
+        await update.message.reply_text(bot.PARSE_ERROR_TEXT, parse_mode='Markdown')
+        return
+
+    items, outro = bot.build_structured_job(date_blocks, max_matches)
+    await execute_job(update, items, outro, reuse)
+
+async def process_simple_match(update, context, reuse=None) -> None:
+    """Обрабатывает простое сообщение от пользователя и генерирует прогноз."""
+    parsed_data = bot.parse_simple_message(update.message.text)
+    matches = parsed_data['matches']
+
+    if not matches:
+        await update.message.reply_text(bot.SIMPLE_FORMAT_ERROR_TEXT, parse_mode='Markdown')
+        return
+
+    await update.message.reply_text(f"📊 Найдено матчей: {len(matches)}. Начинаю обработку...")
+
+    items, outro = bot.build_simple_job(matches)
+    await execute_job(update, items, outro, reuse)
+
+async def process_text_or_buttons(update, context) -> None:
+    """Обрабатывает обычные текстовые сообщения и нажатия на кнопки."""
+    with tracing.job(f"{update.effective_user.id}_{update.message.message_id}"):
+        await _process_text_or_buttons(update, context)
+
+async def _process_text_or_buttons(update, context) -> None:
+    user_id = update.effective_user.id
+    message_id = update.message.message_id
+
+    if bot.is_rate_limited(user_id):
+        await update.message.reply_text(bot.RATE_LIMIT_TEXT)
+        return
+
+    message_text = bot.sanitize_input(update.message.text)
+    if not message_text:
+        await update.message.reply_text(bot.EMPTY_MESSAGE_TEXT)
+        return
+
+    message_key = f"{user_id}_{message_id}"
+
+    if not bot.processing_messages.add(message_key, user_id, replace=False):
+        logger.warning(f"Сообщение {message_key} уже обрабатывается, пропускаем.")
+        await update.message.reply_text(bot.DUPLICATE_MESSAGE_TEXT)
+        return
+
+    try:
+        if message_text == "Контакты":
+            await update.message.reply_text(bot.CONTACT_TEXT, parse_mode='Markdown')
+            return
+
+        reuse = await acquire_user_job(update)
+        if reuse is None:
+            await update.message.reply_text(bot.JOB_REPLACED_TEXT)
+            return
+        try:
+            with metrics.PARSE_DURATION.time(format="simple"), tracing.span("parse", format="simple"):
+                parsed_data = bot.parse_simple_message(message_text)
+            if parsed_data['matches']:
+                await process_simple_match(update, context, reuse)
+            else:
+                await process_matches(update, context, reuse)
+        finally:
+            release_user_job(update)
+    finally:
+        bot.processing_messages.discard(message_key)
+
+# Обработчики команд (аналог CommandHandler в bot.setup_bot)
+COMMAND_HANDLERS = {
+    "start": start,
+    "help": help_command,
+    "menu": setup_menu,
+    "example": example_command,
+    "cancel": cancel_processing,
+}
+
+async def dispatch_update(update) -> None:
+    """Передает обновление подходящему обработчику."""
+    if update.message is None or not update.message.text:
+        return
+
+    text = update.message.text
+    if text.startswith('/'):
+        # "/start@BotName аргументы" -> "start"
+        command = text[1:].split()[0].split('@')[0] if len(text) > 1 else ''
+        handler = COMMAND_HANDLERS.get(command)
+        if handler:
+            await handler(update, None)
+        return
+
+    await process_text_or_buttons(update, None)
+
+# Ограничение на количество одновременных заданий и ссылки на активные задачи
+_job_semaphore = None
+_active_tasks = set()
+
+PENDING_JOBS = metrics.Gauge(
+    "async_bot_pending_jobs",
+    "Количество принятых асинхронным режимом и еще не завершенных заданий",
+    callback=lambda: len(_active_tasks)
+)
+
+async def _run_update(update_json):
+    async with _job_semaphore:
+        try:
+            await dispatch_update(AsyncUpdate.de_json(update_json, async_bot))
+        except Exception as e:
+            logger.error(f"Ошибка при обработке обновления: {e}")
+
+def schedule_update(update_json):
+    """Запускает обработку обновления в фоне, не задерживая ответ Telegram."""
+    task = asyncio.get_running_loop().create_task(_run_update(update_json))
+    _active_tasks.add(task)
+    task.add_done_callback(_active_tasks.discard)
+    return task
+
+async def register_webhook():
+    """Устанавливает webhook, если он еще не указывает на текущий URL (аналог bot.register_webhook)."""
+    webhook_url = bot.get_webhook_url()
+    try:
+        info = await async_bot.call("getWebhookInfo")
+        # Секретный токен по getWebhookInfo не проверить, поэтому при проверке webhook устанавливается всегда
+        if info and info.get("url") == webhook_url and not bot.WEBHOOK_VERIFY_SECRET:
+            logger.info(f"Вебхук уже установлен на {webhook_url}, повторная установка не требуется")
+            return True
+        await async_bot.set_webhook(webhook_url)
+        logger.info(f"Вебхук установлен на {webhook_url}")
+        return True
+    except Exception as e:
+        logger.error(f"Произошла ошибка при установке вебхука: {e}")
+        return False
+
+async def startup():
+    """Инициализация при запуске ASGI приложения."""
+    global _job_semaphore
+    _job_semaphore = asyncio.Semaphore(ASYNC_MAX_CONCURRENT_JOBS)
+
+    # Установка webhook не задерживает готовность воркера к приему запросов
+    if bot.WEBHOOK_AUTO_REGISTER:
+        task = asyncio.get_running_loop().create_task(register_webhook())
+        _active_tasks.add(task)
+        task.add_done_callback(_active_tasks.discard)
+
+async def shutdown():
+    """Дожидается активных заданий и закрывает HTTP клиенты."""
+    if _active_tasks:
+        logger.info(f"Ожидание завершения {len(_active_tasks)} активных заданий...")
+        await asyncio.wait(set(_active_tasks), timeout=SHUTDOWN_TIMEOUT)
+    await async_bot.close()
+    await web_search.close_async_client()
+
+async def _read_body(receive, max_size=None):
+    """Читает тело запроса; None, если оно больше max_size байт."""
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if max_size is not None and len(body) > max_size:
+            return None
+        if not message.get('more_body'):
+            return body
+
+async def _send_response(send, status, text, content_type='text/plain; charset=utf-8'):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode('latin-1'))]
+    })
+    await send({'type': 'http.response.body', 'body': text.encode('utf-8')})
+
+def _is_admin_request(scope):
+    """Проверяет токен служебного запроса (аналог bot.is_admin_request)."""
+    if not bot.ADMIN_TOKEN:
+        return False
+
+    headers = dict(scope.get('headers') or [])
+    auth_header = headers.get(b'authorization', b'').decode('latin-1')
+    if auth_header.startswith('Bearer '):
+        token = auth_header[7:]
+    else:
+        token = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('token', [''])[0]
+    return hmac.compare_digest(token.encode(), bot.ADMIN_TOKEN.encode())
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await startup()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+def _is_duplicate_update(update_id):
+    """Проверяет повторную доставку обновления (в пределах процесса, без блокирующих запросов к хранилищу)."""
+    if bot.recent_updates.seen(update_id):
+        logger.info("Обновление %s уже получено, повтор пропущен", update_id, extra={'log_type': 'duplicate_update'})
+        metrics.DUPLICATE_UPDATES.inc(runtime="async")
+        return True
+    return False
+
+async def app(scope, receive, send):
+    """ASGI приложение: webhook, проверка работоспособности и установка webhook."""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    path = scope['path']
+    method = scope['method']
+
+    if path == '/' + bot.WEBHOOK_PATH and method == 'POST':
+        # Запросы не от Telegram отклоняются по заголовкам, без чтения тела
+        headers = dict(scope.get('headers') or [])
+        content_length = headers.get(b'content-length', b'')
+        rejection = bot.webhook_rejection(
+            headers.get(b'x-telegram-bot-api-secret-token', b'').decode('latin-1'),
+            headers.get(b'content-type', b'').decode('latin-1'),
+            int(content_length) if content_length.isdigit() else None
+        )
+        if rejection is None:
+            body = await _read_body(receive, bot.WEBHOOK_MAX_BODY_SIZE)
+            if body is None:
+                rejection = (413, 'size')
+        if rejection is not None:
+            status, reason = rejection
+            metrics.WEBHOOK_REJECTED.inc(reason=reason)
+            await _send_response(send, status, '')
+            return
+
+        # Повторная доставка подтверждается до разбора JSON
+        update_id = update_dedup.peek_update_id(body)
+        if update_id is not None and _is_duplicate_update(update_id):
+            await _send_response(send, 200, 'ok')
+            return
+
+        try:
+            update_json = json.loads(body)
+        except (ValueError, UnicodeDecodeError) as e:
+            logger.error(f"Ошибка при разборе JSON в webhook запросе: {e}")
+            await _send_response(send, 400, 'Bad Request')
+            return
+
+        if not update_json or not isinstance(update_json, dict):
+            logger.warning("Получен пустой JSON в webhook запросе")
+            await _send_response(send, 403, 'Forbidden')
+            return
+
+        if update_id is None and isinstance(update_json.get('update_id'), int):
+            if _is_duplicate_update(update_json['update_id']):
+                await _send_response(send, 200, 'ok')
+                return
+
+        bot.cleanup_processing_messages()
+        metrics.WEBHOOK_UPDATES.inc(runtime="async")
+        schedule_update(update_json)
+        await _send_response(send, 200, 'ok')
+    elif path == '/' and method == 'GET':
+        await _send_response(send, 200, 'Бот работает!')
+    elif path == '/metrics' and method == 'GET':
+        await _send_response(send, 200, metrics.render(), metrics.CONTENT_TYPE)
+    elif path == '/ready' and method == 'GET':
+        # В асинхронном режиме очередь - это принятые, но не завершенные задания
+        is_ready, details = bot.readiness_status(max_inflight_jobs=ASYNC_MAX_CONCURRENT_JOBS)
+        details['pending_jobs'] = len(_active_tasks)
+        is_ready = is_ready and len(_active_tasks) < ASYNC_MAX_CONCURRENT_JOBS
+        details['ready'] = is_ready
+        await _send_response(send, 200 if is_ready else 503, json.dumps(details), 'application/json')
+    elif path == '/set_webhook' and method == 'GET':
+        webhook_url = bot.get_webhook_url()
+        try:
+            await async_bot.set_webhook(webhook_url)
+            await _send_response(send, 200, f"Webhook установлен на {webhook_url}!")
+        except Exception:
+            await _send_response(send, 200, "Ошибка установки webhook")
+    elif path == '/trace' and method == 'GET' and _is_admin_request(scope):
+        lines = [f"{job_id}  {started_at:%Y-%m-%d %H:%M:%S}  {duration:8.3f} с" for job_id, started_at, duration in tracing.recent_jobs()]
+        await _send_response(send, 200, "\n".join(lines) + "\n")
+    elif path.startswith('/trace/') and method == 'GET' and _is_admin_request(scope):
+        waterfall = tracing.render_waterfall(path[len('/trace/'):])
+        if waterfall is None:
+            await _send_response(send, 404, 'Not Found')
+        else:
+            await _send_response(send, 200, waterfall + "\n")
+    else:
+        await _send_response(send, 404, 'Not Found')
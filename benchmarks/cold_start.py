@@ -0,0 +1,79 @@
+"""
+Замер холодного старта воркера: время импорта bot и первых запросов.
+
+Каждый прогон выполняется в отдельном процессе, чтобы модули не были
+закешированы. Сетевые запросы не выполняются (установка webhook отключена,
+в webhook отправляется обновление без сообщения).
+
+Запуск:
+    python benchmarks/cold_start.py --runs 5
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Тяжелые модули, которые не должны загружаться при импорте bot
+HEAVY_MODULES = ["telegram", "openai", "requests", "bs4"]
+
+CHILD_SCRIPT = """
+import sys, json, time
+t0 = time.perf_counter()
+import bot
+t1 = time.perf_counter()
+loaded = [name for name in {heavy!r} if name in sys.modules]
+client = bot.app.test_client()
+client.get('/')
+t2 = time.perf_counter()
+client.post('/' + bot.WEBHOOK_PATH, json={{'update_id': 1}})
+t3 = time.perf_counter()
+print(json.dumps({{
+    'import_ms': (t1 - t0) * 1000,
+    'first_health_ms': (t2 - t1) * 1000,
+    'first_webhook_ms': (t3 - t2) * 1000,
+    'heavy_loaded_on_import': loaded,
+}}))
+"""
+
+def run_once():
+    """Запускает один холодный старт в отдельном процессе и возвращает замеры."""
+    env = dict(os.environ)
+    env.setdefault("TELEGRAM_BOT_TOKEN", "123456:ABCdefGhIJKlmnoPQRstuVWXyz0123456789")
+    env.setdefault("OPENAI_API_KEY", "benchmark")
+    env["WEBHOOK_PATH"] = "benchmark"
+    env["WEBHOOK_AUTO_REGISTER"] = "false"
+
+    script = CHILD_SCRIPT.format(heavy=HEAVY_MODULES)
+    started = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    # Последняя строка вывода - результат, все остальное - логи
+    return json.loads(started.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер холодного старта бота")
+    parser.add_argument("--runs", type=int, default=5, help="Количество прогонов")
+    args = parser.parse_args()
+
+    results = [run_once() for _ in range(args.runs)]
+
+    print(f"Прогонов: {args.runs}")
+    for key, title in [
+        ("import_ms", "Импорт bot"),
+        ("first_health_ms", "Первый запрос /"),
+        ("first_webhook_ms", "Первый webhook"),
+    ]:
+        values = [result[key] for result in results]
+        print(f"{title:<20} медиана {statistics.median(values):8.1f} мс  "
+              f"мин {min(values):8.1f} мс  макс {max(values):8.1f} мс")
+
+    loaded = results[0]["heavy_loaded_on_import"]
+    print(f"Тяжелые модули после импорта: {', '.join(loaded) if loaded else 'нет'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Локальные заглушки Telegram Bot API, TheSportsDB и OpenAI для бенчмарков.
+
+Каждая заглушка - HTTP сервер в отдельном потоке с настраиваемой задержкой
+ответа и долей ошибок. Ответы повторяют структуру настоящих API в той мере,
+в какой ее использует бот.
+"""
+import json
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+class FakeService:
+    """
+    HTTP заглушка внешнего API.
+
+    Args:
+        name: Название (для отчета)
+        respond: Функция (method, path, query, body) -> (status, dict)
+        latency: Средняя задержка ответа (секунды)
+        jitter: Разброс задержки (секунды, равномерно +-jitter)
+        error_rate: Доля ответов с ошибкой 500/429
+        error_status: HTTP статус ошибочного ответа
+    """
+
+    def __init__(self, name, respond, latency=0.0, jitter=0.0, error_rate=0.0, error_status=500):
+        self.name = name
+        self.respond = respond
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw_body = self.rfile.read(length) if length else b""
+                parsed = urlparse(self.path)
+                status, payload = service.handle(self.command, parsed.path, parse_qs(parsed.query), raw_body, self.headers)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            # Очередь соединений должна вмещать все одновременные запросы бенчмарка
+            request_queue_size = 1024
+
+        self._server = Server(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def handle(self, method, path, query, raw_body, headers):
+        with self._lock:
+            self.requests += 1
+        delay = max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+        if delay:
+            time.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            with self._lock:
+                self.errors += 1
+            return self.error_status, {"ok": False, "error": "fake error"}
+        return self.respond(method, path, query, _decode_body(raw_body, headers))
+
+def _decode_body(raw_body, headers):
+    if not raw_body:
+        return {}
+    content_type = headers.get("Content-Type", "")
+    if "json" in content_type:
+        return json.loads(raw_body)
+    if "x-www-form-urlencoded" in content_type:
+        return {key: values[0] for key, values in parse_qs(raw_body.decode("utf-8")).items()}
+    try:
+        return json.loads(raw_body)
+    except ValueError:
+        return {}
+
+# ---------------------------------------------------------------------------
+# Ответы заглушек
+# ---------------------------------------------------------------------------
+
+_message_counter = 0
+_message_lock = threading.Lock()
+
+def telegram_respond(method, path, query, body):
+    """Ответы Telegram Bot API: /bot<token>/<method>."""
+    global _message_counter
+    api_method = path.rsplit("/", 1)[-1]
+
+    if api_method in ("sendMessage", "editMessageText", "sendDocument"):
+        with _message_lock:
+            _message_counter += 1
+            message_id = _message_counter
+        return 200, {"ok": True, "result": {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(body.get("chat_id", 0) or 0), "type": "private"},
+            "text": str(body.get("text", ""))[:100],
+        }}
+    if api_method == "getWebhookInfo":
+        return 200, {"ok": True, "result": {"url": "", "has_custom_certificate": False, "pending_update_count": 0}}
+    if api_method in ("setWebhook", "deleteWebhook"):
+        return 200, {"ok": True, "result": True}
+    if api_method == "getUpdates":
+        return 200, {"ok": True, "result": []}
+    return 200, {"ok": True, "result": True}
+
+def thesportsdb_respond(method, path, query, body):
+    """Ответы TheSportsDB: /<key>/<endpoint>.php."""
+    endpoint = path.rsplit("/", 1)[-1]
+    param = lambda name: query.get(name, [""])[0]
+
+    if endpoint == "searchteams.php":
+        name = param("t")
+        return 200, {"teams": [{"idTeam": str(abs(hash(name)) % 100000), "strTeam": name}]}
+    if endpoint == "eventslast.php":
+        team_id = param("id")
+        return 200, {"results": [
+            {
+                "dateEvent": f"2025-03-{10 + i:02d}",
+                "strHomeTeam": f"Команда {team_id}" if i % 2 == 0 else f"Соперник {i}",
+                "strAwayTeam": f"Соперник {i}" if i % 2 == 0 else f"Команда {team_id}",
+                "intHomeScore": str(i % 3),
+                "intAwayScore": str((i + 1) % 2),
+                "strLeague": "Fake League",
+                "idHomeTeam": team_id if i % 2 == 0 else str(1000 + i),
+                "idAwayTeam": str(1000 + i) if i % 2 == 0 else team_id,
+            }
+            for i in range(5)
+        ]}
+    if endpoint == "searchplayers.php":
+        positions = ["Goalkeeper", "Defender", "Midfielder", "Forward"]
+        return 200, {"player": [
+            {"strPlayer": f"Игрок {i}", "strPosition": positions[i % len(positions)]}
+            for i in range(25)
+        ]}
+    if endpoint == "eventsday.php":
+        leagues = ["FIFA World Cup qualification (UEFA)", "UEFA Nations League"]
+        return 200, {"events": [
+            {
+                "strHomeTeam": f"Сборная {2 * i + 1}",
+                "strAwayTeam": f"Сборная {2 * i + 2}",
+                "strLeague": league,
+                "dateEvent": param("d"),
+            }
+            for league in leagues
+            for i in range(6)
+        ]}
+    return 200, {}
+
+_ARTICLE_SENTENCE = (
+    "Команды подходят к матчу в хорошей форме, и тренеры готовят интересные тактические решения. "
+)
+
+def openai_respond(method, path, query, body):
+    """Ответы OpenAI: /v1/chat/completions."""
+    max_tokens = int(body.get("max_tokens") or 500)
+    # Примерно 4 символа на токен
+    text = (_ARTICLE_SENTENCE * (max_tokens * 4 // len(_ARTICLE_SENTENCE) + 1))[:max_tokens * 4]
+    return 200, {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": max_tokens, "total_tokens": max_tokens},
+    }
+
+def start_services(telegram_latency=0.02, sportsdb_latency=0.1, openai_latency=1.0,
+                   jitter_ratio=0.3, error_rate=0.0):
+    """Запускает все три заглушки и возвращает словарь name -> FakeService."""
+    services = {
+        "telegram": FakeService("telegram", telegram_respond, telegram_latency, telegram_latency * jitter_ratio),
+        "thesportsdb": FakeService("thesportsdb", thesportsdb_respond, sportsdb_latency, sportsdb_latency * jitter_ratio, error_rate),
+        "openai": FakeService("openai", openai_respond, openai_latency, openai_latency * jitter_ratio, error_rate, error_status=429),
+    }
+    for service in services.values():
+        service.start()
+    return services
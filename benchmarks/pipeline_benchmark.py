@@ -0,0 +1,221 @@
+"""
+Офлайн бенчмарк полного пути обработки: webhook -> обработчик -> web_search
+-> generate_match_prediction -> отправка в Telegram.
+
+Настоящий код бота работает против локальных заглушек Telegram, TheSportsDB
+и OpenAI (benchmarks/fake_services.py) с настраиваемыми задержками и долей
+ошибок. Для каждого сценария воспроизводится поток синтетических
+обновлений и выводятся p50/p95/p99 длительности задания и пропускная
+способность (заданий в секунду).
+
+Примеры:
+    python benchmarks/pipeline_benchmark.py --jobs 20 --concurrency 4
+    python benchmarks/pipeline_benchmark.py --runtime async --jobs 200 --concurrency 200
+    python benchmarks/pipeline_benchmark.py --json current.json --baseline baseline.json
+
+С --baseline бенчмарк завершается с кодом 1, если p95 вырос или
+пропускная способность упала больше чем на --max-regression.
+"""
+import os
+import sys
+import tempfile
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_services
+
+WEBHOOK_PATH = "benchmark"
+
+# Синтетические сообщения пользователей
+SCENARIOS = {
+    "single": "Спартак - ЦСКА",
+    "list10": "10 статей\n" + "\n".join(f"Команда {2 * i + 1} - Команда {2 * i + 2}" for i in range(10)),
+    "tournaments3": (
+        "@Get articles\n"
+        "на 21 марта (не позднее 16 марта)\n\n"
+        + "\n".join(f"{i + 1}. Все 2 матчей                Лига Наций. Переходные матчи (1000)" for i in range(3))
+    ),
+    "all_matches": (
+        "@Get articles\n"
+        "на 21 марта (не позднее 16 марта)\n\n"
+        "1. Все 6 матчей                Лига Наций. Переходные матчи (1000)"
+    ),
+}
+
+def percentile(values, percent):
+    """Перцентиль методом ближайшего ранга."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(percent / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+def make_update(job_number, text):
+    user_id = 100000 + job_number
+    return {
+        "update_id": job_number,
+        "message": {
+            "message_id": job_number,
+            "date": int(time.time()),
+            "text": text,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+        },
+    }
+
+def webhook_headers():
+    """Заголовок с секретным токеном webhook, который передает Telegram."""
+    import bot
+
+    return {"X-Telegram-Bot-Api-Secret-Token": bot.WEBHOOK_SECRET_TOKEN}
+
+def configure_environment(services):
+    """Направляет бота на заглушки; вызывается до импорта bot."""
+    os.environ["TELEGRAM_BOT_TOKEN"] = "123456:ABCdefGhIJKlmnoPQRstuVWXyz0123456789"
+    os.environ["OPENAI_API_KEY"] = "benchmark"
+    os.environ["WEBHOOK_PATH"] = WEBHOOK_PATH
+    os.environ["WEBHOOK_AUTO_REGISTER"] = "false"
+    os.environ["TELEGRAM_API_URL"] = services["telegram"].url
+    os.environ["THESPORTSDB_API_URL"] = services["thesportsdb"].url + "/api/v1/json"
+    os.environ["OPENAI_API_BASE"] = services["openai"].url + "/v1"
+    # Отдельные базы на каждый запуск: иначе update_id прошлого запуска считаются
+    # повторной доставкой, а сохраненные результаты матчей меняют путь обработки
+    data_dir = tempfile.mkdtemp(prefix="pipeline-benchmark-")
+    os.environ["JOB_STORE_PATH"] = os.path.join(data_dir, "jobs.db")
+    os.environ["RESULTS_DB_PATH"] = os.path.join(data_dir, "results.db")
+
+def run_sync(scenario_text, jobs, concurrency, first_job):
+    """Синхронный режим: webhook Flask обрабатывает задание целиком."""
+    import bot
+
+    def post(job_number):
+        client = bot.app.test_client()
+        started = time.perf_counter()
+        client.post("/" + WEBHOOK_PATH, json=make_update(job_number, scenario_text), headers=webhook_headers())
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(post, range(first_job, first_job + jobs)))
+    return latencies, time.perf_counter() - started
+
+def run_async(scenario_text, jobs, concurrency, first_job):
+    """Асинхронный режим: webhook сразу отвечает, длительность берется из трасс заданий."""
+    import httpx
+    import tracing
+    import async_bot
+
+    async def main():
+        await async_bot.startup()
+        transport = httpx.ASGITransport(app=async_bot.app)
+        limiter = asyncio.Semaphore(concurrency)
+        started = time.perf_counter()
+
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def post(job_number):
+                async with limiter:
+                    await client.post("/" + WEBHOOK_PATH, json=make_update(job_number, scenario_text),
+                                      headers=webhook_headers())
+
+            await asyncio.gather(*(post(n) for n in range(first_job, first_job + jobs)))
+            while async_bot._active_tasks:
+                await asyncio.wait(set(async_bot._active_tasks))
+
+        elapsed = time.perf_counter() - started
+        latencies = []
+        for n in range(first_job, first_job + jobs):
+            trace = tracing.get_trace(f"{100000 + n}_{n}")
+            if trace is not None:
+                latencies.append(trace.duration)
+        await async_bot.shutdown()
+        return latencies, elapsed
+
+    return asyncio.run(main())
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн бенчмарк пути обработки заданий")
+    parser.add_argument("--scenario", choices=list(SCENARIOS) + ["all"], default="all")
+    parser.add_argument("--runtime", choices=["sync", "async"], default="sync")
+    parser.add_argument("--jobs", type=int, default=20, help="Заданий на сценарий")
+    parser.add_argument("--concurrency", type=int, default=4, help="Одновременных webhook запросов")
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--sportsdb-latency", type=float, default=0.1)
+    parser.add_argument("--openai-latency", type=float, default=1.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ошибок TheSportsDB и OpenAI")
+    parser.add_argument("--json", help="Сохранить результаты в JSON файл")
+    parser.add_argument("--baseline", help="JSON файл с результатами для сравнения")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Допустимое ухудшение (доля)")
+    args = parser.parse_args()
+
+    services = fake_services.start_services(
+        telegram_latency=args.telegram_latency,
+        sportsdb_latency=args.sportsdb_latency,
+        openai_latency=args.openai_latency,
+        error_rate=args.error_rate,
+    )
+    configure_environment(services)
+
+    import logging
+    import bot
+    logging.disable(logging.WARNING)
+    bot.RATE_LIMIT_PERIOD = 0
+
+    scenarios = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    run = run_sync if args.runtime == "sync" else run_async
+
+    results = {}
+    first_job = 1
+    print(f"Режим: {args.runtime}, заданий на сценарий: {args.jobs}, параллельно: {args.concurrency}")
+    print(f"{'Сценарий':<14}{'p50, с':>10}{'p95, с':>10}{'p99, с':>10}{'заданий/с':>12}  запросов к API")
+    for name in scenarios:
+        before = {key: service.requests for key, service in services.items()}
+        latencies, elapsed = run(SCENARIOS[name], args.jobs, args.concurrency, first_job)
+        first_job += args.jobs
+        calls = {key: service.requests - before[key] for key, service in services.items()}
+
+        results[name] = {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "jobs_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+            "calls": calls,
+        }
+        r = results[name]
+        calls_text = ", ".join(f"{key}={value}" for key, value in calls.items())
+        print(f"{name:<14}{r['p50']:>10.3f}{r['p95']:>10.3f}{r['p99']:>10.3f}{r['jobs_per_sec']:>12.2f}  {calls_text}")
+
+    for service in services.values():
+        service.stop()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"runtime": args.runtime, "scenarios": results}, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["scenarios"]
+        regressions = []
+        for name, current in results.items():
+            if name not in baseline:
+                continue
+            base = baseline[name]
+            if base["p95"] and current["p95"] > base["p95"] * (1 + args.max_regression):
+                regressions.append(f"{name}: p95 {base['p95']:.3f} -> {current['p95']:.3f} с")
+            if base["jobs_per_sec"] and current["jobs_per_sec"] < base["jobs_per_sec"] * (1 - args.max_regression):
+                regressions.append(f"{name}: {base['jobs_per_sec']:.2f} -> {current['jobs_per_sec']:.2f} заданий/с")
+        if regressions:
+            print("Обнаружено ухудшение производительности:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("Ухудшений относительно базовых результатов нет.")
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,45 @@
+from __future__ import annotations
+
 import os
+import sys
 import logging
 import re
+import math
 import time
 import hashlib
+import itertools
 import secrets
-from datetime import datetime
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
-from telegram import Update, Bot, ReplyKeyboardMarkup, KeyboardButton
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext, Dispatcher
-import requests
-from bs4 import BeautifulSoup
-import openai
+import json
 import web_search
+import hmac
+import metrics
+import tracing
+import structured_logging
+import circuit_breaker
+import concurrency_limit
+import model_router
+import inflight
+import enrichment
+import job_store
+import pipeline
+import scheduler
+import prompts
+import fallback_article
+import update_dedup
 import threading
-from flask import Flask, request, abort
-from telegram.error import TimedOut
+from flask import Flask, request, abort, Response
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO
-)
+# telegram и openai импортируются лениво (см. get_bot, get_dispatcher, get_openai),
+# чтобы запуск воркера и проверки работоспособности не платили за их загрузку
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import CallbackContext
+
+# Настройка логирования (каждая строка помечается идентификатором задания, запись - в отдельном потоке)
+tracing.install_log_record_factory()
+structured_logging.configure()
 logger = logging.getLogger(__name__)
 
 # Загрузка переменных окружения
@@ -37,6 +57,22 @@ if not OPENAI_API_KEY:
 # Генерируем уникальный путь для webhook для дополнительной безопасности
 WEBHOOK_PATH = os.getenv("WEBHOOK_PATH") or secrets.token_hex(16)
 
+# Секретный токен webhook: Telegram передает его в заголовке X-Telegram-Bot-Api-Secret-Token,
+# запросы без него отклоняются до чтения тела. По умолчанию выводится из токена бота
+# и пути webhook, поэтому одинаков во всех воркерах
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN") or hmac.new(
+    TELEGRAM_TOKEN.encode(), WEBHOOK_PATH.encode(), hashlib.sha256
+).hexdigest()
+# Проверять ли секретный токен (false - если webhook устанавливается без него вручную)
+WEBHOOK_VERIFY_SECRET = os.getenv("WEBHOOK_VERIFY_SECRET", "true").lower() == "true"
+# Максимальный размер тела запроса к webhook (байты); обновления Telegram с
+# сообщениями до MAX_INPUT_LENGTH символов значительно меньше
+WEBHOOK_MAX_BODY_SIZE = int(os.getenv("WEBHOOK_MAX_BODY_SIZE", 64 * 1024))
+
+# Адреса внешних API (переопределяются, например, для бенчмарков с локальными заглушками)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE")
+
 PORT = int(os.environ.get('PORT', 5000))
 APP_URL = os.environ.get('APP_URL', 'https://your-app-name.onrender.com')
 
@@ -46,19 +82,117 @@ MAX_MATCHES_ALLOWED = 10  # Максимальное количество мат
 RATE_LIMIT_PERIOD = 60   # Период ограничения в секундах
 MAX_REQUESTS_PER_PERIOD = 5  # Максимальное количество запросов в период
 
-openai.api_key = OPENAI_API_KEY
+# Токен для служебных эндпоинтов (/trace); если не задан, они отключены
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+# Порог количества одновременно обрабатываемых сообщений для /ready
+READY_MAX_INFLIGHT_JOBS = int(os.getenv('READY_MAX_INFLIGHT_JOBS', 50))
+
+# Устанавливать ли webhook автоматически при запуске (один раз на деплой,
+# в мастер-процессе gunicorn - см. gunicorn.conf.py)
+WEBHOOK_AUTO_REGISTER = os.getenv('WEBHOOK_AUTO_REGISTER', 'true').lower() == 'true'
+
+# Режим очереди: webhook только проверяет и ставит обновления в очередь,
+# обработку выполняют отдельные процессы (python bot.py --worker)
+UPDATE_QUEUE_ENABLED = os.getenv('UPDATE_QUEUE_ENABLED', 'false').lower() == 'true'
+# Количество процессов-обработчиков и потоков в каждом из них
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', 2))
+WORKER_THREADS = int(os.getenv('WORKER_THREADS', 4))
+# Пауза между проверками пустой очереди (секунды)
+WORKER_POLL_INTERVAL = 0.2
+
+# Режим long polling для хостов без входящего HTTPS (USE_POLLING=true или python bot.py --polling)
+USE_POLLING = os.getenv('USE_POLLING', 'false').lower() == 'true'
+# Количество обновлений, обрабатываемых одновременно в режиме polling
+POLLING_WORKERS = int(os.getenv('POLLING_WORKERS', 8))
+# Сколько Telegram держит запрос getUpdates без новых обновлений (секунды)
+POLLING_TIMEOUT = int(os.getenv('POLLING_TIMEOUT', 30))
+# Максимальное количество обновлений в ответе getUpdates
+POLLING_BATCH_SIZE = int(os.getenv('POLLING_BATCH_SIZE', 100))
+# Максимальная пауза между повторами getUpdates после ошибок (секунды)
+POLLING_MAX_BACKOFF = 30
+
+# Размер пула HTTP-соединений с Bot API (по умолчанию в python-telegram-bot
+# одно соединение на все потоки)
+TELEGRAM_CON_POOL_SIZE = int(os.getenv('TELEGRAM_CON_POOL_SIZE', max(16, POLLING_WORKERS + 4)))
 
 # Создаем Flask приложение
 app = Flask(__name__)
 
-# Глобальные переменные для телеграм-бота
-bot = Bot(token=TELEGRAM_TOKEN)
+# Глобальные переменные для телеграм-бота (создаются при первом обращении)
+bot = None
 dispatcher = None
+openai = None
+# Блокировка для ленивой инициализации бота и диспетчера
+init_lock = threading.RLock()
+
+# Предохранитель для OpenAI: при серии ошибок сразу используем базовый прогноз
+openai_breaker = circuit_breaker.CircuitBreaker("openai")
+# Адаптивный лимит одновременных запросов к OpenAI (начальное и максимальное значения)
+openai_limiter = concurrency_limit.AdaptiveLimiter(
+    "openai", int(os.getenv('OPENAI_CONCURRENCY', 16)), max_limit=int(os.getenv('OPENAI_MAX_CONCURRENCY', 128))
+)
+# Пока SCHEDULER_SLOTS не задан, слоты планировщика следуют текущему лимиту OpenAI
+scheduler.scheduler.set_slots_function(lambda: openai_limiter.limit)
+
+def get_openai():
+    """Возвращает модуль openai, импортируя и настраивая его при первом обращении."""
+    global openai
+    if openai is None:
+        with init_lock:
+            if openai is None:
+                import openai as openai_module
+                openai_module.api_key = OPENAI_API_KEY
+                if OPENAI_API_BASE:
+                    openai_module.api_base = OPENAI_API_BASE
+                openai = openai_module
+    return openai
+
+def get_bot():
+    """Возвращает экземпляр telegram.Bot, создавая его при первом обращении."""
+    global bot
+    if bot is None:
+        with init_lock:
+            if bot is None:
+                bot = _create_instrumented_bot()
+    return bot
+
+def _create_instrumented_bot():
+    """Создает telegram.Bot, замеряющий длительность запросов к Bot API."""
+    from telegram import Bot
+    from telegram.utils.request import Request
+    
+    class InstrumentedBot(Bot):
+        def _post(self, endpoint, *args, **kwargs):
+            with metrics.TELEGRAM_REQUEST_DURATION.time(method=endpoint), tracing.span("telegram", method=endpoint):
+                return super()._post(endpoint, *args, **kwargs)
+    
+    return InstrumentedBot(token=TELEGRAM_TOKEN, base_url=f"{TELEGRAM_API_URL}/bot",
+                           request=Request(con_pool_size=TELEGRAM_CON_POOL_SIZE))
+
+def get_dispatcher():
+    """Возвращает диспетчер с зарегистрированными обработчиками, создавая его при первом обращении."""
+    if dispatcher is None:
+        setup_bot()
+    return dispatcher
 
-# Словарь для отслеживания обрабатываемых сообщений, чтобы избежать дублирования
-processing_messages = {}
-# Механизм блокировки для безопасной работы с processing_messages
-message_lock = threading.Lock()
+# Обрабатываемые сообщения, чтобы избежать дублирования (устаревшие записи истекают, см. inflight)
+processing_messages = inflight.InflightMessages()
+
+metrics.INFLIGHT_JOBS.set_function(lambda: len(processing_messages))
+enrichment.set_load_function(lambda: len(processing_messages))
+
+# Задания пользователей в этом процессе: {user_id: {'jobs': множество job_id,
+# 'waiting': job_id ожидающего запроса, 'results': {ключ матча: прогноз}}}
+user_jobs = {}
+# Задания, отмененные в этом процессе (дополнительно к статусу в хранилище заданий)
+canceled_jobs = set()
+user_jobs_condition = threading.Condition()
+if UPDATE_QUEUE_ENABLED:
+    metrics.QUEUED_UPDATES.set_function(lambda: job_store.store.queued_updates())
+
+# Недавно полученные update_id: повторная доставка обновления не обрабатывается
+recent_updates = update_dedup.RecentUpdates()
 
 # Защита от спама и DoS атак
 user_requests = {}
@@ -77,6 +211,7 @@ def is_rate_limited(user_id):
         
         # Проверяем лимит
         if len(user_requests[user_id]) >= MAX_REQUESTS_PER_PERIOD:
+            metrics.RATE_LIMITED.inc()
             return True
         
         # Добавляем новый запрос
@@ -96,53 +231,8 @@ def sanitize_input(text):
     sanitized = re.sub(r'[\x00-\x1F\x7F]', '', text)
     return sanitized
 
-def setup_bot():
-    """Настройка и запуск бота."""
-    global dispatcher
-    
-    # Создаем диспетчер если он еще не создан
-    if dispatcher is None:
-        # Создаем диспетчер
-        dispatcher = Dispatcher(bot, None, workers=0)
-        
-        # Регистрируем обработчики команд
-        dispatcher.add_handler(CommandHandler("start", start))
-        dispatcher.add_handler(CommandHandler("help", help_command))
-        dispatcher.add_handler(CommandHandler("menu", setup_menu))
-        dispatcher.add_handler(CommandHandler("example", example_command))
-        dispatcher.add_handler(CommandHandler("cancel", cancel_processing))
-        
-        # Обработчик обычных сообщений и текстовых кнопок
-        text_handler = MessageHandler(Filters.text & ~Filters.command, process_text_or_buttons)
-        dispatcher.add_handler(text_handler)
-    
-    # Устанавливаем webhook
-    webhook_url = f"{APP_URL}/{WEBHOOK_PATH}"
-    logger.info(f"Запуск бота в режиме webhook на {webhook_url}...")
-    try:
-        bot.set_webhook(webhook_url)
-        logger.info(f"Вебхук установлен на {webhook_url}")
-    except TimedOut:
-        logger.warning("Не удалось установить вебхук автоматически из-за таймаута. "
-                      f"Пожалуйста, установите его вручную, перейдя по ссылке: {APP_URL}/set_webhook")
-    except Exception as e:
-        logger.error(f"Произошла ошибка при установке вебхука: {e}")
-
-def setup_menu(update: Update, context: CallbackContext) -> None:
-    """Создает меню с кнопками команд."""
-    keyboard = [
-        [KeyboardButton("/start"), KeyboardButton("/help")],
-        [KeyboardButton("/example"), KeyboardButton("/cancel")]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    update.message.reply_text(
-        "Меню команд бота:",
-        reply_markup=reply_markup
-    )
-
-def example_command(update: Update, context: CallbackContext) -> None:
-    """Отправляет пример запроса для прогноза."""
-    example_text = """
+# Тексты ответов бота (общие для синхронного и асинхронного режимов)
+EXAMPLE_TEXT = """
 *Примеры запросов для прогноза:*
 
 Простой запрос:
@@ -165,12 +255,8 @@ def example_command(update: Update, context: CallbackContext) -> None:
 
 Скопируйте пример и отредактируйте под свои нужды.
     """
-    update.message.reply_text(example_text, parse_mode='Markdown')
 
-def start(update: Update, context: CallbackContext) -> None:
-    """Отправляет приветственное сообщение при команде /start."""
-    user_first_name = update.effective_user.first_name
-    welcome_text = f"""
+WELCOME_TEXT_TEMPLATE = """
 👋 Привет, {user_first_name}!
 
 🏆 Я бот для создания профессиональных прогнозов на спортивные матчи.
@@ -201,19 +287,8 @@ def start(update: Update, context: CallbackContext) -> None:
 
 📋 Отправь /help для подробной инструкции.
     """
-    
-    # Добавляем меню с кнопками
-    keyboard = [
-        [KeyboardButton("/help"), KeyboardButton("/example")],
-        [KeyboardButton("Контакты"), KeyboardButton("/cancel")]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    
-    update.message.reply_text(welcome_text, parse_mode='Markdown', reply_markup=reply_markup)
 
-def help_command(update: Update, context: CallbackContext) -> None:
-    """Отправляет помощь при команде /help."""
-    help_text = """
+HELP_TEXT = """
 🤖 *Инструкция по использованию бота*
 
 Этот бот создаёт профессиональные прогнозы на спортивные матчи. Вот как им пользоваться:
@@ -259,45 +334,275 @@ def help_command(update: Update, context: CallbackContext) -> None:
 /menu - Показать меню кнопок
 /cancel - Отменить текущую обработку матчей
     """
+
+CONTACT_TEXT = """
+*Контактная информация:*
+
+Разработчик: @ainishanov
+
+По всем вопросам обращайтесь к разработчику.
+            """
+
+FORMAT_ERROR_TEXT = (
+    "❌ Неверный формат сообщения!\n\n"
+    "Пожалуйста, используйте формат:\n"
+    "```\nна [дата] (не позднее [дедлайн])\n\n"
+    "1. [Команда1] - [Команда2]                [Турнир] ([мин_символов])\n```\n\n"
+    "Отправьте /help для подробной инструкции."
+)
+
+PARSE_ERROR_TEXT = (
+    "❌ Не удалось обработать данные о матчах.\n\n"
+    "Пожалуйста, проверьте формат сообщения:\n"
+    "- Между командами и турниром должно быть 16 пробелов\n"
+    "- Формат даты должен быть правильным\n"
+    "- Каждый матч должен быть на новой строке\n\n"
+    "Отправьте /help для подробной инструкции."
+)
+
+SIMPLE_FORMAT_ERROR_TEXT = (
+    "❌ Не удалось найти матчи в вашем сообщении.\n\n"
+    "Пожалуйста, укажите матчи в формате:\n"
+    "```\nна [дата]\nКоманда1 - Команда2\nКоманда3 - Команда4\n```\n\n"
+    "Или просто:\n"
+    "```\nКоманда1 - Команда2\n```\n\n"
+    "Отправьте /help для подробной инструкции."
+)
+
+RATE_LIMIT_TEXT = "⚠️ Вы отправляете слишком много запросов. Пожалуйста, подождите немного и попробуйте снова."
+EMPTY_MESSAGE_TEXT = "⚠️ Получено пустое сообщение. Пожалуйста, отправьте текст запроса."
+DUPLICATE_MESSAGE_TEXT = "⚠️ Это сообщение уже обрабатывается. Пожалуйста, дождитесь завершения."
+CANCELED_TEXT = "🛑 Обработка ваших запросов отменена. Вы можете отправить новый запрос."
+NOTHING_TO_CANCEL_TEXT = "ℹ️ В данный момент нет активных запросов для отмены."
+RESUME_TEXT = "🔄 Бот был перезапущен. Продолжаю обработку вашего запроса с места остановки..."
+SUPERSEDED_TEXT = "🔁 Предыдущий запрос отменен, обрабатываю новый. Готовые прогнозы совпадающих матчей будут использованы повторно."
+JOB_QUEUED_TEXT = "⏳ Предыдущий запрос еще обрабатывается. Этот запрос будет обработан после него."
+JOB_REPLACED_TEXT = "↪️ Запрос заменен более новым и не будет обработан."
+
+# Раскладки клавиатур (подписи кнопок по строкам)
+MENU_KEYBOARD = [["/start", "/help"], ["/example", "/cancel"]]
+START_KEYBOARD = [["/help", "/example"], ["Контакты", "/cancel"]]
+HELP_KEYBOARD = [["/start", "/example"], ["Контакты", "/cancel"]]
+
+# Максимальная длина одного сообщения Telegram (с запасом)
+MAX_MESSAGE_LENGTH = 4000
+
+# Параметры запроса к OpenAI (модель и max_tokens выбираются в model_router)
+OPENAI_TEMPERATURE = 0.7
+
+# Период поиска брошенных заданий для возобновления (секунды)
+JOB_RECOVERY_INTERVAL = 60
+
+# Что делать с незавершенными заданиями пользователя при новом запросе:
+# replace - отменить их (готовые прогнозы совпадающих матчей используются повторно),
+# queue - выполнить новый запрос после них (из ожидающих остается только последний),
+# parallel - выполнять одновременно
+USER_JOB_POLICY = os.getenv('USER_JOB_POLICY', 'replace').lower()
+
+# Доставка прогнозов задания одним файлом вместо сообщений: auto (если ожидаемый
+# объем прогнозов больше DOCUMENT_THRESHOLD символов), always или never
+DOCUMENT_DELIVERY = os.getenv('DOCUMENT_DELIVERY', 'auto').lower()
+DOCUMENT_THRESHOLD = int(os.getenv('DOCUMENT_THRESHOLD', 3 * MAX_MESSAGE_LENGTH))
+# Формат файла с прогнозами: md или html
+DOCUMENT_FORMAT = os.getenv('DOCUMENT_FORMAT', 'md').lower()
+
+def build_keyboard(layout):
+    """Создает клавиатуру Telegram из раскладки подписей кнопок."""
+    from telegram import ReplyKeyboardMarkup, KeyboardButton
+    
+    keyboard = [[KeyboardButton(label) for label in row] for row in layout]
+    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+def split_message(message):
+    """Разбивает длинное сообщение на части, допустимые для Telegram."""
+    if len(message) <= MAX_MESSAGE_LENGTH:
+        return [message]
+    
+    parts = [message[i:i+MAX_MESSAGE_LENGTH] for i in range(0, len(message), MAX_MESSAGE_LENGTH)]
+    return [part if i == 0 else f"... {part}" for i, part in enumerate(parts)]
+
+def send_long_message(update: Update, message):
+    """Отправляет сообщение, при необходимости разбивая его на части."""
+    for part in split_message(message):
+        update.message.reply_text(part, parse_mode='Markdown')
+
+def setup_bot():
+    """Создает диспетчер и регистрирует обработчики (без сетевых запросов)."""
+    global dispatcher
+    
+    # Создаем диспетчер если он еще не создан
+    with init_lock:
+        if dispatcher is not None:
+            return
+        
+        from telegram.ext import CommandHandler, MessageHandler, Filters, Dispatcher
+        
+        # Создаем диспетчер
+        new_dispatcher = Dispatcher(get_bot(), None, workers=0)
+        
+        # Регистрируем обработчики команд
+        new_dispatcher.add_handler(CommandHandler("start", start))
+        new_dispatcher.add_handler(CommandHandler("help", help_command))
+        new_dispatcher.add_handler(CommandHandler("menu", setup_menu))
+        new_dispatcher.add_handler(CommandHandler("example", example_command))
+        new_dispatcher.add_handler(CommandHandler("cancel", cancel_processing))
+        
+        # Обработчик обычных сообщений и текстовых кнопок
+        text_handler = MessageHandler(Filters.text & ~Filters.command, process_text_or_buttons)
+        new_dispatcher.add_handler(text_handler)
+        
+        dispatcher = new_dispatcher
+
+def get_webhook_url():
+    """Полный URL webhook для текущего деплоя."""
+    return f"{APP_URL}/{WEBHOOK_PATH}"
+
+def webhook_secret_kwargs():
+    """Параметры setWebhook для секретного токена (пусто, если проверка отключена)."""
+    return {'secret_token': WEBHOOK_SECRET_TOKEN} if WEBHOOK_VERIFY_SECRET else {}
+
+def webhook_rejection(secret_token, content_type, content_length):
+    """
+    Быстрая проверка запроса к webhook по заголовкам, до чтения и разбора тела.
+    
+    Args:
+        secret_token: Значение заголовка X-Telegram-Bot-Api-Secret-Token
+        content_type: Значение заголовка Content-Type
+        content_length: Размер тела из Content-Length (None, если не указан)
+    
+    Returns:
+        tuple: (HTTP статус, причина) или None, если запрос можно обрабатывать
+    """
+    if WEBHOOK_VERIFY_SECRET and not hmac.compare_digest((secret_token or '').encode(), WEBHOOK_SECRET_TOKEN.encode()):
+        return 403, 'secret'
+    if not (content_type or '').lower().startswith('application/json'):
+        return 415, 'content_type'
+    if content_length is None or content_length > WEBHOOK_MAX_BODY_SIZE:
+        return 413, 'size'
+    return None
+
+def register_webhook():
+    """
+    Устанавливает webhook, если он еще не указывает на текущий URL.
+    
+    Вызывается один раз на деплой (мастер-процесс gunicorn, `python bot.py --set-webhook`),
+    а не при загрузке каждого воркера. Использует отдельный экземпляр Bot, чтобы
+    соединения не наследовались воркерами после fork. С проверкой секретного
+    токена webhook устанавливается всегда: getWebhookInfo не сообщает, с каким
+    токеном он был установлен.
+    
+    Returns:
+        bool: True, если webhook установлен (или уже был установлен)
+    """
+    from telegram import Bot
+    from telegram.error import TimedOut
+    
+    webhook_url = get_webhook_url()
+    registration_bot = Bot(token=TELEGRAM_TOKEN, base_url=f"{TELEGRAM_API_URL}/bot")
+    try:
+        info = registration_bot.get_webhook_info()
+        if info.url == webhook_url and not WEBHOOK_VERIFY_SECRET:
+            logger.info(f"Вебхук уже установлен на {webhook_url}, повторная установка не требуется")
+            return True
+        
+        logger.info(f"Запуск бота в режиме webhook на {webhook_url}...")
+        registration_bot.set_webhook(webhook_url, **webhook_secret_kwargs())
+        logger.info(f"Вебхук установлен на {webhook_url}")
+        return True
+    except TimedOut:
+        logger.warning("Не удалось установить вебхук автоматически из-за таймаута. "
+                      f"Пожалуйста, установите его вручную, перейдя по ссылке: {APP_URL}/set_webhook")
+    except Exception as e:
+        logger.error(f"Произошла ошибка при установке вебхука: {e}")
+    return False
+
+def setup_menu(update: Update, context: CallbackContext) -> None:
+    """Создает меню с кнопками команд."""
+    update.message.reply_text(
+        "Меню команд бота:",
+        reply_markup=build_keyboard(MENU_KEYBOARD)
+    )
+
+def example_command(update: Update, context: CallbackContext) -> None:
+    """Отправляет пример запроса для прогноза."""
+    update.message.reply_text(EXAMPLE_TEXT, parse_mode='Markdown')
+
+def start(update: Update, context: CallbackContext) -> None:
+    """Отправляет приветственное сообщение при команде /start."""
+    user_first_name = update.effective_user.first_name
+    welcome_text = WELCOME_TEXT_TEMPLATE.format(user_first_name=user_first_name)
     
     # Добавляем меню с кнопками
-    keyboard = [
-        [KeyboardButton("/start"), KeyboardButton("/example")],
-        [KeyboardButton("Контакты"), KeyboardButton("/cancel")]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    reply_markup = build_keyboard(START_KEYBOARD)
+    
+    update.message.reply_text(welcome_text, parse_mode='Markdown', reply_markup=reply_markup)
+
+def help_command(update: Update, context: CallbackContext) -> None:
+    """Отправляет помощь при команде /help."""
+    # Добавляем меню с кнопками
+    reply_markup = build_keyboard(HELP_KEYBOARD)
     
-    update.message.reply_text(help_text, parse_mode='Markdown', reply_markup=reply_markup)
+    update.message.reply_text(HELP_TEXT, parse_mode='Markdown', reply_markup=reply_markup)
+
+def cancel_user_messages(user_id):
+    """Удаляет все обрабатываемые сообщения пользователя. Возвращает True, если что-то отменено."""
+    canceled = False
+    
+    if processing_messages.cancel_user(user_id):
+        canceled = True
+    
+    with user_jobs_condition:
+        state = user_jobs.get(user_id)
+        if state and (state['jobs'] or state['waiting']):
+            canceled_jobs.update(state['jobs'])
+            state['waiting'] = None
+            user_jobs_condition.notify_all()
+            canceled = True
+    
+    # Отмененные задания не продолжаются и не возобновляются после перезапуска
+    if job_store.store.cancel_user_jobs(user_id):
+        canceled = True
+    
+    return canceled
 
 def cancel_processing(update: Update, context: CallbackContext) -> None:
     """Отменяет обработку текущих сообщений пользователя."""
     user_id = update.effective_user.id
-    canceled = False
-    
-    with message_lock:
-        keys_to_delete = []
-        for key in processing_messages.keys():
-            if key.startswith(f"{user_id}_"):
-                keys_to_delete.append(key)
-                canceled = True
-        
-        for key in keys_to_delete:
-            del processing_messages[key]
+    canceled = cancel_user_messages(user_id)
     
     if canceled:
         logger.info(f"Пользователь {user_id} отменил обработку своих сообщений.")
-        update.message.reply_text("🛑 Обработка ваших запросов отменена. Вы можете отправить новый запрос.")
+        update.message.reply_text(CANCELED_TEXT)
     else:
-        update.message.reply_text("ℹ️ В данный момент нет активных запросов для отмены.")
+        update.message.reply_text(NOTHING_TO_CANCEL_TEXT)
+
+def extract_max_matches(text):
+    """Определяет ограничение на количество статей (например, "5 статей")."""
+    max_matches_pattern = r'(\d+)\s+стат(ей|ьи)'  # Например, "5 статей" или "10 статей"
+    max_matches = 5  # По умолчанию ограничение - 5 матчей
+    
+    max_matches_match = re.search(max_matches_pattern, text, re.IGNORECASE)
+    if max_matches_match:
+        max_matches = int(max_matches_match.group(1))
+        logger.info(f"Установлено ограничение на количество статей: {max_matches}")
+    
+    return max_matches
 
-def parse_match_text(text):
-    """Парсит текст сообщения с матчами и возвращает структурированные данные."""
+def parse_match_text(text, limit=True):
+    """
+    Парсит текст сообщения с матчами и возвращает структурированные данные.
+    
+    Args:
+        text: Текст в формате "@Get articles"
+        limit: Ограничивать количество матчей (5 или "N статей" из текста); без
+            ограничения разбирается весь файл (пакетная генерация)
+    """
     try:
         # Проверка на ограничение количества статей в сообщении
         max_matches_pattern = r'(\d+)\s+стат(ей|ьи)'  # Например, "5 статей" или "10 статей"
-        max_matches = 5  # По умолчанию ограничение - 5 матчей
+        max_matches = 5 if limit else math.inf  # По умолчанию ограничение - 5 матчей
         
-        max_matches_match = re.search(max_matches_pattern, text, re.IGNORECASE)
+        max_matches_match = re.search(max_matches_pattern, text, re.IGNORECASE) if limit else None
         if max_matches_match:
             max_matches = int(max_matches_match.group(1))
             logger.info(f"Установлено ограничение на количество статей в parse_match_text: {max_matches}")
@@ -380,184 +685,317 @@ def parse_match_text(text):
         logger.error(f"Ошибка при парсинге текста: {e}")
         return []
 
-def search_match_info(match):
-    """Поиск информации о матче в интернете."""
+def split_teams(teams_text):
+    """Разделяет строку "Команда1 - Команда2" на названия команд."""
+    teams = teams_text.split(' - ')
+    return teams[0].strip(), teams[1].strip()
+
+def placeholder_tournament_matches(tournament):
+    """Базовая информация о матчах турнира, если поиск ничего не нашел."""
+    # Создаем базовую информацию для 3 матчей
+    return [
+        {
+            'team1': f"Команда A {tournament}",
+            'team2': f"Команда B {tournament}",
+            'tournament': tournament
+        },
+        {
+            'team1': f"Команда C {tournament}",
+            'team2': f"Команда D {tournament}",
+            'tournament': tournament
+        },
+        {
+            'team1': f"Команда E {tournament}",
+            'team2': f"Команда F {tournament}",
+            'tournament': tournament
+        }
+    ]
+
+def placeholder_teams_info(team1, team2):
+    """Заполнители данных о командах, если их не удалось получить."""
+    team1_info = {
+        'last_matches': f"Последние матчи {team1} были впечатляющими. Команда показала стабильную игру, одержав несколько важных побед.",
+        'lineup': f"Основной состав {team1} укомплектован сильными игроками во всех линиях. Тренер может рассчитывать на всех лидеров команды."
+    }
+    team2_info = {
+        'last_matches': f"В последних играх {team2} демонстрировал хорошую форму, хотя и были некоторые неудачные матчи. Команда стремится улучшить свои результаты.",
+        'lineup': f"Состав {team2} имеет несколько ключевых игроков, на которых возлагаются большие надежды. Тренерский штаб готовит команду к важным матчам."
+    }
+    return team1_info, team2_info
+
+def build_match_info(match, team1, team2, team1_info, team2_info):
+    """Собирает данные о матче для генерации прогноза."""
+    return {
+        'team1': team1,
+        'team2': team2,
+        'tournament': match['tournament'],
+        'last_matches_team1': team1_info['last_matches'],
+        'last_matches_team2': team2_info['last_matches'],
+        'lineup_team1': team1_info['lineup'],
+        'lineup_team2': team2_info['lineup'],
+        'form_team1': team1_info.get('form'),
+        'form_team2': team2_info.get('form'),
+        'head_to_head': web_search.get_head_to_head(team1_info.get('team_id'), team2_info.get('team_id'), team1)
+    }
+
+def fallback_match_info(match):
+    """Базовые данные о матче на случай ошибки при поиске информации."""
+    if match.get('is_all_matches', False):
+        return [
+            {
+                'team1': "Команда 1",
+                'team2': "Команда 2",
+                'tournament': match.get('tournament', "Неизвестный турнир")
+            },
+            {
+                'team1': "Команда 3",
+                'team2': "Команда 4", 
+                'tournament': match.get('tournament', "Неизвестный турнир")
+            }
+        ]
+    
+    team1, team2 = split_teams(match.get('teams', "Команда A - Команда B"))
+    return {
+        'team1': team1,
+        'team2': team2,
+        'tournament': match.get('tournament', "Неизвестный турнир"),
+        'last_matches_team1': f"{team1} показывает стабильную игру в этом сезоне. Команда демонстрирует хорошую форму и готова к новым победам.",
+        'last_matches_team2': f"{team2} имеет свои взлеты и падения в последних играх, но стремится к улучшению результатов.",
+        'lineup_team1': f"Состав {team1} полностью укомплектован. Все ключевые игроки готовы к матчу.",
+        'lineup_team2': f"В составе {team2} есть несколько звездных игроков, которые могут решить исход матча."
+    }
+
+def search_match_info(match, profile=enrichment.FULL):
+    """
+    Поиск информации о матче в интернете.
+
+    Args:
+        match: Матч из запроса в формате "@Get articles"
+        profile: Профиль сбора информации (см. enrichment)
+    """
+    with tracing.span("search_match_info", number=match.get('number', ''), profile=profile):
+        return _search_match_info(match, profile)
+
+def _search_match_info(match, profile):
     try:
         if match['is_all_matches']:
+            if profile == enrichment.NONE:
+                return placeholder_tournament_matches(match['tournament'])
             # Ищем все матчи турнира на указанную дату
             date_str = match.get('date', '21 марта')  # По умолчанию используем '21 марта'
             matches = web_search.search_matches_for_tournament(match['tournament'], date_str)
             # Если матчи не найдены, создаем базовую информацию
             if not matches:
-                # Создаем базовую информацию для 3 матчей
-                return [
-                    {
-                        'team1': f"Команда A {match['tournament']}",
-                        'team2': f"Команда B {match['tournament']}",
-                        'tournament': match['tournament']
-                    },
-                    {
-                        'team1': f"Команда C {match['tournament']}",
-                        'team2': f"Команда D {match['tournament']}",
-                        'tournament': match['tournament']
-                    },
-                    {
-                        'team1': f"Команда E {match['tournament']}",
-                        'team2': f"Команда F {match['tournament']}",
-                        'tournament': match['tournament']
-                    }
-                ]
+                return placeholder_tournament_matches(match['tournament'])
             return matches
         else:
-            teams = match['teams'].split(' - ')
-            team1 = teams[0].strip()
-            team2 = teams[1].strip()
-            
-            # Получаем информацию о командах
-            try:
-                team1_info = web_search.get_team_info(team1)
-                team2_info = web_search.get_team_info(team2)
-            except Exception as e:
-                logger.warning(f"Не удалось получить данные о командах: {e}. Создаю заполнители.")
-                # Если не удалось получить данные, создаем заполнители
-                team1_info = {
-                    'last_matches': f"Последние матчи {team1} были впечатляющими. Команда показала стабильную игру, одержав несколько важных побед.",
-                    'lineup': f"Основной состав {team1} укомплектован сильными игроками во всех линиях. Тренер может рассчитывать на всех лидеров команды."
-                }
-                team2_info = {
-                    'last_matches': f"В последних играх {team2} демонстрировал хорошую форму, хотя и были некоторые неудачные матчи. Команда стремится улучшить свои результаты.",
-                    'lineup': f"Состав {team2} имеет несколько ключевых игроков, на которых возлагаются большие надежды. Тренерский штаб готовит команду к важным матчам."
-                }
-            
-            return {
-                'team1': team1,
-                'team2': team2,
-                'tournament': match['tournament'],
-                'last_matches_team1': team1_info['last_matches'],
-                'last_matches_team2': team2_info['last_matches'],
-                'lineup_team1': team1_info['lineup'],
-                'lineup_team2': team2_info['lineup']
-            }
+            team1, team2 = split_teams(match['teams'])
+            return collect_match_info(match, team1, team2, profile)
     except Exception as e:
         logger.error(f"Ошибка при поиске информации о матче: {e}")
         # Не возвращаем None, а создаем базовые данные
-        if match.get('is_all_matches', False):
-            return [
-                {
-                    'team1': "Команда 1",
-                    'team2': "Команда 2",
-                    'tournament': match.get('tournament', "Неизвестный турнир")
-                },
-                {
-                    'team1': "Команда 3",
-                    'team2': "Команда 4", 
-                    'tournament': match.get('tournament', "Неизвестный турнир")
-                }
-            ]
-        else:
-            teams = match.get('teams', "Команда A - Команда B").split(' - ')
-            team1 = teams[0].strip()
-            team2 = teams[1].strip()
-            return {
-                'team1': team1,
-                'team2': team2,
-                'tournament': match.get('tournament', "Неизвестный турнир"),
-                'last_matches_team1': f"{team1} показывает стабильную игру в этом сезоне. Команда демонстрирует хорошую форму и готова к новым победам.",
-                'last_matches_team2': f"{team2} имеет свои взлеты и падения в последних играх, но стремится к улучшению результатов.",
-                'lineup_team1': f"Состав {team1} полностью укомплектован. Все ключевые игроки готовы к матчу.",
-                'lineup_team2': f"В составе {team2} есть несколько звездных игроков, которые могут решить исход матча."
-            }
+        return fallback_match_info(match)
+
+def collect_match_info(match, team1, team2, profile):
+    """Данные о матче двух команд в объеме профиля сбора информации (см. enrichment)."""
+    if not enrichment.uses_api(profile):
+        return build_local_match_info(team1, team2, match['tournament'], use_results=profile == enrichment.CACHED)
+    
+    # Получаем информацию о командах
+    try:
+        include_players = profile == enrichment.FULL
+        team1_info = web_search.get_team_info(team1, include_players)
+        team2_info = web_search.get_team_info(team2, include_players)
+    except Exception as e:
+        logger.warning(f"Не удалось получить данные о командах: {e}. Создаю заполнители.")
+        # Если не удалось получить данные, создаем заполнители
+        team1_info, team2_info = placeholder_teams_info(team1, team2)
+    
+    return build_match_info(match, team1, team2, team1_info, team2_info)
+
+def build_prediction_prompts(match, min_symbols):
+    """Формирует системный и пользовательский промпты для прогноза на матч (см. prompts.build_prompts)."""
+    return prompts.build_prompts(match, min_symbols)
+
+def build_openai_request(match, min_symbols, model=None, timeout=None):
+    """
+    Формирует параметры запроса ChatCompletion для прогноза на матч.
+
+    Args:
+        match: Информация о матче
+        min_symbols: Требуемый объем прогноза (от него зависит max_tokens)
+        model: Модель OpenAI (по умолчанию - первая из model_router.OPENAI_MODELS)
+        timeout: Таймаут запроса (секунды)
+    """
+    system_prompt, user_prompt = build_prediction_prompts(match, min_symbols)
+    openai_request = {
+        'model': model or model_router.OPENAI_MODELS[0],
+        'messages': [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        'max_tokens': model_router.max_tokens(min_symbols),
+        'n': 1,
+        'stop': None,
+        'temperature': OPENAI_TEMPERATURE,
+    }
+    if timeout is not None:
+        openai_request['request_timeout'] = timeout
+    return openai_request
+
+def build_basic_prediction(match_info, min_symbols):
+    """
+    Создает базовый прогноз на случай, если OpenAI недоступен (см. fallback_article).
+
+    Для списка матчей (из "Все X матчей") возвращает список прогнозов.
+    """
+    if isinstance(match_info, list):
+        return [fallback_article.build_article(match, min_symbols) for match in match_info]
+    if not isinstance(match_info, dict):
+        match_info = {}
+    return fallback_article.build_article(match_info, min_symbols)
+
+def create_chat_completion(openai_request, deadline=None, timing=None):
+    """
+    Выполняет запрос ChatCompletion с учетом метрик и предохранителя.
+
+    Таймаут запроса отсчитывается от deadline после получения слота
+    openai_limiter, так что ожидание слота входит во время на прогноз.
+
+    Args:
+        openai_request: Параметры запроса
+        deadline: Момент (time.monotonic()), к которому нужен ответ
+        timing: Словарь, в который записывается длительность самого запроса ('seconds')
+
+    Raises:
+        circuit_breaker.CircuitOpenError: если OpenAI временно считается недоступным
+        model_router.DeadlineExceeded: если после ожидания слота времени на попытку не осталось
+    """
+    prompt_tokens = record_prompt_tokens(openai_request)
+    with tracing.span("openai", model=openai_request['model'], prompt_tokens=prompt_tokens), openai_limiter.slot():
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining < model_router.OPENAI_MIN_ATTEMPT_TIMEOUT:
+                raise model_router.DeadlineExceeded(f"Осталось {remaining:.1f} с после ожидания слота OpenAI")
+            openai_request['request_timeout'] = remaining
+        # Проверяется после ожидания слота: пробный запрос полуоткрытого предохранителя должен выполниться
+        if not openai_breaker.allow():
+            raise circuit_breaker.CircuitOpenError("OpenAI временно недоступен")
+
+        started = time.perf_counter()
+        try:
+            response = get_openai().ChatCompletion.create(**openai_request)
+        except Exception as e:
+            if is_openai_overload(e):
+                openai_limiter.record_overload()
+            openai_breaker.record_failure()
+            metrics.OPENAI_REQUEST_DURATION.observe(time.perf_counter() - started, model=openai_request['model'], outcome="error")
+            raise
+        finally:
+            if timing is not None:
+                timing['seconds'] = time.perf_counter() - started
+    
+    openai_breaker.record_success()
+    metrics.OPENAI_REQUEST_DURATION.observe(time.perf_counter() - started, model=openai_request['model'], outcome="ok")
+    record_token_usage(response, openai_request['model'])
+    return response
+
+def is_openai_timeout(error):
+    """Истек ли таймаут запроса к OpenAI (request_timeout)."""
+    # Ошибки openai возможны только после его импорта
+    return openai is not None and isinstance(error, openai.error.Timeout)
+
+def completion_tokens(response, min_symbols):
+    """Объем ответа OpenAI в токенах (по usage, иначе ожидаемый объем прогноза)."""
+    usage = response.get('usage') if hasattr(response, 'get') else None
+    if usage and usage.get('completion_tokens'):
+        return usage['completion_tokens']
+    return model_router.expected_tokens(min_symbols)
+
+def request_prediction(match, min_symbols):
+    """
+    Запрашивает прогноз на один матч у модели, выбранной model_router.
+
+    Если таймаут попытки истек, прогноз запрашивается у более быстрой модели;
+    если время на прогноз (OPENAI_DEADLINE) закончилось, возвращается запасная
+    статья. Остальные ошибки OpenAI передаются вызывающему коду.
+
+    Returns:
+        dict: Прогноз {'teams': ..., 'prediction': ...}
+    """
+    router = model_router.router
+    deadline = time.monotonic() + router.deadline
+    model = router.choose(min_symbols, router.deadline)
+    while model is not None:
+        timing = {}
+        with tracing.span("route", model=model, timeout=round(deadline - time.monotonic(), 1)) as span:
+            try:
+                response = create_chat_completion(build_openai_request(match, min_symbols, model), deadline, timing)
+            except model_router.DeadlineExceeded:
+                if span is not None:
+                    span.attrs['outcome'] = model_router.OUTCOME_FALLBACK
+                break
+            except Exception as e:
+                if not is_openai_timeout(e):
+                    router.record(model, timing.get('seconds', 0.0), 0, model_router.OUTCOME_ERROR)
+                    raise
+                router.record(model, timing['seconds'], model_router.expected_tokens(min_symbols), model_router.OUTCOME_TIMEOUT)
+                logger.warning(f"Таймаут модели {model} для матча {match['team1']} - {match['team2']}")
+                if span is not None:
+                    span.attrs['outcome'] = model_router.OUTCOME_TIMEOUT
+                model = router.choose(min_symbols, deadline - time.monotonic(), after=model)
+                continue
+            router.record(model, timing['seconds'], completion_tokens(response, min_symbols), model_router.OUTCOME_OK)
+            if span is not None:
+                span.attrs['outcome'] = model_router.OUTCOME_OK
+        return {
+            'teams': f"{match['team1']} - {match['team2']}",
+            'prediction': response.choices[0].message['content'].strip()
+        }
+
+    router.record_fallback()
+    logger.warning(f"Время на прогноз для матча {match['team1']} - {match['team2']} истекло, используется запасная статья")
+    return fallback_article.build_article(match, min_symbols)
+
+def is_openai_overload(error):
+    """
+    Означает ли ошибка OpenAI перегрузку: таймаут, ответ 429 или 5xx
+    (лимит одновременных запросов снижается).
+    """
+    if is_openai_timeout(error):
+        return True
+    # Код ответа есть у всех ошибок API openai (openai.error.OpenAIError.http_status)
+    status = getattr(error, 'http_status', None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+def record_prompt_tokens(openai_request):
+    """Учитывает размер промпта запроса в метриках. Возвращает количество токенов."""
+    prompt_tokens = prompts.count_tokens(openai_request['messages'], openai_request['model'])
+    metrics.OPENAI_PROMPT_TOKENS.observe(prompt_tokens, model=openai_request['model'])
+    return prompt_tokens
+
+def record_token_usage(response, model):
+    """Учитывает фактический расход токенов из ответа OpenAI (поле usage), если он есть."""
+    usage = response.get('usage') if hasattr(response, 'get') else None
+    if not usage:
+        return
+    for token_type in ('prompt_tokens', 'completion_tokens'):
+        if usage.get(token_type) is not None:
+            metrics.OPENAI_TOKENS.inc(usage[token_type], model=model, type=token_type)
 
 def generate_match_prediction(match_info, min_symbols):
     """Генерирует прогноз на матч с использованием OpenAI API (ChatCompletion)."""
+    with tracing.span("generate_match_prediction", min_symbols=min_symbols):
+        return _generate_match_prediction(match_info, min_symbols)
+
+def _generate_match_prediction(match_info, min_symbols):
     try:
         if isinstance(match_info, list):
             # Для "Все X матчей"
-            predictions = []
-            for match in match_info:
-                system_prompt = """Ты - опытный спортивный аналитик, создающий прогнозы на футбольные матчи.
-                Твоя задача - создать детальный, интересный прогноз на матч, не упоминая о недостатке информации.
-                Пиши так, как будто ты обладаешь всеми необходимыми данными.
-                Используй профессиональную футбольную терминологию, упоминай возможные тактики, стратегии и ключевых игроков команд.
-                Всегда завершай прогноз конкретным предсказанием результата (победа одной из команд или ничья).
-                """
-                
-                user_prompt = f"""
-                Напиши оригинальный, профессиональный прогноз на футбольный матч между командами {match['team1']} и {match['team2']} 
-                в рамках турнира {match['tournament']}. 
-                
-                Прогноз должен быть подробным, увлекательным и содержать не менее {min_symbols} символов.
-                Обязательно включи:
-                - Анализ текущей формы обеих команд
-                - Информацию о ключевых игроках
-                - Историю встреч (можешь придумать её)
-                - Тактический разбор и стиль игры команд
-                - Факторы, которые могут повлиять на исход матча
-                - В конце - конкретный прогноз на исход (счет, победитель или ничья)
-                
-                Не упоминай о недостатке информации. Пиши так, как будто ты обладаешь всеми данными о командах.
-                """
-                
-                response = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo", # Используем gpt-3.5-turbo
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    max_tokens=1500, # Можно немного уменьшить, т.к. chat модели эффективнее
-                    n=1,
-                    stop=None,
-                    temperature=0.7, # Можно немного понизить температуру для большей предсказуемости
-                )
-                
-                prediction_text = response.choices[0].message['content'].strip()
-                predictions.append({
-                    'teams': f"{match['team1']} - {match['team2']}",
-                    'prediction': prediction_text
-                })
-            return predictions
+            return [request_prediction(match, min_symbols) for match in match_info]
         else:
             # Для одиночного матча
-            system_prompt = """Ты - опытный спортивный аналитик, создающий прогнозы на футбольные матчи на основе предоставленных данных.
-            Твоя задача - создать детальный, профессиональный прогноз, который будет интересно читать.
-            Используй футбольную терминологию, обсуждай тактики, стратегии и ключевых игроков.
-            Всегда завершай прогноз конкретным предсказанием результата (победа одной из команд или ничья).
-            Не упоминай о недостатке информации - пиши уверенно, как эксперт с полными данными.
-            """
-            
-            user_prompt = f"""
-            Напиши оригинальный, профессиональный прогноз на футбольный матч между командами {match_info['team1']} и {match_info['team2']} 
-            в рамках турнира {match_info['tournament']}. 
-            
-            Используй следующую информацию:
-            - Последние матчи {match_info['team1']}: {match_info['last_matches_team1']}
-            - Последние матчи {match_info['team2']}: {match_info['last_matches_team2']}
-            - Состав {match_info['team1']}: {match_info['lineup_team1']}
-            - Состав {match_info['team2']}: {match_info['lineup_team2']}
-            
-            Прогноз должен быть подробным, увлекательным и содержать не менее {min_symbols} символов.
-            Обязательно включи:
-            - Тактический разбор и стиль игры команд
-            - В конце - конкретный прогноз на исход (счет, победитель или ничья)
-            """
-            
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo", # Используем gpt-3.5-turbo
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=1500,
-                n=1,
-                stop=None,
-                temperature=0.7,
-            )
-            
-            prediction_text = response.choices[0].message['content'].strip()
-            return {
-                'teams': f"{match_info['team1']} - {match_info['team2']}",
-                'prediction': prediction_text
-            }
+            return request_prediction(match_info, min_symbols)
     except Exception as e:
         logger.error(f"Ошибка при генерации прогноза: {e}")
         # Попробуем получить более детальную информацию об ошибке OpenAI, если доступно
@@ -565,158 +1003,532 @@ def generate_match_prediction(match_info, min_symbols):
         logger.error(error_message)
         
         # Создаем базовый прогноз вместо возврата ошибки
-        team1 = match_info['team1'] if isinstance(match_info, dict) else "Команда 1"
-        team2 = match_info['team2'] if isinstance(match_info, dict) else "Команда 2"
-        tournament = match_info['tournament'] if isinstance(match_info, dict) else "Турнир"
-        
-        basic_prediction = f"""
-        Прогноз на матч {team1} - {team2} в рамках турнира {tournament}:
-        
-        Предстоящий матч между {team1} и {team2} обещает быть интересным противостоянием. Обе команды находятся в хорошей форме и готовы показать качественный футбол.
-        
-        {team1} в последних матчах демонстрирует стабильную игру, особенно в атаке, где лидеры команды создают множество опасных моментов. Тренерский штаб провел отличную подготовительную работу, и команда выглядит тактически грамотно организованной.
-        
-        {team2}, в свою очередь, также показывает достойные результаты. Команда отличается дисциплинированной игрой в обороне и быстрыми контратаками. Ключевые игроки находятся в оптимальной форме и готовы решать исход матча.
-        
-        История встреч этих команд говорит о напряженном противостоянии, где каждый матч был борьбой до последних минут. Вероятно, и в этот раз мы увидим упорную борьбу.
-        
-        Учитывая текущую форму обеих команд, тактические особенности и мотивацию, я прогнозирую победу {team1} со счетом 2:1. Команда имеет небольшое преимущество в атакующем потенциале, что должно сказаться на итоговом результате.
-        """
-        
-        # Убеждаемся, что прогноз содержит не менее min_symbols символов
-        while len(basic_prediction) < min_symbols:
-            basic_prediction += f"\n\nДополнительно стоит отметить, что {team1} активно работает над усилением состава и тактическими схемами. В последних матчах команда показала значительный прогресс в организации атак и стандартных положениях.\n\n{team2} также не стоит на месте. Команда совершенствует свой стиль игры, делая упор на контроль мяча и позиционные атаки. Тренерский штаб грамотно подходит к ротации состава, что позволяет поддерживать высокий уровень физической готовности игроков."
-        
-        return {
-            'teams': f"{team1} - {team2}",
-            'prediction': basic_prediction
-        }
+        return build_basic_prediction(match_info, min_symbols)
 
-def process_matches(update: Update, context: CallbackContext) -> None:
-    """Обрабатывает полученное сообщение и генерирует прогнозы."""
-    message_text = update.message.text
+def extract_structured_content(message_text):
+    """
+    Возвращает текст со списком матчей в формате "@Get articles".
     
+    Returns:
+        str: Текст для parse_match_text или None, если формат сообщения неверный
+    """
     # Если сообщение начинается с '@Get articles', обрабатываем его содержимое
     if message_text.startswith('@Get articles'):
         # Удаляем метку '@Get articles' из текста
-        content = message_text.replace('@Get articles', '').strip()
-        update.message.reply_text("🔍 Начинаю обработку данных из сообщения...")
-    else:
-        # Если обычное сообщение, проверяем его формат
-        if "на " in message_text and " (не позднее " in message_text:
-            content = message_text
-            update.message.reply_text("🔍 Начинаю обработку данных из сообщения...")
-        else:
-            # Неверный формат сообщения
-            update.message.reply_text(
-                "❌ Неверный формат сообщения!\n\n"
-                "Пожалуйста, используйте формат:\n"
-                "```\nна [дата] (не позднее [дедлайн])\n\n"
-                "1. [Команда1] - [Команда2]                [Турнир] ([мин_символов])\n```\n\n"
-                "Отправьте /help для подробной инструкции.", 
-                parse_mode='Markdown'
-            )
-            return
+        return message_text.replace('@Get articles', '').strip()
     
-    # Проверка на ограничение количества статей в сообщении
-    max_matches_pattern = r'(\d+)\s+стат(ей|ьи)'  # Например, "5 статей" или "10 статей"
-    max_matches = 5  # По умолчанию ограничение - 5 матчей
+    # Если обычное сообщение, проверяем его формат
+    if "на " in message_text and " (не позднее " in message_text:
+        return message_text
     
-    max_matches_match = re.search(max_matches_pattern, message_text, re.IGNORECASE)
-    if max_matches_match:
-        max_matches = int(max_matches_match.group(1))
-        logger.info(f"Установлено ограничение на количество статей: {max_matches}")
+    return None
+
+def build_structured_job(date_blocks, max_matches):
+    """
+    Составляет задание из блоков матчей формата "@Get articles".
     
-    # Парсинг текста сообщения
-    date_blocks = parse_match_text(content)
-    if not date_blocks:
-        update.message.reply_text(
-            "❌ Не удалось обработать данные о матчах.\n\n"
-            "Пожалуйста, проверьте формат сообщения:\n"
-            "- Между командами и турниром должно быть 16 пробелов\n"
-            "- Формат даты должен быть правильным\n"
-            "- Каждый матч должен быть на новой строке\n\n"
-            "Отправьте /help для подробной инструкции.", 
-            parse_mode='Markdown'
-        )
-        return
+    Элемент задания - один матч и служебные сообщения, которые отправляются
+    перед его обработкой.
+    
+    Returns:
+        tuple: (список элементов задания, список итоговых сообщений)
+    """
+    items = []
+    pending_messages = []
     
     # Счетчик обработанных матчей
     processed_matches = 0
     
     for date_block in date_blocks:
-        update.message.reply_text(f"📅 Обрабатываю матчи на {date_block['date']} (дедлайн: {date_block['deadline']})...")
+        pending_messages.append(f"📅 Обрабатываю матчи на {date_block['date']} (дедлайн: {date_block['deadline']})...")
         
         # Ограничиваем количество матчей для обработки в этом блоке
         matches_in_block = date_block['matches'][:max(0, max_matches - processed_matches)]
         
         if not matches_in_block:
-            update.message.reply_text("📊 Достигнуто максимальное количество матчей для обработки.")
+            pending_messages.append("📊 Достигнуто максимальное количество матчей для обработки.")
             break
-            
-        # Отображаем сводку о количестве найденных и обрабатываемых матчей
-        update.message.reply_text(f"📊 Найдено матчей в блоке: {len(date_block['matches'])}, обрабатываю: {len(matches_in_block)}")
+        
+        # Сводка о количестве найденных и обрабатываемых матчей
+        pending_messages.append(f"📊 Найдено матчей в блоке: {len(date_block['matches'])}, обрабатываю: {len(matches_in_block)}")
         
         for idx, match in enumerate(matches_in_block, 1):
-            try:
-                # Информируем пользователя о прогрессе
-                if match.get('is_all_matches', False):
-                    update.message.reply_text(f"⚽ Ищу информацию о всех матчах турнира {match['tournament']}... ({processed_matches + idx}/{max_matches})")
-                else:
-                    update.message.reply_text(f"⚽ Ищу информацию о матче {match['teams']}... ({processed_matches + idx}/{max_matches})")
-                
-                # Поиск информации
-                match_info = search_match_info(match)
-                if not match_info:
-                    update.message.reply_text(f"⚠️ Не удалось найти полную информацию для матча #{match['number']}. Создаю прогноз на основе доступных данных...")
-                
-                # Генерация прогноза
-                update.message.reply_text(f"✍️ Создаю прогноз для матча...")
-                predictions = generate_match_prediction(match_info, match['min_symbols'])
-                
-                # Отправка результатов
-                if isinstance(predictions, list):
-                    for pred_idx, pred in enumerate(predictions, 1):
-                        message = f"📊 *Прогноз #{pred_idx} ({processed_matches + idx}/{max_matches}) для {pred['teams']}:*\n\n{pred['prediction']}"
-                        # Разбиваем сообщение, если оно слишком длинное
-                        if len(message) > 4000:
-                            parts = [message[i:i+4000] for i in range(0, len(message), 4000)]
-                            for i, part in enumerate(parts):
-                                if i == 0:
-                                    update.message.reply_text(part, parse_mode='Markdown')
-                                else:
-                                    update.message.reply_text(f"... {part}", parse_mode='Markdown')
-                        else:
-                            update.message.reply_text(message, parse_mode='Markdown')
-                else:
-                    message = f"📊 *Прогноз ({processed_matches + idx}/{max_matches}) для {predictions['teams']}:*\n\n{predictions['prediction']}"
-                    # Разбиваем сообщение, если оно слишком длинное
-                    if len(message) > 4000:
-                        parts = [message[i:i+4000] for i in range(0, len(message), 4000)]
-                        for i, part in enumerate(parts):
-                            if i == 0:
-                                update.message.reply_text(part, parse_mode='Markdown')
-                            else:
-                                update.message.reply_text(f"... {part}", parse_mode='Markdown')
-                    else:
-                        update.message.reply_text(message, parse_mode='Markdown')
+            position = f"{processed_matches + idx}/{max_matches}"
+            if match.get('is_all_matches', False):
+                progress = f"⚽ Ищу информацию о всех матчах турнира {match['tournament']}... ({position})"
+            else:
+                progress = f"⚽ Ищу информацию о матче {match['teams']}... ({position})"
             
-            except Exception as e:
-                logger.error(f"Ошибка при обработке матча #{match['number']}: {e}")
-                update.message.reply_text(
-                    f"⚠️ Произошла ошибка при обработке матча #{match['number']}.\n"
-                    f"Пожалуйста, проверьте правильность введенных данных или попробуйте позже."
-                )
+            items.append({'kind': 'structured', 'match': match, 'position': position,
+                          'messages': pending_messages + [progress]})
+            pending_messages = []
         
-        # Увеличиваем счетчик обработанных матчей
         processed_matches += len(matches_in_block)
         
         # Проверяем, не достигли ли мы лимита
         if processed_matches >= max_matches:
-            update.message.reply_text("📊 Достигнуто максимальное количество матчей для обработки.")
+            pending_messages.append("📊 Достигнуто максимальное количество матчей для обработки.")
             break
     
-    update.message.reply_text(f"✅ Обработка завершена! Обработано матчей: {processed_matches}. Надеюсь, прогнозы будут полезны.")
+    outro = pending_messages + [f"✅ Обработка завершена! Обработано матчей: {processed_matches}. Надеюсь, прогнозы будут полезны."]
+    return items, outro
+
+def build_simple_job(matches):
+    """
+    Составляет задание из матчей упрощенного формата.
+    
+    Returns:
+        tuple: (список элементов задания, список итоговых сообщений)
+    """
+    items = [
+        {'kind': 'simple', 'match': match, 'position': f"{i}/{len(matches)}",
+         'messages': [f"⚽ Создаю прогноз на матч {i}/{len(matches)}: {match['teams']}..."]}
+        for i, match in enumerate(matches, 1)
+    ]
+    return items, ["✅ Все прогнозы готовы!"]
+
+def enrich_job_item(item, send):
+    """Собирает информацию о матче элемента задания."""
+    match = item['match']
+    
+    profile = enrichment.profile_for(item['kind'])
+    if item['kind'] == 'simple':
+        return build_simple_match_info(match, profile)
+    
+    match_info = search_match_info(match, profile)
+    if not match_info:
+        send(match_info_missing_text(item))
+    return match_info
+
+def match_info_missing_text(item):
+    """Сообщение о том, что полная информация о матче элемента задания не найдена."""
+    return f"⚠️ Не удалось найти полную информацию для матча #{item['match']['number']}. Создаю прогноз на основе доступных данных..."
+
+def generate_job_item(item, match_info, send):
+    """Генерирует прогноз для элемента задания."""
+    for text in generation_messages(item):
+        send(text)
+    return generate_match_prediction(match_info, item['match']['min_symbols'])
+
+def generation_messages(item):
+    """Сообщения, которые отправляются перед генерацией прогноза элемента задания."""
+    if item['kind'] == 'structured':
+        return [f"✍️ Создаю прогноз для матча {item['position']}..."]
+    return []
+
+def format_job_item_result(item, predictions):
+    """Сообщения с прогнозами элемента задания."""
+    position = item['position']
+    
+    if item['kind'] == 'simple':
+        return [f"📊 *Прогноз {position} для {predictions['teams']}:*\n\n{predictions['prediction']}"]
+    
+    if isinstance(predictions, list):
+        return [
+            f"📊 *Прогноз #{pred_idx} ({position}) для {pred['teams']}:*\n\n{pred['prediction']}"
+            for pred_idx, pred in enumerate(predictions, 1)
+        ]
+    return [f"📊 *Прогноз ({position}) для {predictions['teams']}:*\n\n{predictions['prediction']}"]
+
+def job_item_error_text(item):
+    """Сообщение пользователю об ошибке обработки элемента задания."""
+    match = item['match']
+    
+    if item['kind'] == 'simple':
+        return (
+            f"⚠️ Произошла ошибка при создании прогноза для {match['teams']}.\n"
+            f"Пожалуйста, попробуйте еще раз или уточните команды."
+        )
+    return (
+        f"⚠️ Произошла ошибка при обработке матча #{match['number']}.\n"
+        f"Пожалуйста, проверьте правильность введенных данных или попробуйте позже."
+    )
+
+def expected_job_length(items):
+    """Ожидаемый объем прогнозов задания (символов) по заявленным min_symbols."""
+    return sum(
+        item['match'].get('min_symbols', 1000) * (item['match'].get('count', 1) if item['match'].get('is_all_matches') else 1)
+        for item in items
+    )
+
+def use_document_delivery(items):
+    """Отправлять ли прогнозы задания одним файлом (см. DOCUMENT_DELIVERY)."""
+    if DOCUMENT_DELIVERY == 'always':
+        return True
+    if DOCUMENT_DELIVERY == 'never':
+        return False
+    return expected_job_length(items) > DOCUMENT_THRESHOLD
+
+def _document_sections(items, results):
+    """Разделы файла с прогнозами: (заголовок блока или None, заголовок раздела, текст)."""
+    current_date = None
+    for index, item in enumerate(items):
+        date = item['match'].get('date') or None
+        heading = f"Прогнозы на {date}" if date and date != current_date else None
+        current_date = date or current_date
+        
+        predictions = results.get(index)
+        if predictions is None:
+            yield heading, f"Матч {item['position']}", job_item_error_text(item)
+            continue
+        for prediction in predictions if isinstance(predictions, list) else [predictions]:
+            yield heading, prediction['teams'], prediction['prediction'].strip()
+            heading = None
+
+def build_job_document(job_id, items, results):
+    """
+    Собирает файл с прогнозами задания в формате DOCUMENT_FORMAT.
+    
+    Args:
+        job_id: Идентификатор задания (для имени файла)
+        items: Элементы задания
+        results: Прогнозы по индексам элементов (нет индекса - ошибка обработки)
+    
+    Returns:
+        tuple: (имя файла, содержимое в bytes)
+    """
+    if DOCUMENT_FORMAT == 'html':
+        import html
+        
+        parts = ['<!DOCTYPE html>', '<html><head><meta charset="utf-8"><title>Прогнозы</title></head><body>']
+        for heading, title, text in _document_sections(items, results):
+            if heading:
+                parts.append(f"<h1>{html.escape(heading)}</h1>")
+            parts.append(f"<h2>{html.escape(title)}</h2>")
+            parts.extend(f"<p>{html.escape(paragraph)}</p>" for paragraph in text.split("\n\n") if paragraph.strip())
+        parts.append('</body></html>')
+        return f"predictions_{job_id}.html", "\n".join(parts).encode('utf-8')
+    
+    parts = []
+    for heading, title, text in _document_sections(items, results):
+        if heading:
+            parts.append(f"# {heading}")
+        parts.extend([f"## {title}", text])
+    return f"predictions_{job_id}.md", ("\n\n".join(parts) + "\n").encode('utf-8')
+
+def send_job_document(chat_id, job_id, items, results):
+    """Отправляет прогнозы задания одним файлом."""
+    import io
+    
+    filename, content = build_job_document(job_id, items, results)
+    predictions = sum(len(value) if isinstance(value, list) else 1 for value in results.values() if value is not None)
+    get_bot().send_document(
+        chat_id=chat_id, document=io.BytesIO(content), filename=filename,
+        caption=f"📄 Прогнозы: {predictions}"
+    )
+
+def status_message(chat_id, text):
+    """Отправляет сообщение о ходе задания и возвращает функцию для его обновления."""
+    message_id = get_bot().send_message(chat_id=chat_id, text=text).message_id
+    
+    def update(new_text):
+        try:
+            get_bot().edit_message_text(chat_id=chat_id, message_id=message_id, text=new_text)
+        except Exception as e:
+            # Ход выполнения не критичен для задания
+            logger.warning(f"Не удалось обновить сообщение о ходе задания: {e}")
+    return update
+
+def chat_sender(chat_id):
+    """Функция отправки сообщений в чат (не зависит от исходного update, поэтому подходит для возобновления)."""
+    def send(text, parse_mode=None):
+        get_bot().send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+    return send
+
+def match_key(item):
+    """Ключ матча элемента задания для повторного использования прогноза другим заданием."""
+    return (item['kind'],) + tuple(sorted((key, value) for key, value in item['match'].items() if key != 'number'))
+
+def is_job_canceled(job_id):
+    """Отменено ли задание (/cancel или новым запросом пользователя)."""
+    return job_id in canceled_jobs or job_store.store.is_canceled(job_id)
+
+def acquire_user_job(job_id, user_id, send, policy=None):
+    """
+    Регистрирует задание пользователя с учетом политики USER_JOB_POLICY.
+    
+    Args:
+        job_id: Идентификатор нового задания
+        user_id: Пользователь
+        send: Функция отправки сообщений в чат
+        policy: Политика вместо USER_JOB_POLICY (parallel - для возобновляемых заданий)
+    
+    Returns:
+        dict: Готовые прогнозы заданий пользователя по ключам матчей (общие для его
+            заданий) или None, если запрос, ожидая очереди, заменен более новым
+    """
+    policy = policy or USER_JOB_POLICY
+    cancel_stored_user_jobs(job_id, user_id, policy)
+    
+    with user_jobs_condition:
+        result, notice = register_user_job(job_id, user_id, policy)
+        if notice:
+            send(notice)
+        while result is QUEUED and is_user_job_queued(job_id, user_id):
+            user_jobs_condition.wait()
+        return finish_user_job_wait(job_id, user_id) if result is QUEUED else result
+
+# Результат register_user_job: задание ждет завершения предыдущего (USER_JOB_POLICY=queue)
+QUEUED = object()
+
+def cancel_stored_user_jobs(job_id, user_id, policy):
+    """Отменяет в хранилище незавершенные задания пользователя (политика replace)."""
+    if policy == 'replace' and job_store.store.cancel_user_jobs(user_id):
+        # Задания пользователя в других процессах остановятся по статусу в хранилище
+        logger.info(f"Незавершенные задания пользователя {user_id} отменены новым запросом {job_id}")
+
+def register_user_job(job_id, user_id, policy):
+    """
+    Неблокирующая часть acquire_user_job; вызывается под user_jobs_condition.
+    
+    Returns:
+        tuple: (готовые прогнозы пользователя или QUEUED, сообщение пользователю или None);
+            после ожидания QUEUED регистрацию завершает finish_user_job_wait
+    """
+    state = user_jobs.setdefault(user_id, {'jobs': set(), 'waiting': None, 'results': {}})
+    notice = None
+    if state['jobs'] and policy == 'replace':
+        canceled_jobs.update(state['jobs'])
+        notice = SUPERSEDED_TEXT
+    elif state['jobs'] and policy == 'queue':
+        state['waiting'] = job_id
+        user_jobs_condition.notify_all()
+        return QUEUED, JOB_QUEUED_TEXT
+    state['jobs'].add(job_id)
+    return state['results'], notice
+
+def is_user_job_queued(job_id, user_id):
+    """Ждет ли задание (все еще последнее в очереди) завершения предыдущих заданий пользователя."""
+    state = user_jobs.get(user_id)
+    return state is not None and bool(state['jobs']) and state['waiting'] == job_id
+
+def finish_user_job_wait(job_id, user_id):
+    """Завершает регистрацию задания после ожидания очереди (под user_jobs_condition)."""
+    # Состояние могло быть удалено (/cancel и завершение предыдущего задания)
+    state = user_jobs.get(user_id)
+    if state is None:
+        return None
+    if state['waiting'] != job_id:
+        if not state['jobs'] and state['waiting'] is None:
+            del user_jobs[user_id]
+        return None
+    state['waiting'] = None
+    state['jobs'].add(job_id)
+    return state['results']
+
+def release_user_job(job_id, user_id):
+    """Снимает регистрацию завершенного задания пользователя."""
+    with user_jobs_condition:
+        canceled_jobs.discard(job_id)
+        state = user_jobs.get(user_id)
+        if state is not None:
+            state['jobs'].discard(job_id)
+            if not state['jobs'] and state['waiting'] is None:
+                del user_jobs[user_id]
+        user_jobs_condition.notify_all()
+
+def start_job(update: Update, items, outro):
+    """Сохраняет задание в хранилище и выполняет его (с учетом других заданий пользователя)."""
+    user_id = update.effective_user.id
+    job_id = f"{user_id}_{update.message.message_id}"
+    send = chat_sender(update.effective_chat.id)
+    
+    reuse = acquire_user_job(job_id, user_id, send)
+    if reuse is None:
+        send(JOB_REPLACED_TEXT)
+        return
+    try:
+        job = job_store.store.create_job(job_id, user_id, update.effective_chat.id, items, outro)
+        start_job_recovery()
+        execute_job(job, send, reuse)
+    finally:
+        release_user_job(job_id, user_id)
+
+def execute_job(job, send, reuse=None):
+    """
+    Выполняет задание с первого недоставленного элемента.
+    
+    Элементы проходят конвейер: поиск информации -> генерация -> отправка,
+    поэтому поиск информации о следующих матчах идет во время генерации
+    прогноза для текущего. Готовые прогнозы берутся из хранилища заданий,
+    новые сохраняются в него до отправки, а после отправки элемент отмечается
+    доставленным. Прогнозы матчей, уже готовые в других заданиях пользователя
+    (словарь reuse), не генерируются повторно. Обработка прекращается, если
+    пользователь отменил задание (/cancel или новым запросом).
+    """
+    job_id = job['job_id']
+    items = job['items']
+    # Оставшаяся стоимость задания с каждого элемента для планировщика генерации
+    # (первыми генерируются элементы заданий, которым осталось меньше всего)
+    remaining_costs = list(itertools.accumulate(
+        (scheduler.item_cost(item['match']) for item in reversed(items))
+    ))[::-1]
+    
+    # Крупные задания отправляются одним файлом: вместо сообщений о каждом матче -
+    # одно обновляемое сообщение о ходе выполнения
+    document_mode = use_document_delivery(items)
+    if document_mode:
+        results = {}
+        item_send = lambda text, parse_mode=None: None
+        update_status = status_message(
+            job['chat_id'], f"⏳ Готовлю прогнозы одним файлом: {job['next_index']}/{len(items)}"
+        )
+    else:
+        item_send = send
+    
+    def pending_items():
+        for index in range(job['next_index'], len(items)):
+            if is_job_canceled(job_id):
+                return
+            yield {'index': index, 'match_info': None, 'predictions': None, 'error': None}
+    
+    def enrich(state):
+        item = items[state['index']]
+        try:
+            # Информируем пользователя о прогрессе
+            for text in item['messages']:
+                item_send(text)
+            
+            state['predictions'] = job_store.store.get_result(job_id, state['index'])
+            if state['predictions'] is None and reuse is not None:
+                state['predictions'] = reuse.get(match_key(item))
+                if state['predictions'] is not None:
+                    logger.info(f"Прогноз для матча {item['position']} взят из предыдущего запроса")
+                    job_store.store.save_result(job_id, state['index'], state['predictions'])
+            if state['predictions'] is None:
+                state['match_info'] = enrich_job_item(item, item_send)
+        except Exception as e:
+            state['error'] = e
+        return state
+    
+    def generate(state):
+        if state['predictions'] is None and state['error'] is None:
+            try:
+                with scheduler.scheduler.slot(job['user_id'], remaining_costs[state['index']]):
+                    state['predictions'] = generate_job_item(items[state['index']], state['match_info'], item_send)
+                job_store.store.save_result(job_id, state['index'], state['predictions'])
+                if reuse is not None:
+                    reuse[match_key(items[state['index']])] = state['predictions']
+            except Exception as e:
+                state['error'] = e
+        return state
+    
+    def deliver(state):
+        if is_job_canceled(job_id):
+            return False
+        
+        item = items[state['index']]
+        if state['error'] is not None:
+            logger.error(f"Ошибка при обработке матча {item['position']} задания {job_id}: {state['error']}")
+        
+        if document_mode:
+            results[state['index']] = state['predictions'] if state['error'] is None else None
+            update_status(f"⏳ Готовлю прогнозы одним файлом: {state['index'] + 1}/{len(items)}")
+        elif state['error'] is not None:
+            send(job_item_error_text(item))
+        else:
+            # Отправка результатов (длинные сообщения разбиваются на части)
+            for message in format_job_item_result(item, state['predictions']):
+                for part in split_message(message):
+                    send(part, parse_mode='Markdown')
+        
+        job_store.store.mark_delivered(job_id, state['index'])
+    
+    try:
+        pipeline.run_pipeline(pending_items(), [enrich, generate], deliver)
+        
+        if is_job_canceled(job_id):
+            logger.info(f"Задание {job_id} отменено пользователем, обработка остановлена")
+            return
+        
+        if document_mode:
+            # Элементы, доставленные до перезапуска, берутся из хранилища
+            for index in range(job['next_index']):
+                results[index] = job_store.store.get_result(job_id, index)
+            send_job_document(job['chat_id'], job_id, items, results)
+            update_status(f"✅ Прогнозы готовы: {len(items)}/{len(items)}")
+        
+        for text in job['outro']:
+            send(text)
+        job_store.store.finish_job(job_id)
+    except Exception as e:
+        # Сообщения не доставляются (например, бот заблокирован) - не возобновляем задание
+        logger.error(f"Задание {job_id} прервано: {e}")
+        job_store.store.finish_job(job_id, job_store.FAILED)
+
+def resume_job(job):
+    """Продолжает задание, брошенное остановленным процессом."""
+    job_id = job['job_id']
+    
+    with tracing.job(job_id):
+        logger.info(f"Возобновление задания {job_id} с матча {job['next_index'] + 1}/{len(job['items'])}")
+        processing_messages.add(job_id, job['user_id'])
+        send = chat_sender(job['chat_id'])
+        reuse = acquire_user_job(job_id, job['user_id'], send, policy='parallel')
+        try:
+            send(RESUME_TEXT)
+            execute_job(job, send, reuse)
+        finally:
+            release_user_job(job_id, job['user_id'])
+            processing_messages.discard(job_id)
+
+# Поток возобновления заданий запускается один раз на процесс
+job_recovery_started = False
+
+def start_job_recovery():
+    """
+    Запускает фоновый поток, который обновляет heartbeat заданий процесса
+    и возобновляет задания, брошенные остановленными процессами.
+    """
+    global job_recovery_started
+    
+    if not job_store.store.enabled:
+        return
+    with init_lock:
+        if job_recovery_started:
+            return
+        job_recovery_started = True
+    
+    threading.Thread(target=job_recovery_loop, name="job-recovery", daemon=True).start()
+
+def job_recovery_loop():
+    last_recovery = None
+    while True:
+        try:
+            job_store.store.heartbeat()
+            if last_recovery is None or time.monotonic() - last_recovery >= JOB_RECOVERY_INTERVAL:
+                last_recovery = time.monotonic()
+                for job in job_store.store.claim_stale_jobs():
+                    threading.Thread(target=resume_job, args=(job,), daemon=True).start()
+                job_store.store.purge_finished()
+        except Exception as e:
+            logger.error(f"Ошибка при возобновлении заданий: {e}")
+        time.sleep(job_store.JOB_HEARTBEAT_INTERVAL)
+
+def process_matches(update: Update, context: CallbackContext) -> None:
+    """Обрабатывает полученное сообщение и генерирует прогнозы."""
+    message_text = update.message.text
+    
+    content = extract_structured_content(message_text)
+    if content is None:
+        # Неверный формат сообщения
+        update.message.reply_text(FORMAT_ERROR_TEXT, parse_mode='Markdown')
+        return
+    
+    update.message.reply_text("🔍 Начинаю обработку данных из сообщения...")
+    
+    # Проверка на ограничение количества статей в сообщении
+    max_matches = extract_max_matches(message_text)
+    
+    # Парсинг текста сообщения
+    with metrics.PARSE_DURATION.time(format="structured"), tracing.span("parse", format="structured"):
+        date_blocks = parse_match_text(content)
+    if not date_blocks:
+        update.message.reply_text(PARSE_ERROR_TEXT, parse_mode='Markdown')
+        return
+    
+    items, outro = build_structured_job(date_blocks, max_matches)
+    start_job(update, items, outro)
 
 def parse_simple_message(text):
     """Упрощенный парсинг текста о матче из любого формата сообщения."""
@@ -834,6 +1646,50 @@ def parse_simple_message(text):
     
     return {'date': date, 'matches': matches[:max_matches]}  # Гарантируем ограничение по количеству матчей
 
+def build_simple_match_info(match, profile=enrichment.CACHED):
+    """
+    Создает данные о командах для упрощенного формата запроса.
+    
+    По умолчанию (профиль cached) форма команд и личные встречи берутся из
+    локальной базы результатов, если команды в ней есть; запросы к API не
+    выполняются.
+    """
+    return collect_match_info(match, match['team1'], match['team2'], profile)
+
+def build_local_match_info(team1, team2, tournament, use_results=True):
+    """
+    Базовые данные о командах без запросов к API.
+    
+    Args:
+        team1, team2: Команды
+        tournament: Турнир
+        use_results: Брать форму команд и личные встречи из локальной базы результатов
+    """
+    match_info = {
+        'team1': team1,
+        'team2': team2,
+        'tournament': tournament,
+        'last_matches_team1': f"{team1} показывает стабильную игру в этом сезоне.",
+        'last_matches_team2': f"{team2} демонстрирует хорошую форму в последних матчах.",
+        'lineup_team1': f"Состав {team1} укомплектован сильными игроками.",
+        'lineup_team2': f"В составе {team2} есть несколько ключевых футболистов."
+    }
+    if not use_results:
+        return match_info
+    
+    team1_info = web_search.get_local_team_info(team1)
+    team2_info = web_search.get_local_team_info(team2)
+    if team1_info:
+        match_info['last_matches_team1'] = team1_info['last_matches']
+        match_info['form_team1'] = team1_info.get('form')
+    if team2_info:
+        match_info['last_matches_team2'] = team2_info['last_matches']
+        match_info['form_team2'] = team2_info.get('form')
+    if team1_info and team2_info:
+        match_info['head_to_head'] = web_search.get_head_to_head(team1_info['team_id'], team2_info['team_id'], team1)
+    
+    return match_info
+
 def process_simple_match(update: Update, context: CallbackContext) -> None:
     """Обрабатывает простое сообщение от пользователя и генерирует прогноз."""
     message_text = update.message.text
@@ -843,109 +1699,55 @@ def process_simple_match(update: Update, context: CallbackContext) -> None:
     matches = parsed_data['matches']
     
     if not matches:
-        update.message.reply_text(
-            "❌ Не удалось найти матчи в вашем сообщении.\n\n"
-            "Пожалуйста, укажите матчи в формате:\n"
-            "```\nна [дата]\nКоманда1 - Команда2\nКоманда3 - Команда4\n```\n\n"
-            "Или просто:\n"
-            "```\nКоманда1 - Команда2\n```\n\n"
-            "Отправьте /help для подробной инструкции.",
-            parse_mode='Markdown'
-        )
+        update.message.reply_text(SIMPLE_FORMAT_ERROR_TEXT, parse_mode='Markdown')
         return
     
     # Информируем пользователя о количестве найденных матчей
     update.message.reply_text(f"📊 Найдено матчей: {len(matches)}. Начинаю обработку...")
     
-    # Обрабатываем каждый найденный матч
-    for i, match in enumerate(matches, 1):
-        update.message.reply_text(f"⚽ Создаю прогноз на матч {i}/{len(matches)}: {match['teams']}...")
-        
-        try:
-            # Создаем базовые данные о командах
-            match_info = {
-                'team1': match['team1'],
-                'team2': match['team2'],
-                'tournament': match['tournament'],
-                'last_matches_team1': f"{match['team1']} показывает стабильную игру в этом сезоне.",
-                'last_matches_team2': f"{match['team2']} демонстрирует хорошую форму в последних матчах.",
-                'lineup_team1': f"Состав {match['team1']} укомплектован сильными игроками.",
-                'lineup_team2': f"В составе {match['team2']} есть несколько ключевых футболистов."
-            }
-            
-            # Генерация прогноза
-            prediction = generate_match_prediction(match_info, match['min_symbols'])
-            
-            # Отправка результата
-            message = f"📊 *Прогноз {i}/{len(matches)} для {prediction['teams']}:*\n\n{prediction['prediction']}"
-            
-            # Разбиваем сообщение, если оно слишком длинное
-            if len(message) > 4000:
-                parts = [message[i:i+4000] for i in range(0, len(message), 4000)]
-                for i, part in enumerate(parts):
-                    if i == 0:
-                        update.message.reply_text(part, parse_mode='Markdown')
-                    else:
-                        update.message.reply_text(f"... {part}", parse_mode='Markdown')
-            else:
-                update.message.reply_text(message, parse_mode='Markdown')
-                
-        except Exception as e:
-            logger.error(f"Ошибка при обработке матча {match['teams']}: {e}")
-            update.message.reply_text(
-                f"⚠️ Произошла ошибка при создании прогноза для {match['teams']}.\n"
-                f"Пожалуйста, попробуйте еще раз или уточните команды."
-            )
-    
-    update.message.reply_text("✅ Все прогнозы готовы!")
+    items, outro = build_simple_job(matches)
+    start_job(update, items, outro)
 
 def process_text_or_buttons(update: Update, context: CallbackContext) -> None:
     """Обрабатывает обычные текстовые сообщения и нажатия на кнопки."""
+    # Все этапы и строки лога помечаются идентификатором задания
+    with tracing.job(f"{update.effective_user.id}_{update.message.message_id}"):
+        _process_text_or_buttons(update, context)
+
+def _process_text_or_buttons(update: Update, context: CallbackContext) -> None:
     message_text = update.message.text
     user_id = update.effective_user.id
     message_id = update.message.message_id
     
     # Проверка на ограничение скорости запросов
     if is_rate_limited(user_id):
-        update.message.reply_text(
-            "⚠️ Вы отправляете слишком много запросов. Пожалуйста, подождите немного и попробуйте снова."
-        )
+        update.message.reply_text(RATE_LIMIT_TEXT)
         return
     
     # Безопасная обработка входных данных
     message_text = sanitize_input(message_text)
     if not message_text:
-        update.message.reply_text("⚠️ Получено пустое сообщение. Пожалуйста, отправьте текст запроса.")
+        update.message.reply_text(EMPTY_MESSAGE_TEXT)
         return
     
     # Создаем уникальный идентификатор для сообщения
     message_key = f"{user_id}_{message_id}"
     
-    # Проверяем, не обрабатывается ли уже это сообщение
-    with message_lock:
-        if message_key in processing_messages:
-            logger.warning(f"Сообщение {message_key} уже обрабатывается, пропускаем.")
-            update.message.reply_text("⚠️ Это сообщение уже обрабатывается. Пожалуйста, дождитесь завершения.")
-            return
-        
-        # Отмечаем сообщение как обрабатываемое
-        processing_messages[message_key] = datetime.now()
+    # Отмечаем сообщение как обрабатываемое, если оно еще не обрабатывается
+    if not processing_messages.add(message_key, user_id, replace=False):
+        logger.warning(f"Сообщение {message_key} уже обрабатывается, пропускаем.")
+        update.message.reply_text(DUPLICATE_MESSAGE_TEXT)
+        return
     
     try:
         # Обрабатываем кнопки меню
         if message_text == "Контакты":
-            contact_text = """
-*Контактная информация:*
-
-Разработчик: @ainishanov
-
-По всем вопросам обращайтесь к разработчику.
-            """
-            update.message.reply_text(contact_text, parse_mode='Markdown')
+            update.message.reply_text(CONTACT_TEXT, parse_mode='Markdown')
             return
         
         # Всегда сначала пробуем упрощенный парсинг для любого сообщения
-        parsed_data = parse_simple_message(message_text)
+        with metrics.PARSE_DURATION.time(format="simple"), tracing.span("parse", format="simple"):
+            parsed_data = parse_simple_message(message_text)
         if parsed_data['matches']:
             # Если нашли матчи, обрабатываем их
             process_simple_match(update, context)
@@ -954,36 +1756,40 @@ def process_text_or_buttons(update: Update, context: CallbackContext) -> None:
             process_matches(update, context)
     finally:
         # В любом случае удаляем сообщение из обрабатываемых
-        with message_lock:
-            if message_key in processing_messages:
-                del processing_messages[message_key]
+        processing_messages.discard(message_key)
 
 # Функция для очистки устаревших записей обрабатываемых сообщений
 def cleanup_processing_messages():
-    """Удаляет старые записи из словаря processing_messages."""
-    now = datetime.now()
-    with message_lock:
-        keys_to_delete = []
-        for key, timestamp in processing_messages.items():
-            # Если сообщение обрабатывается более 5 минут, считаем его "зависшим"
-            if (now - timestamp).total_seconds() > 300:  # 5 минут
-                keys_to_delete.append(key)
-        
-        for key in keys_to_delete:
-            del processing_messages[key]
-            logger.warning(f"Удалено устаревшее сообщение {key} из обрабатываемых.")
+    """Удаляет "зависшие" записи (старше inflight.MESSAGE_TTL) из processing_messages."""
+    processing_messages.expire()
 
 # Добавим периодическую очистку устаревших сообщений в webhook-обработчик
 @app.route('/' + WEBHOOK_PATH, methods=['POST'])
 def webhook():
     """Обработчик для входящих сообщений через webhook."""
+    # Запросы не от Telegram отклоняются по заголовкам, без чтения тела и записи в лог
+    rejection = webhook_rejection(
+        request.headers.get('X-Telegram-Bot-Api-Secret-Token'),
+        request.headers.get('Content-Type'),
+        request.content_length
+    )
+    if rejection is not None:
+        status, reason = rejection
+        metrics.WEBHOOK_REJECTED.inc(reason=reason)
+        return Response(status=status)
+    
     # Проверка IP-адреса запроса для защиты от атак
     if request.headers.get('X-Forwarded-For'):
         ip = request.headers.get('X-Forwarded-For').split(',')[0].strip()
     else:
         ip = request.remote_addr
         
-    logger.info(f"Получен webhook запрос от {ip}")
+    logger.info("Получен webhook запрос от %s", ip, extra={'log_type': 'webhook'})
+    
+    # Повторная доставка подтверждается до разбора JSON
+    update_id = update_dedup.peek_update_id(request.get_data(cache=True))
+    if update_id is not None and is_duplicate_update(update_id):
+        return 'ok'
     
     # Проверяем, что запрос пришел от Telegram
     try:
@@ -995,61 +1801,332 @@ def webhook():
         logger.error(f"Ошибка при разборе JSON в webhook запросе: {e}")
         abort(400)
     
-    # Периодически очищаем устаревшие записи
-    cleanup_processing_messages()
+    if update_id is None and isinstance(update_json.get('update_id'), int):
+        update_id = update_json['update_id']
+        if is_duplicate_update(update_id):
+            return 'ok'
     
-    update = Update.de_json(update_json, bot)
-    dispatcher.process_update(update)
+    metrics.WEBHOOK_UPDATES.inc(runtime="sync")
+    
+    try:
+        if UPDATE_QUEUE_ENABLED:
+            # Обработку выполнят процессы-обработчики
+            job_store.store.enqueue_update(update_json)
+            return 'ok'
+        
+        # Периодически очищаем устаревшие записи
+        cleanup_processing_messages()
+        process_update_json(update_json)
+    except Exception:
+        # Обновление не обработано: повторная доставка от Telegram должна пройти
+        if update_id is not None:
+            forget_update(update_id)
+        raise
     return 'ok'
 
+def is_duplicate_update(update_id):
+    """
+    Проверяет, получено ли обновление повторно, и запоминает его.
+    
+    Сначала проверяются обновления текущего процесса, затем (если включено
+    хранилище заданий) обновления всех процессов.
+    """
+    duplicate = recent_updates.seen(update_id)
+    if not duplicate:
+        try:
+            duplicate = not job_store.store.mark_update_seen(update_id)
+        except Exception as e:
+            logger.error(f"Ошибка при проверке обновления {update_id} в хранилище: {e}")
+    
+    if duplicate:
+        logger.info("Обновление %s уже получено, повтор пропущен", update_id, extra={'log_type': 'duplicate_update'})
+        metrics.DUPLICATE_UPDATES.inc(runtime="sync")
+    return duplicate
+
+def forget_update(update_id):
+    """Забывает обновление, чтобы его повторная доставка была обработана."""
+    recent_updates.forget(update_id)
+    try:
+        job_store.store.forget_update(update_id)
+    except Exception as e:
+        logger.error(f"Ошибка при удалении обновления {update_id} из хранилища: {e}")
+
+def process_update_json(update_json):
+    """Передает обновление Telegram (в виде JSON) обработчикам диспетчера."""
+    from telegram import Update
+    
+    update = Update.de_json(update_json, get_bot())
+    get_dispatcher().process_update(update)
+
 # Маршрут для проверки работоспособности
 @app.route('/')
 def index():
     return 'Бот работает!'
 
+def readiness_status(max_inflight_jobs=None):
+    """
+    Проверяет готовность экземпляра принимать новые задания.
+    
+    Экземпляр не готов, если разомкнут предохранитель одного из внешних API
+    или количество обрабатываемых сообщений достигло порога.
+    
+    Returns:
+        tuple: (готов ли экземпляр, словарь с подробностями)
+    """
+    if max_inflight_jobs is None:
+        max_inflight_jobs = READY_MAX_INFLIGHT_JOBS
+    
+    breaker_states = {name: breaker.state for name, breaker in circuit_breaker.breakers.items()}
+    inflight = len(processing_messages)
+    
+    ready = inflight < max_inflight_jobs and all(state != circuit_breaker.OPEN for state in breaker_states.values())
+    details = {
+        'ready': ready,
+        'circuit_breakers': breaker_states,
+        'inflight_jobs': inflight,
+        'max_inflight_jobs': max_inflight_jobs,
+    }
+    if UPDATE_QUEUE_ENABLED:
+        details['queued_updates'] = job_store.store.queued_updates()
+    return ready, details
+
+# Маршрут для метрик в формате Prometheus
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
+# Маршрут для проверки готовности (для балансировщика/оркестратора)
+@app.route('/ready')
+def ready():
+    is_ready, details = readiness_status()
+    return Response(json.dumps(details), status=200 if is_ready else 503, mimetype='application/json')
+
+def is_admin_request():
+    """Проверяет токен служебного запроса (заголовок Authorization: Bearer или параметр token)."""
+    if not ADMIN_TOKEN:
+        return False
+    
+    auth_header = request.headers.get('Authorization', '')
+    token = auth_header[7:] if auth_header.startswith('Bearer ') else request.args.get('token', '')
+    return hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+# Маршруты для просмотра трасс последних заданий
+@app.route('/trace')
+def trace_list():
+    if not is_admin_request():
+        abort(404)
+    
+    lines = [f"{job_id}  {started_at:%Y-%m-%d %H:%M:%S}  {duration:8.3f} с" for job_id, started_at, duration in tracing.recent_jobs()]
+    return Response("\n".join(lines) + "\n", mimetype='text/plain')
+
+@app.route('/trace/<job_id>')
+def trace_detail(job_id):
+    if not is_admin_request():
+        abort(404)
+    
+    waterfall = tracing.render_waterfall(job_id)
+    if waterfall is None:
+        abort(404)
+    return Response(waterfall + "\n", mimetype='text/plain')
+
+# Маршрут для пакетной генерации статей по файлу с матчами
+@app.route('/bulk', methods=['POST'])
+def bulk_generate():
+    """
+    Генерирует статьи по файлу в формате "@Get articles" (поле file или тело запроса)
+    и возвращает zip-архив; отчет - в заголовках X-Bulk-* и в report.json архива.
+    
+    Каталог результатов определяется содержимым файла, поэтому повторная отправка
+    того же файла (например, после обрыва соединения) продолжает генерацию.
+    """
+    if not is_admin_request():
+        abort(404)
+    
+    import bulk
+    
+    upload = request.files.get('file')
+    text = upload.read().decode('utf-8') if upload else request.get_data(as_text=True)
+    if not text.strip():
+        abort(400)
+    
+    output_dir = os.path.join(bulk.BULK_OUTPUT_DIR, hashlib.sha256(text.encode('utf-8')).hexdigest()[:16])
+    # Из запроса можно только уменьшить количество потоков (не больше BULK_WORKERS)
+    workers = max(1, min(request.args.get('workers', type=int) or bulk.BULK_WORKERS, bulk.BULK_WORKERS))
+    report = bulk.run_bulk(text, output_dir, workers=workers, resume=request.args.get('resume', 'true') != 'false')
+    
+    headers = {
+        'Content-Disposition': 'attachment; filename="articles.zip"',
+        'X-Bulk-Matches': str(report['matches']),
+        'X-Bulk-Generated': str(report['generated']),
+        'X-Bulk-Skipped': str(report['skipped']),
+        'X-Bulk-Failed': str(report['failed']),
+        'X-Bulk-Seconds': str(report['seconds']),
+        'X-Bulk-Articles-Per-Minute': str(report['articles_per_minute']),
+    }
+    return Response(bulk.build_archive(output_dir), mimetype='application/zip', headers=headers)
+
 # Маршрут для установки webhook
 @app.route('/set_webhook')
 def set_webhook():
-    webhook_url = f"{APP_URL}/{WEBHOOK_PATH}"
-    s = bot.set_webhook(webhook_url)
+    webhook_url = get_webhook_url()
+    s = get_bot().set_webhook(webhook_url, **webhook_secret_kwargs())
     if s:
         return f"Webhook установлен на {webhook_url}!"
     else:
         return "Ошибка установки webhook"
 
-def run_polling():
-    """Запуск бота в режиме polling (для локальной разработки)."""
-    updater = Updater(TELEGRAM_TOKEN)
-    dispatcher = updater.dispatcher
+def process_polled_update(update):
+    """Обрабатывает обновление из getUpdates теми же обработчиками, что и webhook."""
+    if is_duplicate_update(update.update_id):
+        return
+    try:
+        cleanup_processing_messages()
+        get_dispatcher().process_update(update)
+    except Exception as e:
+        logger.error(f"Ошибка при обработке обновления {update.update_id}: {e}")
+
+def run_polling(workers=POLLING_WORKERS):
+    """
+    Запуск бота в режиме long polling (для хостов без входящего HTTPS).
+    
+    Использует тот же диспетчер, что и webhook (setup_bot). Обновления
+    запрашиваются пачками через getUpdates с долгим ожиданием и обрабатываются
+    пулом из workers потоков, поэтому, как и в режиме webhook, задания разных
+    пользователей выполняются одновременно. Если все потоки заняты, новые
+    обновления не запрашиваются (остаются у Telegram до освобождения потока).
+    Смещение подтверждает получение обновлений следующим запросом getUpdates.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from telegram.error import Conflict, NetworkError, RetryAfter
     
-    # Регистрируем обработчики команд
-    dispatcher.add_handler(CommandHandler("start", start))
-    dispatcher.add_handler(CommandHandler("help", help_command))
-    dispatcher.add_handler(CommandHandler("menu", setup_menu))
-    dispatcher.add_handler(CommandHandler("example", example_command))
-    dispatcher.add_handler(CommandHandler("cancel", cancel_processing))
+    # getUpdates не работает, пока установлен webhook
+    get_bot().delete_webhook()
+    setup_bot()
+    start_job_recovery()
     
-    # Обработчик обычных сообщений и кнопок
-    dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, process_text_or_buttons))
+    slots = threading.BoundedSemaphore(workers)
     
-    # Запускаем бота
-    updater.start_polling()
-    updater.idle()
+    def run(update):
+        try:
+            process_polled_update(update)
+        finally:
+            slots.release()
+    
+    logger.info(f"Запуск polling: {workers} потоков, ожидание getUpdates {POLLING_TIMEOUT} с")
+    offset = None
+    backoff = 1
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="polling")
+    try:
+        while True:
+            try:
+                updates = get_bot().get_updates(
+                    offset=offset, limit=POLLING_BATCH_SIZE, timeout=POLLING_TIMEOUT,
+                    allowed_updates=["message"]
+                )
+                backoff = 1
+            except RetryAfter as e:
+                time.sleep(e.retry_after)
+                continue
+            except (Conflict, NetworkError) as e:
+                logger.warning(f"Ошибка getUpdates: {e}, повтор через {backoff} с")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, POLLING_MAX_BACKOFF)
+                continue
+            except Exception as e:
+                # Прочие TelegramError (BadRequest, Unauthorized...) и непредвиденные ошибки
+                # не должны останавливать получение обновлений
+                logger.error(f"Непредвиденная ошибка getUpdates: {e}, повтор через {backoff} с")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, POLLING_MAX_BACKOFF)
+                continue
+            
+            for update in updates:
+                offset = update.update_id + 1
+                metrics.POLLED_UPDATES.inc()
+                slots.acquire()
+                executor.submit(run, update)
+    except KeyboardInterrupt:
+        logger.info("Остановка polling")
+    finally:
+        # Незавершенные задания возобновятся после перезапуска (хранилище заданий)
+        executor.shutdown(wait=False)
+
+def worker_loop():
+    """Забирает обновления из очереди и обрабатывает их теми же обработчиками, что и webhook."""
+    while True:
+        try:
+            update_json = job_store.store.claim_update()
+        except Exception as e:
+            logger.error(f"Ошибка при чтении очереди обновлений: {e}")
+            update_json = None
+        
+        if update_json is None:
+            time.sleep(WORKER_POLL_INTERVAL)
+            continue
+        
+        try:
+            cleanup_processing_messages()
+            process_update_json(update_json)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке обновления {update_json.get('update_id')}: {e}")
+
+def run_worker_process(threads):
+    """Процесс-обработчик: несколько потоков worker_loop и возобновление заданий."""
+    start_job_recovery()
+    workers = [threading.Thread(target=worker_loop, name=f"worker-{i}", daemon=True) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
 
-# Инициализируем бота для gunicorn
-print("Инициализация бота для gunicorn...")
-setup_bot()  # Вызываем setup_bot для инициализации диспетчера и вебхука
+def run_workers(processes=WORKER_PROCESSES, threads=WORKER_THREADS):
+    """
+    Запускает процессы-обработчики очереди обновлений и перезапускает
+    завершившиеся процессы.
+    """
+    import multiprocessing
+    
+    if not job_store.store.enabled:
+        logger.error("Процессам-обработчикам нужна очередь в хранилище заданий (JOB_STORE_ENABLED=true)")
+        sys.exit(1)
+    
+    logger.info(f"Запуск {processes} процессов-обработчиков по {threads} потоков")
+    workers = {}
+    try:
+        while True:
+            for i in range(processes):
+                if i not in workers or not workers[i].is_alive():
+                    if i in workers:
+                        logger.warning(f"Процесс-обработчик {i} завершился с кодом {workers[i].exitcode}, перезапуск")
+                    workers[i] = multiprocessing.Process(target=run_worker_process, args=(threads,), name=f"bot-worker-{i}")
+                    workers[i].start()
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for worker in workers.values():
+            worker.terminate()
 
 if __name__ == '__main__':
+    if '--set-webhook' in sys.argv:
+        # Однократная установка webhook при деплое
+        sys.exit(0 if register_webhook() else 1)
+    
+    if '--worker' in sys.argv:
+        # Обработчики очереди обновлений (webhook запущен с UPDATE_QUEUE_ENABLED=true)
+        run_workers()
+        sys.exit(0)
+    
     # Режим работы в зависимости от среды
-    if os.environ.get('USE_POLLING', 'False').lower() == 'true':
-        # Локальный запуск с polling
+    if USE_POLLING or '--polling' in sys.argv:
+        # Long polling (локально или на хосте без входящего HTTPS)
         print("Запуск бота в режиме polling...")
         run_polling()
     else:
         # Запуск на сервере с webhook
         print("Запуск бота в режиме webhook...")
         print(f"Используется путь webhook: /{WEBHOOK_PATH}")
-        setup_bot()
+        if WEBHOOK_AUTO_REGISTER:
+            register_webhook()
+        if not UPDATE_QUEUE_ENABLED:
+            start_job_recovery()
         # Запуск Flask приложения с опциями безопасности
-        app.run(host='0.0.0.0', port=PORT, threaded=True) 
\ No newline at end of file
+        app.run(host='0.0.0.0', port=PORT, threaded=True) 
@@ -0,0 +1,167 @@
+"""
+Пакетная генерация статей по файлу с матчами в формате "@Get articles".
+
+В отличие от обработки сообщения в Telegram, файл разбирается целиком (без
+ограничения MAX_MATCHES_ALLOWED), матчи обрабатываются параллельно, а
+статьи записываются в каталог, по файлу на матч. Уже готовые статьи при
+повторном запуске пропускаются, поэтому прерванную генерацию можно
+продолжить. Результат при необходимости упаковывается в zip-архив.
+
+Запуск из командной строки:
+    python bulk.py "Get articles" --output articles --archive articles.zip
+"""
+import os
+import re
+import io
+import sys
+import json
+import time
+import logging
+import zipfile
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import bot
+import enrichment
+
+logger = logging.getLogger(__name__)
+
+# Количество матчей, обрабатываемых одновременно
+BULK_WORKERS = int(os.getenv("BULK_WORKERS", 8))
+# Каталог для результатов пакетной генерации через HTTP
+BULK_OUTPUT_DIR = os.getenv("BULK_OUTPUT_DIR", "bulk_output")
+# Имя файла с отчетом в каталоге и архиве
+REPORT_NAME = "report.json"
+
+def article_name(match):
+    """Имя файла статьи: дата блока и номер матча (номера в блоках повторяются)."""
+    date_part = re.sub(r"[^\w]+", "-", match.get('date') or "без-даты").strip("-")
+    return f"{date_part}-{int(match['number']):03d}.md"
+
+def render_article(match, predictions):
+    """Markdown-файл с прогнозами матча (для "Все X матчей" - несколько прогнозов)."""
+    if not isinstance(predictions, list):
+        predictions = [predictions]
+    title = f"Все матчи: {match['tournament']}" if match.get('is_all_matches') else match['teams']
+    lines = [
+        f"# {title}",
+        "",
+        f"Турнир: {match['tournament']}  ",
+        f"Дата: {match.get('date', '')}",
+    ]
+    for prediction in predictions:
+        lines.extend(["", f"## {prediction['teams']}", "", prediction['prediction'].strip()])
+    return "\n".join(lines) + "\n"
+
+def _write_file(path, content):
+    # Запись через временный файл: прерванная запись не оставляет неполной статьи
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+def _generate(match, path, profile):
+    match_info = bot.search_match_info(match, profile)
+    predictions = bot.generate_match_prediction(match_info, match['min_symbols'])
+    content = render_article(match, predictions)
+    _write_file(path, content)
+    return len(predictions) if isinstance(predictions, list) else 1
+
+def run_bulk(text, output_dir, workers=BULK_WORKERS, resume=True, profile=None):
+    """
+    Генерирует статьи для всех матчей из текста в формате "@Get articles".
+
+    Args:
+        text: Содержимое файла с матчами
+        output_dir: Каталог для статей
+        workers: Количество матчей, обрабатываемых одновременно
+        resume: Пропускать матчи, статьи для которых уже есть в каталоге
+        profile: Профиль сбора информации (по умолчанию ENRICHMENT_PROFILE_BULK, см. enrichment)
+
+    Returns:
+        dict: Отчет (количество матчей, готовых, пропущенных и неудачных, время и скорость)
+    """
+    started = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+
+    matches = [match for block in bot.parse_match_text(text, limit=False) for match in block['matches']]
+    pending = []
+    skipped = 0
+    for match in matches:
+        path = os.path.join(output_dir, article_name(match))
+        if resume and os.path.exists(path):
+            skipped += 1
+        else:
+            pending.append((match, path))
+
+    logger.info(f"Пакетная генерация: матчей {len(matches)}, уже готово {skipped}, в работе {len(pending)}")
+
+    def process(entry):
+        match, path = entry
+        try:
+            return _generate(match, path, enrichment.profile_for('bulk', profile))
+        except Exception as e:
+            logger.error(f"Ошибка пакетной генерации для матча {os.path.basename(path)}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(process, pending))
+
+    duration = time.perf_counter() - started
+    articles = sum(result for result in results if result is not None)
+    report = {
+        'matches': len(matches),
+        'generated': sum(1 for result in results if result is not None),
+        'skipped': skipped,
+        'failed': sum(1 for result in results if result is None),
+        'articles': articles,
+        'seconds': round(duration, 3),
+        'articles_per_minute': round(articles / duration * 60, 2) if duration > 0 else 0.0,
+    }
+    _write_file(os.path.join(output_dir, REPORT_NAME), json.dumps(report, ensure_ascii=False, indent=2))
+    logger.info(
+        f"Пакетная генерация завершена: готово {report['generated']}, пропущено {skipped}, ошибок {report['failed']}, "
+        f"{duration:.1f} с, {report['articles_per_minute']} статей/мин"
+    )
+    return report
+
+def build_archive(output_dir, target=None):
+    """
+    Упаковывает статьи и отчет из каталога в zip-архив.
+
+    Args:
+        output_dir: Каталог со статьями
+        target: Путь к архиву или файловый объект; если не указан, архив возвращается в виде bytes
+    """
+    buffer = target if target is not None else io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name in sorted(os.listdir(output_dir)):
+            if name.endswith(".md") or name == REPORT_NAME:
+                archive.write(os.path.join(output_dir, name), arcname=name)
+    if target is None:
+        return buffer.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная генерация статей по файлу в формате \"@Get articles\"")
+    parser.add_argument("fixtures", help="Файл с матчами ('-' - стандартный ввод)")
+    parser.add_argument("--output", default="articles", help="Каталог для статей")
+    parser.add_argument("--archive", help="Путь к zip-архиву с результатами")
+    parser.add_argument("--workers", type=int, default=BULK_WORKERS, help="Матчей одновременно")
+    parser.add_argument("--no-resume", action="store_true", help="Генерировать заново уже готовые статьи")
+    parser.add_argument("--enrichment", choices=enrichment.PROFILES, help="Профиль сбора информации о матчах")
+    args = parser.parse_args()
+
+    if args.fixtures == "-":
+        text = sys.stdin.read()
+    else:
+        with open(args.fixtures, encoding="utf-8") as f:
+            text = f.read()
+
+    report = run_bulk(text, args.output, workers=args.workers, resume=not args.no_resume, profile=args.enrichment)
+    if args.archive:
+        build_archive(args.output, args.archive)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 1 if report['failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
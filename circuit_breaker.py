@@ -0,0 +1,85 @@
+"""
+Предохранители (circuit breaker) для внешних API.
+
+После серии подряд идущих ошибок предохранитель размыкается, и запросы к
+API не выполняются до истечения паузы: вызывающий код сразу переходит к
+запасному варианту вместо ожидания таймаутов и повторов. После паузы
+пропускается один пробный запрос, успех которого снова замыкает цепь.
+"""
+import time
+import threading
+
+import metrics
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Все предохранители процесса (для /ready)
+breakers = {}
+
+class CircuitBreaker:
+    """Предохранитель для одного внешнего API."""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+        breakers[name] = self
+        metrics.CIRCUIT_BREAKER_STATE.set(0, name=name)
+
+    def _set_state(self, state):
+        self._state = state
+        metrics.CIRCUIT_BREAKER_STATE.set(_STATE_VALUES[state], name=self.name)
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """Разрешен ли запрос к API."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                # Пропускаем один пробный запрос
+                self._set_state(HALF_OPEN)
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            if self._state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_canceled(self):
+        """
+        Запрос прерван без результата (например, отменой задания - asyncio.CancelledError).
+
+        Если это был пробный запрос, следующий запрос снова становится пробным,
+        иначе предохранитель остался бы полуоткрытым и отклонял все запросы.
+        """
+        with self._lock:
+            if self._state == HALF_OPEN:
+                # Пауза уже истекла (_opened_at не меняется), поэтому allow пропустит новый пробный запрос
+                self._set_state(OPEN)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+class CircuitOpenError(Exception):
+    """Запрос не выполнен, так как предохранитель разомкнут."""
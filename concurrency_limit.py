@@ -0,0 +1,138 @@
+"""
+Адаптивное ограничение количества одновременных запросов к внешним API.
+
+Лимит подбирается по алгоритму AIMD: пока задержка ответов стабильна и
+лимит действительно используется, он растет на единицу за "окно" из limit
+успешных запросов; при перегрузке (ответ 429, таймаут) лимит умножается на
+ADAPTIVE_BACKOFF, но не чаще одного раза за среднее время ответа, чтобы
+пачка одновременных ошибок не обрушила его до минимума. Задержка считается
+стабильной, если ее быстрое скользящее среднее не превышает медленное более
+чем в ADAPTIVE_TOLERANCE раз. Текущий лимит и число запросов в работе
+доступны в метриках.
+"""
+import os
+import time
+import asyncio
+import threading
+from contextlib import contextmanager, asynccontextmanager
+
+import metrics
+
+ADAPTIVE_CONCURRENCY_ENABLED = os.getenv("ADAPTIVE_CONCURRENCY_ENABLED", "true").lower() == "true"
+# Множитель лимита при перегрузке
+ADAPTIVE_BACKOFF = float(os.getenv("ADAPTIVE_BACKOFF", 0.7))
+# Во сколько раз недавняя задержка может превышать обычную, чтобы лимит еще рос
+ADAPTIVE_TOLERANCE = float(os.getenv("ADAPTIVE_TOLERANCE", 1.5))
+# Коэффициенты быстрого и медленного скользящих средних задержки
+_FAST_ALPHA = 0.3
+_SLOW_ALPHA = 0.02
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+class AdaptiveLimiter:
+    """Адаптивный лимит одновременных запросов к одному внешнему API."""
+
+    def __init__(self, name, initial_limit, min_limit=1, max_limit=100):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self._limit = float(initial_limit)
+        self._inflight = 0
+        self._fast_latency = None
+        self._slow_latency = None
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        # Асинхронные ожидающие: (цикл событий, future), пробуждаются при освобождении места
+        self._async_waiters = []
+        metrics.UPSTREAM_CONCURRENCY_LIMIT.set(int(self._limit), upstream=name)
+        metrics.UPSTREAM_INFLIGHT.set(0, upstream=name)
+
+    @property
+    def limit(self):
+        """Текущий лимит одновременных запросов."""
+        return max(self.min_limit, int(self._limit))
+
+    def _try_acquire(self):
+        if not ADAPTIVE_CONCURRENCY_ENABLED or self._inflight < self.limit:
+            self._inflight += 1
+            metrics.UPSTREAM_INFLIGHT.set(self._inflight, upstream=self.name)
+            return True
+        return False
+
+    def _release(self, latency):
+        with self._condition:
+            saturated = self._inflight >= self.limit
+            self._inflight -= 1
+            metrics.UPSTREAM_INFLIGHT.set(self._inflight, upstream=self.name)
+
+            if latency is not None:
+                if self._fast_latency is None:
+                    self._fast_latency = self._slow_latency = latency
+                else:
+                    self._fast_latency += _FAST_ALPHA * (latency - self._fast_latency)
+                    self._slow_latency += _SLOW_ALPHA * (latency - self._slow_latency)
+
+                # Аддитивный рост: только если лимит упирается в нагрузку и задержка стабильна
+                stable = self._fast_latency <= self._slow_latency * ADAPTIVE_TOLERANCE
+                if saturated and stable and self._limit < self.max_limit:
+                    self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+                    metrics.UPSTREAM_CONCURRENCY_LIMIT.set(self.limit, upstream=self.name)
+            self._condition.notify_all()
+            self._wake_async_waiters()
+
+    def _wake_async_waiters(self):
+        # Место могут освобождать потоки, поэтому future завершается в потоке своего цикла
+        for loop, waiter in self._async_waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+        self._async_waiters = []
+
+    def record_overload(self):
+        """Сигнал перегрузки API (429, таймаут): мультипликативное снижение лимита."""
+        with self._condition:
+            now = time.monotonic()
+            if now - self._last_decrease < (self._fast_latency or 0):
+                return
+            self._last_decrease = now
+            self._limit = max(self.min_limit, self._limit * ADAPTIVE_BACKOFF)
+            metrics.UPSTREAM_CONCURRENCY_LIMIT.set(self.limit, upstream=self.name)
+
+    @contextmanager
+    def slot(self):
+        """Ожидает места в пределах лимита на время запроса и учитывает его задержку."""
+        with self._condition:
+            while not self._try_acquire():
+                self._condition.wait()
+        started = time.perf_counter()
+        latency = None
+        try:
+            yield
+            latency = time.perf_counter() - started
+        finally:
+            # Задержка неудачных запросов не учитывается: таймауты сообщаются через record_overload
+            self._release(latency)
+
+    @asynccontextmanager
+    async def async_slot(self):
+        """Асинхронный вариант slot (ожидание не блокирует цикл событий)."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self._try_acquire():
+                    break
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            try:
+                await waiter
+            finally:
+                with self._condition:
+                    if (loop, waiter) in self._async_waiters:
+                        self._async_waiters.remove((loop, waiter))
+        started = time.perf_counter()
+        latency = None
+        try:
+            yield
+            latency = time.perf_counter() - started
+        finally:
+            self._release(latency)
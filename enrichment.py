@@ -0,0 +1,81 @@
+"""
+Профили сбора информации о матчах (глубина обогащения).
+
+Профили упорядочены от самого дешевого к самому полному:
+- none: без данных - только шаблонные описания команд
+- cached: форма команд и личные встречи из локальной базы результатов, без запросов к API
+- light: поиск команды и последние матчи (searchteams.php, eventslast.php), без состава
+- full: поиск команды, последние матчи и состав (плюс searchplayers.php)
+
+Профиль задается отдельно для каждого типа запроса (упрощенный формат,
+формат "@Get articles", пакетная генерация) и автоматически понижается при
+нагрузке: когда количество обрабатываемых сообщений достигает
+ENRICHMENT_LIGHT_LOAD, используется не больше light, а при
+ENRICHMENT_CACHED_LOAD или разомкнутом предохранителе TheSportsDB - не больше
+cached. Так задержка и расход квоты API обмениваются на качество статей.
+"""
+import os
+
+import metrics
+import circuit_breaker
+
+NONE = "none"
+CACHED = "cached"
+LIGHT = "light"
+FULL = "full"
+PROFILES = (NONE, CACHED, LIGHT, FULL)
+
+def _profile_from_env(name, default):
+    value = os.getenv(name, default).lower()
+    return value if value in PROFILES else default
+
+# Профили по типам запросов
+ENRICHMENT_PROFILES = {
+    'simple': _profile_from_env("ENRICHMENT_PROFILE_SIMPLE", CACHED),
+    'structured': _profile_from_env("ENRICHMENT_PROFILE_STRUCTURED", FULL),
+    'bulk': _profile_from_env("ENRICHMENT_PROFILE_BULK", FULL),
+}
+# Количество обрабатываемых сообщений, начиная с которого профиль понижается до light и до cached
+ENRICHMENT_LIGHT_LOAD = int(os.getenv("ENRICHMENT_LIGHT_LOAD", 20))
+ENRICHMENT_CACHED_LOAD = int(os.getenv("ENRICHMENT_CACHED_LOAD", 40))
+
+# Функция, возвращающая текущую нагрузку (задается в bot)
+_load_function = None
+
+def set_load_function(function):
+    """Задает функцию текущей нагрузки (количество обрабатываемых сообщений)."""
+    global _load_function
+    _load_function = function
+
+def uses_api(profile):
+    """Выполняет ли профиль запросы к TheSportsDB."""
+    return profile in (LIGHT, FULL)
+
+def _cap(profile, limit):
+    return min(profile, limit, key=PROFILES.index)
+
+def profile_for(kind, requested=None):
+    """
+    Профиль для запроса с учетом нагрузки и состояния TheSportsDB.
+
+    Args:
+        kind: Тип запроса ('simple', 'structured' или 'bulk')
+        requested: Явно запрошенный профиль (по умолчанию - из ENRICHMENT_PROFILES)
+
+    Returns:
+        str: Один из PROFILES
+    """
+    profile = requested or ENRICHMENT_PROFILES.get(kind, FULL)
+    breaker = circuit_breaker.breakers.get("thesportsdb")
+    load = _load_function() if _load_function is not None else 0
+
+    if uses_api(profile) and breaker is not None and breaker.state == circuit_breaker.OPEN:
+        # Запросы к API все равно не выполнятся - локальные данные лучше заглушек
+        profile = _cap(profile, CACHED)
+    elif load >= ENRICHMENT_CACHED_LOAD:
+        profile = _cap(profile, CACHED)
+    elif load >= ENRICHMENT_LIGHT_LOAD:
+        profile = _cap(profile, LIGHT)
+
+    metrics.ENRICHMENT_PROFILES.inc(kind=kind, profile=profile)
+    return profile
@@ -0,0 +1,219 @@
+"""
+Запасной генератор статей-прогнозов на случай недоступности OpenAI.
+
+Статья собирается за один проход из шаблонов абзацев с несколькими
+вариантами формулировок и использует собранные данные о матче (форма
+команд, ключевые игроки, личные встречи). Выбор вариантов зависит от
+команд и турнира, поэтому статьи о разных матчах отличаются, а повторная
+генерация для того же матча дает тот же текст. Недостающий объем
+добирается неповторяющимися абзацами, а не копированием одного абзаца.
+"""
+import zlib
+import random
+
+from team_form import WIN, DRAW
+
+INTRO_TEMPLATES = (
+    "Предстоящий матч между {team1} и {team2} обещает быть интересным противостоянием. Обе команды настроены на результат и готовы показать качественный футбол.",
+    "{team1} и {team2} проведут встречу, от которой болельщики ждут напряженной борьбы. Турнир {tournament} не прощает ошибок, и цена каждого очка высока.",
+    "В рамках турнира {tournament} {team1} принимает {team2}. Соперники хорошо знают сильные стороны друг друга, поэтому исход матча решат детали.",
+    "Матч {team1} - {team2} станет одним из самых любопытных в программе турнира {tournament}. Команды подходят к нему с разным настроем, но с одинаковыми амбициями.",
+    "Встреча {team1} и {team2} может многое изменить в турнирном положении обеих команд. Тренерам предстоит найти правильный баланс между атакой и обороной.",
+)
+
+FORM_TEMPLATES = (
+    "Баланс {team} в последних матчах (В-Н-П): {record}, разница мячей {goals_for}:{goals_against}. {streak_text}",
+    "{team} подходит к игре с результатами {sequence} в последних встречах (В - победа, Н - ничья, П - поражение) и соотношением мячей {goals_for}:{goals_against}. {streak_text}",
+    "Последние результаты {team} (В-Н-П): {record}; забито {goals_for}, пропущено {goals_against}. {streak_text}",
+)
+
+GENERIC_TEAM_TEMPLATES = (
+    "{team} в последних матчах демонстрирует стабильную игру, особенно в атаке, где лидеры команды создают множество опасных моментов. Тренерский штаб провел хорошую подготовительную работу.",
+    "{team} отличается дисциплинированной игрой в обороне и быстрыми контратаками. Ключевые игроки находятся в рабочей форме и готовы решать исход матча.",
+    "{team} делает ставку на контроль мяча и терпеливые позиционные атаки. Команда умеет менять темп игры по ходу встречи.",
+    "{team} сильна в борьбе за подборы и на стандартных положениях. Соперникам непросто навязать ей свою игру.",
+)
+
+PLAYERS_TEMPLATES = (
+    "У {team} многое будет зависеть от игроков, которые задают тон в атаке и обороне: {players}.",
+    "Среди тех, кто может повлиять на исход встречи в составе {team}, стоит выделить: {players}.",
+    "Ключевые фигуры {team} в этом матче - {players}.",
+)
+
+HEAD_TO_HEAD_TEMPLATES = (
+    "История личных встреч: {head_to_head}. Этот опыт команды наверняка учтут при подготовке.",
+    "Статистика очных встреч ({head_to_head}) добавляет матчу интриги.",
+)
+
+NO_HEAD_TO_HEAD_TEMPLATES = (
+    "Очные встречи этих команд обычно проходят в упорной борьбе, и в этот раз стоит ожидать того же.",
+    "Соперники хорошо изучили друг друга, поэтому многое решит готовность реализовать свои моменты.",
+)
+
+# Дополнительные абзацы собираются из трех частей; первые 512 сочетаний не повторяются
+FILLER_OPENINGS = (
+    "Большое значение будет иметь борьба в центре поля.",
+    "Не стоит забывать и о физической готовности игроков.",
+    "Важную роль сыграют стандартные положения.",
+    "Многое решит то, какая команда первой забьет.",
+    "Тренерские решения по ходу матча могут стать определяющими.",
+    "Отдельного внимания заслуживает игра на флангах.",
+    "Психологический настрой команд в таком матче не менее важен, чем тактика.",
+    "Скамейка запасных может оказаться решающим фактором во втором тайме.",
+)
+FILLER_MIDDLES = (
+    "{team1} старается действовать первым номером и прессинговать соперника высоко.",
+    "{team2} умеет терпеливо ждать своих моментов и быстро переходить из обороны в атаку.",
+    "{team1} в последнее время заметно прибавила в организации атак.",
+    "{team2} уделяет много внимания надежности в обороне.",
+    "Игроки {team1} хорошо взаимодействуют в атакующих комбинациях.",
+    "У {team2} есть футболисты, способные решить эпизод индивидуальным действием.",
+    "{team1} нередко забивает после розыгрыша стандартов.",
+    "{team2} опасна на контратаках, особенно когда соперник увлекается атакой.",
+)
+FILLER_CLOSINGS = (
+    "Поэтому зрителей ждет содержательный футбол.",
+    "Ошибки в таком матче могут стоить очень дорого.",
+    "Ставка на дисциплину может принести свои плоды.",
+    "Это делает исход встречи менее предсказуемым.",
+    "Для болельщиков это хороший повод следить за игрой с первых минут.",
+    "Именно такие детали часто определяют победителя.",
+    "Ключевым будет умение сохранить концентрацию до финального свистка.",
+    "Удачно выбранный момент для замен может перевернуть ход игры.",
+)
+
+PREDICTION_TEMPLATES = {
+    "team1": (
+        "Учитывая текущую форму обеих команд, тактические особенности и мотивацию, я прогнозирую победу {team1} со счетом {score}.",
+        "Итоговый прогноз: {team1} окажется сильнее, счет {score}.",
+    ),
+    "team2": (
+        "Учитывая текущую форму обеих команд, тактические особенности и мотивацию, я прогнозирую победу {team2} со счетом {score}.",
+        "Итоговый прогноз: {team2} увезет победу, счет {score}.",
+    ),
+    "draw": (
+        "Силы соперников примерно равны, поэтому я прогнозирую ничью со счетом {score}.",
+        "Итоговый прогноз: команды разойдутся миром, счет {score}.",
+    ),
+}
+
+# Преимущество своего поля при сравнении силы команд (очков за матч)
+HOME_ADVANTAGE = 0.3
+
+def _format_values(match):
+    return {
+        "team1": match.get("team1", "Команда 1"),
+        "team2": match.get("team2", "Команда 2"),
+        "tournament": match.get("tournament", "Турнир"),
+    }
+
+def _streak_text(team, form):
+    result, length = form["streak"]
+    if length < 2:
+        return ""
+    if result == WIN:
+        return f"Команда выигрывает матчи подряд (серия - {length}) и подходит к игре на подъеме."
+    if result == DRAW:
+        return f"Несколько последних встреч подряд ({length}) {team} завершила вничью."
+    return f"Серия поражений ({length} подряд) заставляет {team} искать новые решения."
+
+def _team_paragraph(rng, team, form):
+    if form:
+        template = rng.choice(FORM_TEMPLATES)
+        return template.format(
+            team=team,
+            record="-".join(map(str, form["record"])),
+            sequence=form["sequence"],
+            goals_for=form["goals_for"],
+            goals_against=form["goals_against"],
+            streak_text=_streak_text(team, form),
+        ).strip()
+    return rng.choice(GENERIC_TEAM_TEMPLATES).format(team=team)
+
+def _key_players(lineup):
+    """Имена игроков из списка строк "Имя (позиция)" или None для текстовых заглушек."""
+    if not isinstance(lineup, (list, tuple)):
+        return None
+    names = [str(player).split(" (")[0].strip() for player in lineup[:3]]
+    return ", ".join(name for name in names if name) or None
+
+def _strength(form):
+    if not form:
+        return None
+    games = sum(form["record"]) or 1
+    wins, draws, _ = form["record"]
+    return (3 * wins + draws) / games + (form["goals_for"] - form["goals_against"]) / games * 0.5
+
+def _prediction(match):
+    """Исход и счет по форме команд (без данных - победа хозяев 2:1, как раньше)."""
+    strength1 = _strength(match.get("form_team1"))
+    strength2 = _strength(match.get("form_team2"))
+    if strength1 is None or strength2 is None:
+        return "team1", "2:1"
+
+    difference = strength1 + HOME_ADVANTAGE - strength2
+    if difference > 1.0:
+        return "team1", "2:0"
+    if difference > 0.4:
+        return "team1", "2:1"
+    if difference < -1.0:
+        return "team2", "0:2"
+    if difference < -0.4:
+        return "team2", "1:2"
+    return "draw", "1:1"
+
+def build_article(match, min_symbols):
+    """
+    Создает статью-прогноз не короче min_symbols символов.
+
+    Args:
+        match: Данные о матче (team1, team2, tournament и, если есть, form_team1,
+            form_team2, lineup_team1, lineup_team2, head_to_head)
+        min_symbols: Минимальная длина статьи
+
+    Returns:
+        dict: {'teams': ..., 'prediction': ...}
+    """
+    values = _format_values(match)
+    rng = random.Random(zlib.crc32(f"{values['team1']}|{values['team2']}|{values['tournament']}".encode("utf-8")))
+
+    paragraphs = [
+        f"Прогноз на матч {values['team1']} - {values['team2']} в рамках турнира {values['tournament']}:",
+        rng.choice(INTRO_TEMPLATES).format(**values),
+        _team_paragraph(rng, values["team1"], match.get("form_team1")),
+        _team_paragraph(rng, values["team2"], match.get("form_team2")),
+    ]
+    for team_key, lineup_key in (("team1", "lineup_team1"), ("team2", "lineup_team2")):
+        players = _key_players(match.get(lineup_key))
+        if players:
+            paragraphs.append(rng.choice(PLAYERS_TEMPLATES).format(team=values[team_key], players=players))
+    if match.get("head_to_head"):
+        paragraphs.append(rng.choice(HEAD_TO_HEAD_TEMPLATES).format(head_to_head=match["head_to_head"]))
+    else:
+        paragraphs.append(rng.choice(NO_HEAD_TO_HEAD_TEMPLATES))
+
+    outcome, score = _prediction(match)
+    final = rng.choice(PREDICTION_TEMPLATES[outcome]).format(score=score, **values)
+
+    # Добираем объем неповторяющимися абзацами (длина считается по ходу, без повторной сборки текста)
+    length = sum(len(paragraph) + 2 for paragraph in paragraphs) + len(final)
+    openings = rng.sample(FILLER_OPENINGS, len(FILLER_OPENINGS))
+    middles = rng.sample(FILLER_MIDDLES, len(FILLER_MIDDLES))
+    closings = rng.sample(FILLER_CLOSINGS, len(FILLER_CLOSINGS))
+    count = len(openings)
+    index = 0
+    while length < min_symbols:
+        paragraph = " ".join((
+            openings[index % count],
+            middles[(index + index // count) % count].format(**values),
+            closings[(index + 2 * (index // count) + index // (count * count)) % count],
+        ))
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+        index += 1
+
+    paragraphs.append(final)
+    return {
+        'teams': f"{values['team1']} - {values['team2']}",
+        'prediction': "\n\n".join(paragraphs)
+    }
@@ -0,0 +1,36 @@
+"""
+Настройки gunicorn (файл читается gunicorn автоматически из рабочей директории).
+
+Webhook устанавливается один раз в мастер-процессе при запуске деплоя,
+а не при загрузке каждого воркера.
+"""
+import os
+import secrets
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Все воркеры должны использовать один и тот же путь webhook, поэтому
+# случайный путь генерируется здесь, до запуска воркеров
+if not os.environ.get("WEBHOOK_PATH"):
+    os.environ["WEBHOOK_PATH"] = secrets.token_hex(16)
+
+# Потоков в воркере: задания разных пользователей обрабатываются в одном процессе
+# и делят планировщик генерации (scheduler.py); 1 - прежний синхронный воркер
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+
+def on_starting(server):
+    """Однократная (идемпотентная) установка webhook в мастер-процессе."""
+    import bot
+
+    if bot.WEBHOOK_AUTO_REGISTER:
+        bot.register_webhook()
+
+def post_worker_init(worker):
+    """Возобновление заданий, прерванных перезапуском (в каждом воркере)."""
+    import bot
+
+    # В режиме очереди задания выполняют и возобновляют процессы-обработчики
+    if not bot.UPDATE_QUEUE_ENABLED:
+        bot.start_job_recovery()
@@ -0,0 +1,163 @@
+"""
+Хеджирование запросов к внешним API для сокращения "хвоста" задержек.
+
+Если запрос на чтение не получил ответа за время, в которое укладываются
+HEDGE_QUANTILE (по умолчанию 95%) недавних запросов того же эндпоинта,
+отправляется один дубликат и используется первый успешный ответ. Дубликаты
+расходуют общий бюджет: каждый запрос пополняет его на HEDGE_BUDGET_RATIO,
+дубликат тратит единицу, поэтому при общей деградации API дополнительная
+нагрузка не превышает HEDGE_BUDGET_RATIO от числа запросов.
+
+В синхронном режиме оба запроса выполняются в пуле потоков, и проигравший
+завершается в фоне (запрос requests нельзя прервать); в асинхронном режиме
+проигравший запрос отменяется.
+"""
+import os
+import math
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent import futures
+
+import metrics
+
+HEDGING_ENABLED = os.getenv("HEDGING_ENABLED", "true").lower() == "true"
+# Квантиль задержки, после которого отправляется дубликат
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", 0.95))
+# Доля запросов, для которых допускаются дубликаты
+HEDGE_BUDGET_RATIO = float(os.getenv("HEDGE_BUDGET_RATIO", 0.05))
+# Максимальный запас бюджета (дубликатов подряд)
+HEDGE_BUDGET_BURST = 10
+# Количество последних задержек эндпоинта для расчета квантиля и минимум до начала хеджирования
+HEDGE_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+
+class Hedger:
+    """Задержки запросов по эндпоинтам и бюджет дубликатов одного внешнего API."""
+
+    def __init__(self, name, max_workers=32):
+        self.name = name
+        self.max_workers = max_workers
+        self._latencies = {}
+        self._delays = {}
+        self._budget = 0.0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def delay(self, key):
+        """Задержка перед отправкой дубликата (секунды) или None, если данных еще мало."""
+        if not HEDGING_ENABLED:
+            return None
+        with self._lock:
+            self._budget = min(HEDGE_BUDGET_BURST, self._budget + HEDGE_BUDGET_RATIO)
+            return self._delays.get(key)
+
+    def observe(self, key, latency):
+        """Учитывает задержку успешного запроса к эндпоинту."""
+        with self._lock:
+            window = self._latencies.get(key)
+            if window is None:
+                window = self._latencies[key] = deque(maxlen=HEDGE_WINDOW)
+            window.append(latency)
+            # Квантиль пересчитывается раз в несколько наблюдений
+            if len(window) >= HEDGE_MIN_SAMPLES and len(window) % 10 == 0:
+                ordered = sorted(window)
+                self._delays[key] = ordered[min(len(ordered) - 1, math.ceil(HEDGE_QUANTILE * len(ordered)) - 1)]
+
+    def _try_spend(self):
+        with self._lock:
+            if self._budget < 1:
+                return False
+            self._budget -= 1
+            return True
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"hedge-{self.name}")
+            return self._executor
+
+    def _timed(self, key, request, accept):
+        started = time.perf_counter()
+        result = request()
+        if accept(result):
+            self.observe(key, time.perf_counter() - started)
+        return result
+
+    def call(self, key, request, accept=lambda result: True):
+        """
+        Выполняет запрос с хеджированием.
+
+        Args:
+            key: Эндпоинт (задержки учитываются отдельно по каждому)
+            request: Функция без аргументов, выполняющая запрос
+            accept: Проверка результата: неуспешный результат не считается победителем
+
+        Returns:
+            Первый успешный результат (или результат основного запроса, если успешных нет)
+        """
+        delay = self.delay(key)
+        if delay is None:
+            return self._timed(key, request, accept)
+
+        executor = self._get_executor()
+        primary = executor.submit(self._timed, key, request, accept)
+        try:
+            return primary.result(timeout=delay)
+        except futures.TimeoutError:
+            pass
+        if not self._try_spend():
+            metrics.HEDGED_REQUESTS.inc(upstream=self.name, result="no_budget")
+            return primary.result()
+
+        hedge = executor.submit(self._timed, key, request, accept)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and accept(future.result()):
+                    metrics.HEDGED_REQUESTS.inc(upstream=self.name, result="hedge" if future is hedge else "primary")
+                    return future.result()
+        metrics.HEDGED_REQUESTS.inc(upstream=self.name, result="failed")
+        return primary.result()
+
+    async def async_call(self, key, request, accept=lambda result: True):
+        """Асинхронный вариант call: request - функция, возвращающая корутину."""
+        delay = self.delay(key)
+
+        async def timed():
+            started = time.perf_counter()
+            result = await request()
+            if accept(result):
+                self.observe(key, time.perf_counter() - started)
+            return result
+
+        if delay is None:
+            return await timed()
+
+        primary = asyncio.ensure_future(timed())
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+            if not self._try_spend():
+                metrics.HEDGED_REQUESTS.inc(upstream=self.name, result="no_budget")
+                return await primary
+
+            hedge = asyncio.ensure_future(timed())
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and accept(task.result()):
+                        metrics.HEDGED_REQUESTS.inc(upstream=self.name, result="hedge" if task is hedge else "primary")
+                        return task.result()
+            metrics.HEDGED_REQUESTS.inc(upstream=self.name, result="failed")
+            return primary.result()
+        finally:
+            # Проигравший запрос (или оба при отмене вызывающего кода) больше не нужен
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
@@ -0,0 +1,95 @@
+"""
+Учет обрабатываемых сообщений с истечением устаревших записей.
+
+Все записи живут одинаковое время (MESSAGE_TTL), поэтому порядок добавления
+совпадает с порядком истечения: записи хранятся в OrderedDict, и очистка
+снимает просроченные записи с начала, не просматривая остальные. Индекс по
+пользователям позволяет отменить сообщения пользователя без перебора всех
+ключей. Все операции - амортизированно O(1) (отмена - O(сообщений
+пользователя)), поэтому время под блокировкой не растет с нагрузкой.
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд сообщение считается "зависшим" и удаляется из обрабатываемых
+MESSAGE_TTL = int(os.getenv("MESSAGE_TTL", 300))
+
+class InflightMessages:
+    """Обрабатываемые сообщения ("{user_id}_{message_id}") с индексом по пользователям."""
+
+    def __init__(self, ttl=MESSAGE_TTL):
+        self.ttl = ttl
+        # key -> (user_id, время добавления); порядок - по времени добавления
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def _remove(self, key):
+        user_id, _ = self._entries.pop(key)
+        keys = self._by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[user_id]
+
+    def add(self, key, user_id, replace=True):
+        """
+        Отмечает сообщение как обрабатываемое.
+
+        Args:
+            key: Ключ сообщения или идентификатор задания
+            user_id: Пользователь
+            replace: Обновить время, если сообщение уже отмечено
+
+        Returns:
+            bool: False, если сообщение уже обрабатывается (и replace=False)
+        """
+        with self._lock:
+            if key in self._entries:
+                if not replace:
+                    return False
+                self._remove(key)
+            self._entries[key] = (user_id, time.monotonic())
+            self._by_user.setdefault(user_id, set()).add(key)
+            return True
+
+    def discard(self, key):
+        """Удаляет сообщение из обрабатываемых (если оно есть)."""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def cancel_user(self, user_id):
+        """Удаляет все обрабатываемые сообщения пользователя. Возвращает их ключи."""
+        with self._lock:
+            keys = self._by_user.pop(user_id, set())
+            for key in keys:
+                del self._entries[key]
+        return keys
+
+    def expire(self):
+        """Удаляет записи старше ttl. Возвращает их ключи."""
+        deadline = time.monotonic() - self.ttl
+        expired = []
+        with self._lock:
+            while self._entries:
+                key, (_, added) = next(iter(self._entries.items()))
+                if added > deadline:
+                    break
+                self._remove(key)
+                expired.append(key)
+        for key in expired:
+            logger.warning(f"Удалено устаревшее сообщение {key} из обрабатываемых.")
+        return expired
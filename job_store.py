@@ -0,0 +1,319 @@
+"""
+Долговременное хранилище заданий (SQLite в режиме WAL).
+
+Задание - это список элементов (матчей) с сообщениями для пользователя.
+Для каждого элемента сохраняется сгенерированный прогноз и отметка о
+доставке, поэтому после перезапуска процесса незавершенное задание
+продолжается с первого недоставленного матча, а уже готовые прогнозы
+не генерируются повторно.
+
+Процесс, выполняющий задание, периодически обновляет heartbeat. Задания,
+heartbeat которых устарел (процесс остановлен или перезапущен), забирает
+на себя любой другой процесс (см. claim_stale_jobs).
+"""
+import os
+import json
+import time
+import socket
+import sqlite3
+import secrets
+import threading
+
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "jobs.db")
+JOB_STORE_ENABLED = os.getenv("JOB_STORE_ENABLED", "true").lower() == "true"
+# Период обновления heartbeat заданий процесса (секунды)
+JOB_HEARTBEAT_INTERVAL = 15
+# Задание считается брошенным, если heartbeat не обновлялся дольше (секунды)
+JOB_STALE_AFTER = 60
+# Сколько хранить завершенные задания (секунды)
+JOB_RETENTION = 24 * 60 * 60
+
+RUNNING = "running"
+DONE = "done"
+CANCELED = "canceled"
+FAILED = "failed"
+
+_process_id = None
+_process_pid = None
+
+def process_id():
+    """Идентификатор текущего процесса как владельца заданий (свой у каждого воркера после fork)."""
+    global _process_id, _process_pid
+    if _process_pid != os.getpid():
+        _process_pid = os.getpid()
+        _process_id = f"{socket.gethostname()}:{_process_pid}:{secrets.token_hex(4)}"
+    return _process_id
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    next_index INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    owner TEXT,
+    heartbeat REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_heartbeat ON jobs (status, heartbeat);
+CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user_id, status);
+CREATE TABLE IF NOT EXISTS job_results (
+    job_id TEXT NOT NULL,
+    item_index INTEGER NOT NULL,
+    prediction TEXT NOT NULL,
+    PRIMARY KEY (job_id, item_index)
+);
+CREATE TABLE IF NOT EXISTS seen_updates (
+    update_id INTEGER PRIMARY KEY,
+    seen_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS updates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+class JobStore:
+    """Хранилище заданий в файле SQLite (соединение на поток)."""
+
+    enabled = True
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._init_lock:
+                if not self._initialized:
+                    connection.executescript(SCHEMA)
+                    self._initialized = True
+        return connection
+
+    def _job_from_row(self, row):
+        payload = json.loads(row["payload"])
+        return {
+            "job_id": row["job_id"],
+            "user_id": row["user_id"],
+            "chat_id": row["chat_id"],
+            "items": payload["items"],
+            "outro": payload["outro"],
+            "next_index": row["next_index"],
+            "status": row["status"],
+        }
+
+    def create_job(self, job_id, user_id, chat_id, items, outro):
+        """Сохраняет новое задание (повторное создание с тем же id начинает его заново)."""
+        now = time.time()
+        payload = json.dumps({"items": items, "outro": outro}, ensure_ascii=False)
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("DELETE FROM job_results WHERE job_id = ?", (job_id,))
+            connection.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, user_id, chat_id, payload, next_index, status, owner, heartbeat, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 0, ?, ?, ?, ?, ?)",
+                (job_id, user_id, chat_id, payload, RUNNING, process_id(), now, now, now)
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return {"job_id": job_id, "user_id": user_id, "chat_id": chat_id, "items": items,
+                "outro": outro, "next_index": 0, "status": RUNNING}
+
+    def get_result(self, job_id, index):
+        """Сохраненный прогноз элемента задания или None."""
+        row = self._connection().execute(
+            "SELECT prediction FROM job_results WHERE job_id = ? AND item_index = ?", (job_id, index)
+        ).fetchone()
+        return json.loads(row["prediction"]) if row else None
+
+    def save_result(self, job_id, index, prediction):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO job_results (job_id, item_index, prediction) VALUES (?, ?, ?)",
+            (job_id, index, json.dumps(prediction, ensure_ascii=False))
+        )
+
+    def mark_delivered(self, job_id, index):
+        """Отмечает элемент доставленным: задание продолжится со следующего."""
+        now = time.time()
+        self._connection().execute(
+            "UPDATE jobs SET next_index = ?, heartbeat = ?, updated_at = ? WHERE job_id = ? AND next_index <= ?",
+            (index + 1, now, now, job_id, index)
+        )
+
+    def finish_job(self, job_id, status=DONE):
+        now = time.time()
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, owner = NULL, updated_at = ? WHERE job_id = ? AND status = ?",
+            (status, now, job_id, RUNNING)
+        )
+
+    def is_canceled(self, job_id):
+        row = self._connection().execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row is not None and row["status"] == CANCELED
+
+    def cancel_user_jobs(self, user_id):
+        """Отменяет все незавершенные задания пользователя. Возвращает их количество."""
+        now = time.time()
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = ?, owner = NULL, updated_at = ? WHERE user_id = ? AND status = ?",
+            (CANCELED, now, user_id, RUNNING)
+        )
+        return cursor.rowcount
+
+    def heartbeat(self):
+        """Обновляет heartbeat всех заданий, выполняемых текущим процессом."""
+        self._connection().execute(
+            "UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status = ?",
+            (time.time(), process_id(), RUNNING)
+        )
+
+    def claim_stale_jobs(self):
+        """
+        Забирает незавершенные задания, брошенные другими процессами.
+
+        Returns:
+            list: Задания, владельцем которых стал текущий процесс
+        """
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            rows = connection.execute(
+                "SELECT * FROM jobs WHERE status = ? AND heartbeat < ?", (RUNNING, now - JOB_STALE_AFTER)
+            ).fetchall()
+            for row in rows:
+                connection.execute(
+                    "UPDATE jobs SET owner = ?, heartbeat = ?, updated_at = ? WHERE job_id = ?",
+                    (process_id(), now, now, row["job_id"])
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return [self._job_from_row(row) for row in rows]
+
+    def purge_finished(self):
+        """Удаляет завершенные задания и запомненные update_id старше JOB_RETENTION."""
+        threshold = time.time() - JOB_RETENTION
+        connection = self._connection()
+        connection.execute(
+            "DELETE FROM job_results WHERE job_id IN (SELECT job_id FROM jobs WHERE status != ? AND updated_at < ?)",
+            (RUNNING, threshold)
+        )
+        connection.execute("DELETE FROM jobs WHERE status != ? AND updated_at < ?", (RUNNING, threshold))
+        connection.execute("DELETE FROM seen_updates WHERE seen_at < ?", (threshold,))
+
+    def mark_update_seen(self, update_id):
+        """
+        Запоминает update_id для всех процессов, использующих хранилище.
+
+        Returns:
+            bool: True, если обновление получено впервые
+        """
+        cursor = self._connection().execute(
+            "INSERT OR IGNORE INTO seen_updates (update_id, seen_at) VALUES (?, ?)", (update_id, time.time())
+        )
+        return cursor.rowcount == 1
+
+    def forget_update(self, update_id):
+        self._connection().execute("DELETE FROM seen_updates WHERE update_id = ?", (update_id,))
+
+    def enqueue_update(self, update_json):
+        """Ставит обновление Telegram в очередь для процессов-обработчиков."""
+        self._connection().execute(
+            "INSERT INTO updates (payload, created_at) VALUES (?, ?)",
+            (json.dumps(update_json, ensure_ascii=False), time.time())
+        )
+
+    def claim_update(self):
+        """
+        Забирает самое старое обновление из очереди.
+        
+        Обновление удаляется из очереди сразу (не более одной доставки): после
+        создания задания его сохранность обеспечивает хранилище заданий.
+        
+        Returns:
+            dict: Обновление Telegram или None, если очередь пуста
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT id, payload FROM updates ORDER BY id LIMIT 1").fetchone()
+            if row is not None:
+                connection.execute("DELETE FROM updates WHERE id = ?", (row["id"],))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return json.loads(row["payload"]) if row else None
+
+    def queued_updates(self):
+        """Количество обновлений, ожидающих обработки."""
+        return self._connection().execute("SELECT COUNT(*) FROM updates").fetchone()[0]
+
+class NullJobStore:
+    """Хранилище-заглушка, если долговременное хранение отключено."""
+
+    enabled = False
+
+    def create_job(self, job_id, user_id, chat_id, items, outro):
+        return {"job_id": job_id, "user_id": user_id, "chat_id": chat_id, "items": items,
+                "outro": outro, "next_index": 0, "status": RUNNING}
+
+    def get_result(self, job_id, index):
+        return None
+
+    def save_result(self, job_id, index, prediction):
+        pass
+
+    def mark_delivered(self, job_id, index):
+        pass
+
+    def finish_job(self, job_id, status=DONE):
+        pass
+
+    def is_canceled(self, job_id):
+        return False
+
+    def cancel_user_jobs(self, user_id):
+        return 0
+
+    def heartbeat(self):
+        pass
+
+    def claim_stale_jobs(self):
+        return []
+
+    def purge_finished(self):
+        pass
+
+    def mark_update_seen(self, update_id):
+        return True
+
+    def forget_update(self, update_id):
+        pass
+
+    def enqueue_update(self, update_json):
+        raise RuntimeError("Очередь обновлений требует хранилища заданий (JOB_STORE_ENABLED=true)")
+
+    def claim_update(self):
+        return None
+
+    def queued_updates(self):
+        return 0
+
+store = JobStore(JOB_STORE_PATH) if JOB_STORE_ENABLED and JOB_STORE_PATH else NullJobStore()
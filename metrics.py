@@ -0,0 +1,298 @@
+"""
+Метрики бота в текстовом формате Prometheus.
+
+Реализация без внешних зависимостей: счетчики, gauge и гистограммы с
+метками, потокобезопасные, со сбором значений в пределах процесса.
+При запуске нескольких воркеров gunicorn каждый воркер отдает свои метрики.
+"""
+import time
+import math
+import threading
+from contextlib import contextmanager
+
+# Границы корзин гистограмм длительности (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Все зарегистрированные метрики в порядке создания
+_registry = []
+_registry_lock = threading.Lock()
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+class _Metric:
+    """Базовый класс метрики с набором меток."""
+
+    type_name = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}, получено {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик."""
+
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+class Gauge(_Metric):
+    """
+    Текущее значение. Вместо set/inc можно передать callback, который
+    вызывается при каждом снятии метрик (для метрик без меток).
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self._callback = callback
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, callback):
+        self._callback = callback
+
+    def _samples(self):
+        if self._callback is not None:
+            try:
+                return [f"{self.name} {_format_value(self._callback())}"]
+            except Exception:
+                return []
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+class Histogram(_Metric):
+    """Гистограмма распределения значений (например, длительности этапов)."""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет длительность блока кода."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, dict(state, buckets=list(state["buckets"]))) for key, state in self._values.items()]
+        samples = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["buckets"]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                samples.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            samples.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            samples.append(f"{self.name}_count{labels} {state['count']}")
+        return samples
+
+def render():
+    """Возвращает все метрики в текстовом формате Prometheus."""
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+# Тип содержимого ответа /metrics
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ---------------------------------------------------------------------------
+# Метрики бота
+# ---------------------------------------------------------------------------
+
+PARSE_DURATION = Histogram(
+    "bot_parse_duration_seconds",
+    "Длительность разбора входящего сообщения",
+    ["format"]
+)
+THESPORTSDB_REQUEST_DURATION = Histogram(
+    "thesportsdb_request_duration_seconds",
+    "Длительность запросов к TheSportsDB (включая повторы)",
+    ["endpoint", "outcome"]
+)
+OPENAI_REQUEST_DURATION = Histogram(
+    "openai_request_duration_seconds",
+    "Длительность запросов к OpenAI",
+    ["model", "outcome"]
+)
+OPENAI_PROMPT_TOKENS = Histogram(
+    "openai_prompt_tokens",
+    "Размер промпта запроса к OpenAI (токены, подсчет до отправки)",
+    ["model"],
+    buckets=(100, 200, 300, 400, 500, 750, 1000, 1500, 2000, 3000, 4000)
+)
+OPENAI_ROUTED_REQUESTS = Counter(
+    "openai_routed_requests_total",
+    "Попытки получить прогноз по выбранной модели и их исход (ok, timeout, error, fallback)",
+    ["model", "outcome"]
+)
+OPENAI_TOKENS = Counter(
+    "openai_tokens_total",
+    "Расход токенов OpenAI по данным ответа (usage)",
+    ["model", "type"]
+)
+SCHEDULER_WAIT_DURATION = Histogram(
+    "bot_scheduler_wait_seconds",
+    "Время ожидания слота генерации прогноза в планировщике"
+)
+TELEGRAM_REQUEST_DURATION = Histogram(
+    "telegram_request_duration_seconds",
+    "Длительность запросов к Telegram Bot API",
+    ["method"]
+)
+WEBHOOK_UPDATES = Counter(
+    "bot_webhook_updates_total",
+    "Количество принятых webhook обновлений",
+    ["runtime"]
+)
+WEBHOOK_REJECTED = Counter(
+    "bot_webhook_rejected_total",
+    "Количество запросов к webhook, отклоненных по заголовкам (секретный токен, тип и размер тела)",
+    ["reason"]
+)
+HEDGED_REQUESTS = Counter(
+    "upstream_hedged_requests_total",
+    "Запросы, не получившие ответа за p95: чей ответ использован (primary, hedge, failed) или no_budget - дубликат не отправлен",
+    ["upstream", "result"]
+)
+POLLED_UPDATES = Counter(
+    "bot_polled_updates_total",
+    "Количество обновлений, полученных через getUpdates (режим polling)"
+)
+DUPLICATE_UPDATES = Counter(
+    "bot_duplicate_updates_total",
+    "Количество повторно доставленных обновлений (по update_id), подтвержденных без обработки",
+    ["runtime"]
+)
+RATE_LIMITED = Counter(
+    "bot_rate_limited_total",
+    "Количество запросов, отклоненных ограничением частоты"
+)
+LOG_DROPPED = Counter(
+    "bot_log_dropped_total",
+    "Записи лога, отброшенные из-за переполнения очереди записи"
+)
+LOG_SUPPRESSED = Counter(
+    "bot_log_suppressed_total",
+    "Записи лога, пропущенные выборкой или ограничением частоты",
+    ["logger"]
+)
+ENRICHMENT_PROFILES = Counter(
+    "bot_enrichment_profile_total",
+    "Матчи по типу запроса и фактически использованному профилю сбора информации",
+    ["kind", "profile"]
+)
+CACHE_REQUESTS = Counter(
+    "bot_cache_requests_total",
+    "Обращения к кешам (попадания и промахи)",
+    ["cache", "result"]
+)
+INFLIGHT_JOBS = Gauge(
+    "bot_inflight_jobs",
+    "Количество сообщений, обрабатываемых в данный момент"
+)
+SCHEDULER_WAITING = Gauge(
+    "bot_scheduler_waiting",
+    "Количество элементов заданий, ожидающих слота генерации"
+)
+QUEUED_UPDATES = Gauge(
+    "bot_queued_updates",
+    "Количество обновлений в очереди, ожидающих процессов-обработчиков"
+)
+UPSTREAM_CONCURRENCY_LIMIT = Gauge(
+    "upstream_concurrency_limit",
+    "Текущий адаптивный лимит одновременных запросов к внешнему API",
+    ["upstream"]
+)
+UPSTREAM_INFLIGHT = Gauge(
+    "upstream_inflight_requests",
+    "Количество выполняющихся запросов к внешнему API",
+    ["upstream"]
+)
+CIRCUIT_BREAKER_STATE = Gauge(
+    "circuit_breaker_state",
+    "Состояние предохранителя внешнего API (0 - закрыт, 1 - пробный, 2 - открыт)",
+    ["name"]
+)
+
+def record_cache(cache, hit):
+    """Учитывает обращение к кешу."""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
@@ -0,0 +1,136 @@
+"""
+Выбор модели OpenAI по объему прогноза и наблюдаемой задержке.
+
+OPENAI_MODELS - модели в порядке предпочтения: от лучшей к самой быстрой.
+Для каждой модели хранится скользящее среднее времени генерации одного
+токена ответа, поэтому ожидаемая длительность запроса растет с запрошенным
+объемом (min_symbols). Прогноз запрашивается у первой модели, которая по
+оценке укладывается в OPENAI_DEADLINE - SLA одного прогноза - с таймаутом,
+равным оставшемуся времени. Если таймаут истек, запрос повторяется на
+следующей, более быстрой модели, а когда время или модели закончились,
+используется запасная статья (fallback_article).
+
+Истекший таймаут учитывается как наблюдение задержки, так что следующие
+запросы сразу уходят на более быструю модель; модель, которую давно не
+выбирали, раз в OPENAI_ROUTER_PROBE_INTERVAL секунд пробуется снова.
+"""
+import os
+import math
+import time
+import threading
+
+import metrics
+
+# Модели OpenAI в порядке предпочтения (через запятую, от лучшей к самой быстрой)
+OPENAI_MODELS = [model.strip() for model in os.getenv("OPENAI_MODELS", "gpt-3.5-turbo").split(",") if model.strip()]
+# Время на один прогноз, включая повторы на более быстрых моделях (секунды)
+OPENAI_DEADLINE = float(os.getenv("OPENAI_DEADLINE", 60))
+# Минимальный таймаут попытки: при меньшем остатке времени сразу используется запасная статья
+OPENAI_MIN_ATTEMPT_TIMEOUT = float(os.getenv("OPENAI_MIN_ATTEMPT_TIMEOUT", 5))
+# Период повторной проверки модели, которая считается медленной (секунды)
+OPENAI_ROUTER_PROBE_INTERVAL = float(os.getenv("OPENAI_ROUTER_PROBE_INTERVAL", 60))
+# Минимальное и максимальное значение max_tokens
+OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", 1500))
+OPENAI_MAX_TOKENS_LIMIT = int(os.getenv("OPENAI_MAX_TOKENS_LIMIT", 3000))
+# Символов русского текста на токен и запас max_tokens сверх ожидаемого объема
+CHARS_PER_TOKEN = 3
+MAX_TOKENS_HEADROOM = 1.5
+# Коэффициент скользящего среднего времени на токен
+_LATENCY_ALPHA = 0.3
+
+# Исходы запроса прогноза
+OUTCOME_OK = "ok"
+OUTCOME_TIMEOUT = "timeout"
+OUTCOME_ERROR = "error"
+OUTCOME_FALLBACK = "fallback"
+
+class DeadlineExceeded(Exception):
+    """Время на прогноз истекло, пока запрос ждал свободного слота OpenAI."""
+
+def expected_tokens(min_symbols):
+    """Ожидаемый объем ответа (токены) для прогноза из min_symbols символов."""
+    return max(1, math.ceil(min_symbols / CHARS_PER_TOKEN))
+
+def max_tokens(min_symbols):
+    """Значение max_tokens для прогноза: не меньше OPENAI_MAX_TOKENS и не больше OPENAI_MAX_TOKENS_LIMIT."""
+    return min(OPENAI_MAX_TOKENS_LIMIT, max(OPENAI_MAX_TOKENS, math.ceil(expected_tokens(min_symbols) * MAX_TOKENS_HEADROOM)))
+
+class ModelRouter:
+    """Выбор модели по оценке длительности запроса и учет наблюдаемой задержки."""
+
+    def __init__(self, models=OPENAI_MODELS, deadline=OPENAI_DEADLINE):
+        self.models = list(models)
+        self.deadline = deadline
+        self._seconds_per_token = {}
+        self._checked = {}
+        self._lock = threading.Lock()
+
+    def estimate(self, model, min_symbols):
+        """Ожидаемая длительность запроса (секунды) или None, если модель еще не наблюдалась."""
+        with self._lock:
+            seconds_per_token = self._seconds_per_token.get(model)
+        if seconds_per_token is None:
+            return None
+        return seconds_per_token * expected_tokens(min_symbols)
+
+    def choose(self, min_symbols, budget, after=None):
+        """
+        Выбирает модель для запроса.
+
+        Args:
+            min_symbols: Требуемый объем прогноза
+            budget: Оставшееся время на прогноз (секунды)
+            after: Модель, на которой истек таймаут (выбирается одна из следующих за ней)
+
+        Returns:
+            str: Модель или None, если попыток больше не осталось
+        """
+        if budget < OPENAI_MIN_ATTEMPT_TIMEOUT:
+            return None
+        candidates = self.models[self.models.index(after) + 1:] if after in self.models else self.models
+        if not candidates:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            for model in candidates:
+                seconds_per_token = self._seconds_per_token.get(model)
+                if seconds_per_token is None or seconds_per_token * expected_tokens(min_symbols) <= budget:
+                    return model
+                if now - self._checked.get(model, 0.0) > OPENAI_ROUTER_PROBE_INTERVAL:
+                    # Давно не проверенная модель: пробуем, не ожидая улучшения оценки
+                    self._checked[model] = now
+                    return model
+        # По оценке не укладывается ни одна модель - пробуем самую быструю
+        return candidates[-1]
+
+    def record(self, model, duration, completion_tokens, outcome):
+        """
+        Учитывает результат запроса к модели.
+
+        Args:
+            model: Модель
+            duration: Длительность запроса (для истекшего таймаута - время до таймаута)
+            completion_tokens: Объем ответа (для таймаута - ожидаемый объем)
+            outcome: OUTCOME_OK, OUTCOME_TIMEOUT или OUTCOME_ERROR
+        """
+        metrics.OPENAI_ROUTED_REQUESTS.inc(model=model, outcome=outcome)
+        if outcome == OUTCOME_ERROR or not completion_tokens:
+            return
+        seconds_per_token = duration / completion_tokens
+        with self._lock:
+            previous = self._seconds_per_token.get(model)
+            if previous is None:
+                self._seconds_per_token[model] = seconds_per_token
+            elif outcome == OUTCOME_TIMEOUT:
+                # Таймаут - нижняя граница задержки: оценка не может стать меньше
+                self._seconds_per_token[model] = max(previous, seconds_per_token)
+            else:
+                self._seconds_per_token[model] = previous + _LATENCY_ALPHA * (seconds_per_token - previous)
+            self._checked[model] = time.monotonic()
+
+    def record_fallback(self):
+        """Учитывает прогноз, замененный запасной статьей из-за дедлайна."""
+        metrics.OPENAI_ROUTED_REQUESTS.inc(model=OUTCOME_FALLBACK, outcome=OUTCOME_FALLBACK)
+
+router = ModelRouter()
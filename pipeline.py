@@ -0,0 +1,91 @@
+"""
+Потоковый конвейер обработки элементов задания.
+
+Каждый этап конвейера выполняется в отдельном потоке и передает результаты
+следующему через очередь ограниченного размера, поэтому, например, поиск
+информации о следующем матче идет одновременно с генерацией прогноза для
+текущего, а быстрый этап не уходит далеко вперед медленного. Общее время
+задания приближается ко времени самого медленного этапа.
+"""
+import os
+import queue
+import threading
+import contextvars
+
+# Максимальное количество элементов в очереди между этапами
+PIPELINE_BUFFER_SIZE = int(os.getenv("PIPELINE_BUFFER_SIZE", 2))
+# Период проверки остановки конвейера при ожидании очереди (секунды)
+_POLL_INTERVAL = 0.1
+
+_DONE = object()
+
+def run_pipeline(source, stages, sink, buffer_size=PIPELINE_BUFFER_SIZE):
+    """
+    Пропускает элементы source через этапы stages и передает результаты в sink.
+
+    Этапы выполняются в отдельных потоках (с копией contextvars вызывающего
+    потока, поэтому трассировка задания сохраняется), sink - в вызывающем
+    потоке. Порядок элементов сохраняется.
+
+    Args:
+        source: Итерируемый источник элементов (читается первым этапом)
+        stages: Функции этапов, каждая принимает результат предыдущего
+        sink: Функция для готовых результатов; если она возвращает False, конвейер останавливается
+        buffer_size: Размер очереди между этапами
+
+    Raises:
+        Exception: Первая ошибка, возникшая в источнике или этапе
+    """
+    stop = threading.Event()
+    errors = []
+    buffers = [queue.Queue(maxsize=buffer_size) for _ in stages]
+
+    def put(buffer, value):
+        while not stop.is_set():
+            try:
+                buffer.put(value, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(buffer):
+        while not stop.is_set():
+            try:
+                return buffer.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def run_stage(index, stage):
+        output = buffers[index]
+        inputs = iter(source) if index == 0 else iter(lambda: get(buffers[index - 1]), _DONE)
+        try:
+            for value in inputs:
+                if not put(output, stage(value)):
+                    break
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            put(output, _DONE)
+
+    threads = [
+        threading.Thread(target=contextvars.copy_context().run, args=(run_stage, index, stage),
+                         name=f"pipeline-stage-{index}", daemon=True)
+        for index, stage in enumerate(stages)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for value in iter(lambda: get(buffers[-1]), _DONE):
+            if sink(value) is False:
+                break
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,143 @@
+"""
+Построение промптов для генерации прогнозов.
+
+Статические части (системные промпты и инструкции) собираются один раз при
+импорте и не содержат отступов исходного кода. Они идут в начале запроса,
+а данные конкретного матча - в конце, поэтому у всех запросов общий
+префикс, который может переиспользовать кеширование промптов на стороне
+провайдера. Списки из web_search (последние матчи, состав) сериализуются
+компактно, а не как repr списка Python.
+"""
+import math
+
+# tiktoken - необязательная зависимость: без него количество токенов оценивается
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Разделитель элементов списков в данных о командах
+LIST_SEPARATOR = "; "
+
+# Промпт для матчей без данных о командах (например, из "Все X матчей")
+SYSTEM_PROMPT_BASIC = (
+    "Ты - опытный спортивный аналитик, создающий прогнозы на футбольные матчи. "
+    "Твоя задача - создать детальный, интересный прогноз на матч, не упоминая о недостатке информации. "
+    "Пиши так, как будто ты обладаешь всеми необходимыми данными. "
+    "Используй профессиональную футбольную терминологию, упоминай возможные тактики, стратегии и ключевых игроков команд. "
+    "Всегда завершай прогноз конкретным предсказанием результата (победа одной из команд или ничья)."
+)
+USER_INSTRUCTIONS_BASIC = (
+    "Напиши оригинальный, профессиональный прогноз на футбольный матч, указанный ниже. "
+    "Прогноз должен быть подробным и увлекательным.\n"
+    "Обязательно включи:\n"
+    "- Анализ текущей формы обеих команд\n"
+    "- Информацию о ключевых игроках\n"
+    "- Историю встреч (можешь придумать её)\n"
+    "- Тактический разбор и стиль игры команд\n"
+    "- Факторы, которые могут повлиять на исход матча\n"
+    "- В конце - конкретный прогноз на исход (счет, победитель или ничья)\n"
+    "Не упоминай о недостатке информации. Пиши так, как будто ты обладаешь всеми данными о командах.\n\n"
+)
+MATCH_TEMPLATE_BASIC = (
+    "Матч: {team1} - {team2}\n"
+    "Турнир: {tournament}\n"
+    "Объем: не менее {min_symbols} символов"
+)
+
+# Промпт для матчей с данными о последних матчах и составах
+SYSTEM_PROMPT_DETAILED = (
+    "Ты - опытный спортивный аналитик, создающий прогнозы на футбольные матчи на основе предоставленных данных. "
+    "Твоя задача - создать детальный, профессиональный прогноз, который будет интересно читать. "
+    "Используй футбольную терминологию, обсуждай тактики, стратегии и ключевых игроков. "
+    "Всегда завершай прогноз конкретным предсказанием результата (победа одной из команд или ничья). "
+    "Не упоминай о недостатке информации - пиши уверенно, как эксперт с полными данными."
+)
+USER_INSTRUCTIONS_DETAILED = (
+    "Напиши оригинальный, профессиональный прогноз на футбольный матч, используя данные ниже. "
+    "Форма: результаты последних матчей (В - победа, Н - ничья, П - поражение), "
+    "текущая серия, забитые и пропущенные мячи, результаты дома и в гостях. "
+    "Прогноз должен быть подробным и увлекательным.\n"
+    "Обязательно включи:\n"
+    "- Тактический разбор и стиль игры команд\n"
+    "- В конце - конкретный прогноз на исход (счет, победитель или ничья)\n\n"
+)
+MATCH_TEMPLATE_DETAILED = (
+    "Матч: {team1} - {team2}\n"
+    "Турнир: {tournament}\n"
+    "Форма {team1}: {last_matches_team1}\n"
+    "Форма {team2}: {last_matches_team2}\n"
+    "Ключевые игроки {team1}: {lineup_team1}\n"
+    "Ключевые игроки {team2}: {lineup_team2}\n"
+    "Личные встречи: {head_to_head}\n"
+    "Объем: не менее {min_symbols} символов"
+)
+
+# Текст для матчей без истории личных встреч в локальной базе результатов
+NO_HEAD_TO_HEAD = "нет данных (не придумывай историю встреч)"
+
+def compact(value):
+    """Компактное текстовое представление данных о команде (строка или список строк)."""
+    if isinstance(value, (list, tuple)):
+        return LIST_SEPARATOR.join(str(item).strip() for item in value if str(item).strip())
+    return " ".join(str(value).split())
+
+def build_prompts(match, min_symbols):
+    """
+    Формирует системный и пользовательский промпты для прогноза на матч.
+
+    Матчи из "Все X матчей" не содержат данных о командах, поэтому для них
+    используется промпт без блока с последними матчами и составами.
+
+    Returns:
+        tuple: (system_prompt, user_prompt)
+    """
+    if 'last_matches_team1' not in match:
+        return SYSTEM_PROMPT_BASIC, USER_INSTRUCTIONS_BASIC + MATCH_TEMPLATE_BASIC.format(
+            team1=match['team1'],
+            team2=match['team2'],
+            tournament=match['tournament'],
+            min_symbols=min_symbols,
+        )
+
+    return SYSTEM_PROMPT_DETAILED, USER_INSTRUCTIONS_DETAILED + MATCH_TEMPLATE_DETAILED.format(
+        team1=match['team1'],
+        team2=match['team2'],
+        tournament=match['tournament'],
+        last_matches_team1=compact(match['last_matches_team1']),
+        last_matches_team2=compact(match['last_matches_team2']),
+        lineup_team1=compact(match['lineup_team1']),
+        lineup_team2=compact(match['lineup_team2']),
+        head_to_head=match.get('head_to_head') or NO_HEAD_TO_HEAD,
+        min_symbols=min_symbols,
+    )
+
+# Кодировщики tiktoken по моделям
+_encodings = {}
+
+def _get_encoding(model):
+    encoding = _encodings.get(model)
+    if encoding is None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+        _encodings[model] = encoding
+    return encoding
+
+def count_tokens(messages, model):
+    """
+    Количество токенов промпта (сообщений ChatCompletion).
+
+    С tiktoken подсчет точный (плюс служебные токены формата чата), без него -
+    оценка около 3 символов на токен для русского текста.
+    """
+    # Служебные токены: 3 на сообщение и 3 на начало ответа
+    tokens = 3
+    for message in messages:
+        tokens += 3
+        if tiktoken is not None:
+            tokens += len(_get_encoding(model).encode(message['content']))
+        else:
+            tokens += math.ceil(len(message['content']) / 3)
+    return tokens
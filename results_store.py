@@ -0,0 +1,205 @@
+"""
+Локальная база результатов матчей (SQLite в режиме WAL).
+
+Заполняется постепенно из каждого ответа eventslast.php и eventsday.php,
+который получает web_search, и индексируется по командам, паре команд и
+дате. Форма команды и история личных встреч берутся из нее за
+миллисекунды без дополнительных запросов к API; если данные о команде
+свежие (обновлялись не раньше RESULTS_FRESHNESS секунд назад), запрос
+eventslast.php не выполняется.
+"""
+import os
+import time
+import sqlite3
+import threading
+
+RESULTS_DB_PATH = os.getenv("RESULTS_DB_PATH", "results.db")
+RESULTS_DB_ENABLED = os.getenv("RESULTS_DB_ENABLED", "true").lower() == "true"
+# Сколько считать последние матчи команды актуальными (секунды)
+RESULTS_FRESHNESS = int(os.getenv("RESULTS_FRESHNESS", 6 * 60 * 60))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    event_key TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    league TEXT,
+    home_id TEXT,
+    away_id TEXT,
+    home_name TEXT,
+    away_name TEXT,
+    home_name_key TEXT,
+    away_name_key TEXT,
+    pair_key TEXT,
+    home_score INTEGER,
+    away_score INTEGER,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_home ON events (home_id, date);
+CREATE INDEX IF NOT EXISTS events_away ON events (away_id, date);
+CREATE INDEX IF NOT EXISTS events_pair ON events (pair_key, date);
+CREATE INDEX IF NOT EXISTS events_home_name ON events (home_name_key, date);
+CREATE INDEX IF NOT EXISTS events_away_name ON events (away_name_key, date);
+CREATE TABLE IF NOT EXISTS team_sync (
+    team_id TEXT PRIMARY KEY,
+    synced_at REAL NOT NULL
+);
+"""
+
+def _name_key(name):
+    return " ".join(str(name or "").lower().split())
+
+def _pair_key(team1_id, team2_id):
+    return ":".join(sorted((str(team1_id), str(team2_id))))
+
+def _score(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+class ResultsStore:
+    """База результатов в файле SQLite (соединение на поток)."""
+
+    enabled = True
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._init_lock:
+                if not self._initialized:
+                    connection.executescript(SCHEMA)
+                    self._initialized = True
+        return connection
+
+    def record_events(self, events, synced_team_id=None):
+        """
+        Сохраняет матчи из ответа API (новые данные заменяют старые).
+
+        Args:
+            events: Матчи в формате TheSportsDB (eventslast.php, eventsday.php)
+            synced_team_id: ID команды, последние матчи которой получены полностью
+        """
+        now = time.time()
+        rows = []
+        for event in events or []:
+            date = event.get("dateEvent") or ""
+            home_id = str(event.get("idHomeTeam") or "")
+            away_id = str(event.get("idAwayTeam") or "")
+            home_name = event.get("strHomeTeam") or ""
+            away_name = event.get("strAwayTeam") or ""
+            if not date or not (home_name or home_id) or not (away_name or away_id):
+                continue
+
+            event_key = str(event.get("idEvent") or f"{date}:{home_id or _name_key(home_name)}:{away_id or _name_key(away_name)}")
+            rows.append((
+                event_key, date, event.get("strLeague"), home_id, away_id, home_name, away_name,
+                _name_key(home_name), _name_key(away_name),
+                _pair_key(home_id, away_id) if home_id and away_id else None,
+                _score(event.get("intHomeScore")), _score(event.get("intAwayScore")), now
+            ))
+
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT OR REPLACE INTO events (event_key, date, league, home_id, away_id, home_name, away_name, "
+                "home_name_key, away_name_key, pair_key, home_score, away_score, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            if synced_team_id:
+                connection.execute(
+                    "INSERT OR REPLACE INTO team_sync (team_id, synced_at) VALUES (?, ?)", (str(synced_team_id), now)
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def is_fresh(self, team_id):
+        """Получались ли последние матчи команды не раньше RESULTS_FRESHNESS секунд назад."""
+        row = self._connection().execute(
+            "SELECT synced_at FROM team_sync WHERE team_id = ?", (str(team_id),)
+        ).fetchone()
+        return row is not None and time.time() - row["synced_at"] < RESULTS_FRESHNESS
+
+    def _events(self, query, params):
+        rows = self._connection().execute(query, params).fetchall()
+        return [
+            {
+                "dateEvent": row["date"],
+                "strLeague": row["league"],
+                "idHomeTeam": row["home_id"],
+                "idAwayTeam": row["away_id"],
+                "strHomeTeam": row["home_name"],
+                "strAwayTeam": row["away_name"],
+                "intHomeScore": row["home_score"],
+                "intAwayScore": row["away_score"],
+            }
+            for row in rows
+        ]
+
+    def team_events(self, team_id, limit=5):
+        """Последние сыгранные матчи команды в формате TheSportsDB, новые первыми."""
+        team_id = str(team_id)
+        return self._events(
+            "SELECT * FROM ("
+            " SELECT * FROM events WHERE home_id = ? AND home_score IS NOT NULL"
+            " UNION ALL"
+            " SELECT * FROM events WHERE away_id = ? AND home_score IS NOT NULL"
+            ") ORDER BY date DESC LIMIT ?",
+            (team_id, team_id, limit)
+        )
+
+    def head_to_head(self, team1_id, team2_id, limit=5):
+        """Последние сыгранные личные встречи двух команд, новые первыми."""
+        return self._events(
+            "SELECT * FROM events WHERE pair_key = ? AND home_score IS NOT NULL ORDER BY date DESC LIMIT ?",
+            (_pair_key(team1_id, team2_id), limit)
+        )
+
+    def find_team_id(self, team_name):
+        """ID команды по названию из сохраненных матчей или None."""
+        key = _name_key(team_name)
+        row = self._connection().execute(
+            "SELECT id FROM ("
+            " SELECT home_id AS id, date FROM events WHERE home_name_key = ? AND home_id != ''"
+            " UNION ALL"
+            " SELECT away_id AS id, date FROM events WHERE away_name_key = ? AND away_id != ''"
+            ") ORDER BY date DESC LIMIT 1",
+            (key, key)
+        ).fetchone()
+        return row["id"] if row else None
+
+class NullResultsStore:
+    """База-заглушка, если локальная база результатов отключена."""
+
+    enabled = False
+
+    def record_events(self, events, synced_team_id=None):
+        pass
+
+    def is_fresh(self, team_id):
+        return False
+
+    def team_events(self, team_id, limit=5):
+        return []
+
+    def head_to_head(self, team1_id, team2_id, limit=5):
+        return []
+
+    def find_team_id(self, team_name):
+        return None
+
+store = ResultsStore(RESULTS_DB_PATH) if RESULTS_DB_ENABLED and RESULTS_DB_PATH else NullResultsStore()
@@ -0,0 +1,120 @@
+"""
+Планировщик генерации прогнозов между заданиями разных пользователей.
+
+Одновременно генерируется не больше SCHEDULER_SLOTS прогнозов. Каждый матч
+задания - отдельная единица работы, которая ждет свободного слота; первым
+получает слот элемент задания с наименьшей оставшейся стоимостью (сумма
+ожидаемых объемов еще не сгенерированных прогнозов по min_symbols), поэтому
+одиночный матч не ждет окончания чужого пакета из десяти, а пакет по мере
+выполнения становится дешевле. Стоимость умножается на количество уже
+выполняющихся элементов того же пользователя и уменьшается со временем
+ожидания (SCHEDULER_AGING единиц в секунду), чтобы большие задания не
+голодали: при 0.1 элемент задания стоимостью 20 обгоняет только что
+пришедший одиночный матч (стоимость 1) примерно через 190 секунд.
+
+Планировщик общий для потоков одного процесса: он распределяет слоты между
+заданиями в потоках gunicorn (threads в gunicorn.conf.py), режима polling и
+процесса-обработчика очереди, но не между разными процессами.
+"""
+import os
+import time
+import itertools
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+# Количество одновременно генерируемых прогнозов (0 - без ограничения); если не задано,
+# равно текущему адаптивному лимиту запросов к OpenAI (см. Scheduler.set_slots_function)
+SCHEDULER_SLOTS = int(os.environ["SCHEDULER_SLOTS"]) if os.getenv("SCHEDULER_SLOTS") else None
+# Количество слотов, если не задано ни SCHEDULER_SLOTS, ни функция слотов
+DEFAULT_SLOTS = 8
+# На сколько единиц стоимости снижается приоритет ожидающего элемента за секунду
+SCHEDULER_AGING = float(os.getenv("SCHEDULER_AGING", 0.1))
+# Объем прогноза, соответствующий единице стоимости (символы)
+COST_UNIT_SYMBOLS = 1000
+
+def item_cost(match):
+    """Стоимость элемента задания: ожидаемый объем прогнозов в единицах COST_UNIT_SYMBOLS."""
+    count = match.get('count', 1) if match.get('is_all_matches') else 1
+    return count * match.get('min_symbols', COST_UNIT_SYMBOLS) / COST_UNIT_SYMBOLS
+
+class Scheduler:
+    """Слоты генерации с приоритетом коротких заданий, чередованием пользователей и старением."""
+
+    def __init__(self, slots=SCHEDULER_SLOTS, aging=SCHEDULER_AGING):
+        self.slots = slots
+        self.aging = aging
+        self._slots_function = None
+        self._running = 0
+        self._waiting = []
+        self._running_by_user = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def _priority(self, ticket, now):
+        running = self._running_by_user.get(ticket['user_id'], 0)
+        return (ticket['cost'] * (1 + running) - self.aging * (now - ticket['enqueued']), ticket['sequence'])
+
+    def _next_ticket(self):
+        now = time.monotonic()
+        return min(self._waiting, key=lambda ticket: self._priority(ticket, now))
+
+    def set_slots_function(self, function):
+        """Задает функцию количества слотов (используется, если slots не задано явно)."""
+        self._slots_function = function
+
+    def _capacity(self):
+        if self.slots is not None:
+            return self.slots
+        if self._slots_function is not None:
+            return self._slots_function()
+        return DEFAULT_SLOTS
+
+    @property
+    def waiting(self):
+        with self._condition:
+            return len(self._waiting)
+
+    @contextmanager
+    def slot(self, user_id, cost):
+        """
+        Ожидает слот для элемента задания и освобождает его после выполнения блока.
+
+        Args:
+            user_id: Пользователь, которому принадлежит задание
+            cost: Оставшаяся стоимость задания (сумма item_cost этого и следующих элементов)
+        """
+        if self.slots == 0:
+            yield
+            return
+
+        ticket = {'user_id': user_id, 'cost': cost, 'enqueued': time.monotonic(), 'sequence': next(self._sequence)}
+        with self._condition:
+            self._waiting.append(ticket)
+            try:
+                # Приоритеты меняются со временем (старение), поэтому ожидание с таймаутом
+                # (и количество слотов, если оно следует адаптивному лимиту)
+                while not (self._running < self._capacity() and self._next_ticket() is ticket):
+                    self._condition.wait(timeout=1.0)
+            finally:
+                self._waiting.remove(ticket)
+            self._running += 1
+            self._running_by_user[user_id] = self._running_by_user.get(user_id, 0) + 1
+            if self._running < self._capacity():
+                # Свободные слоты остались - следующий по приоритету может не ждать
+                self._condition.notify_all()
+        metrics.SCHEDULER_WAIT_DURATION.observe(time.monotonic() - ticket['enqueued'])
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._running -= 1
+                self._running_by_user[user_id] -= 1
+                if not self._running_by_user[user_id]:
+                    del self._running_by_user[user_id]
+                self._condition.notify_all()
+
+scheduler = Scheduler()
+metrics.SCHEDULER_WAITING.set_function(lambda: scheduler.waiting)
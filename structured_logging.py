@@ -0,0 +1,169 @@
+"""
+Неблокирующее логирование в формате JSON с выборкой и ограничением частоты.
+
+Обработчик корневого логгера только кладет запись в очередь; форматирование
+и запись в stderr выполняет отдельный поток (QueueListener). Если очередь
+переполнена, запись отбрасывается (метрика bot_log_dropped_total), так что
+логирование не задерживает обработку запросов при всплесках.
+
+Записи можно пометить типом: logger.info(..., extra={'log_type': 'webhook'}).
+Для типа задается доля сохраняемых записей (LOG_SAMPLE_RATES, например
+"webhook=0.1"), а частота записей одного типа (или одного места вызова, если
+тип не указан) ограничивается LOG_RATE_LIMIT записями в секунду. Количество
+пропущенных записей добавляется к следующей записи того же типа (поле
+"suppressed").
+
+Сообщение форматируется в потоке записи, поэтому в горячих местах аргументы
+передаются отдельно (logger.info("... %s", value)), а не f-строкой: для
+отброшенных записей форматирование не выполняется вовсе.
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+
+import metrics
+
+# Формат вывода: json или text
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Размер очереди записей (при переполнении записи отбрасываются)
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# Записей в секунду одного типа или места вызова (0 - без ограничения) и допустимый всплеск
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", 20))
+LOG_RATE_BURST = 50
+# Доля сохраняемых записей по типам ("тип=доля" через запятую)
+LOG_SAMPLE_RATES = {
+    name.strip(): float(rate)
+    for name, _, rate in (item.partition("=") for item in os.getenv("LOG_SAMPLE_RATES", "webhook=0.1").split(","))
+    if name.strip() and rate
+}
+# Формат текстового вывода (LOG_FORMAT=text)
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(job_id)s] %(message)s'
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'job_id': getattr(record, 'job_id', '-'),
+            'message': record.getMessage(),
+        }
+        log_type = getattr(record, 'log_type', None)
+        if log_type:
+            entry['type'] = log_type
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class SamplingFilter(logging.Filter):
+    """Выборка по типу записи и ограничение частоты (token bucket на тип или место вызова)."""
+
+    def __init__(self, rate_limit=LOG_RATE_LIMIT, burst=LOG_RATE_BURST, sample_rates=None):
+        super().__init__()
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.sample_rates = LOG_SAMPLE_RATES if sample_rates is None else sample_rates
+        # ключ -> [токены, время последнего пополнения, пропущено записей]
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        log_type = getattr(record, 'log_type', None)
+        key = log_type or (record.pathname, record.lineno)
+        rate = self.sample_rates.get(log_type) if log_type else None
+        sampled_out = rate is not None and random.random() >= rate
+
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, time.monotonic(), 0]
+            if not sampled_out and self.rate_limit > 0:
+                now = time.monotonic()
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate_limit)
+                bucket[1] = now
+                if bucket[0] < 1:
+                    sampled_out = True
+                else:
+                    bucket[0] -= 1
+            if sampled_out:
+                bucket[2] += 1
+            else:
+                record.suppressed, bucket[2] = bucket[2], 0
+
+        if sampled_out:
+            metrics.LOG_SUPPRESSED.inc(logger=record.name)
+            return False
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Передает записи в поток записи через ограниченную очередь.
+
+    Поток запускается при первой записи в каждом процессе: воркеры gunicorn
+    создаются через fork после импорта bot в мастер-процессе, а потоки при
+    fork не копируются.
+    """
+
+    def __init__(self, target, queue_size=LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(queue_size))
+        self.target = target
+        self.queue_size = queue_size
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # Очередь, унаследованная от родительского процесса, могла остаться с записями
+            self.queue = queue.Queue(self.queue_size)
+            self._listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+            atexit.register(self.flush_and_stop)
+
+    def flush_and_stop(self):
+        """Дописывает записи из очереди и останавливает поток записи."""
+        with self._start_lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+                self._listener = None
+                self._pid = None
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_DROPPED.inc()
+
+    def prepare(self, record):
+        # Форматирование выполняется в потоке записи, а не в вызывающем потоке
+        return record
+
+def configure():
+    """Настраивает корневой логгер (повторный вызов ничего не меняет)."""
+    root = logging.getLogger()
+    if any(isinstance(handler, NonBlockingQueueHandler) for handler in root.handlers):
+        return
+
+    target = logging.StreamHandler()
+    target.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+    handler = NonBlockingQueueHandler(target)
+    handler.addFilter(SamplingFilter())
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
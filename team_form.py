@@ -0,0 +1,168 @@
+"""
+Статистика формы команды по последним матчам и выбор ключевых игроков.
+
+Вместо списка строк с результатами из eventslast.php в промпт передается
+компактная сводка: результаты подряд, серия, разница мячей, результаты
+дома и в гостях и сколько дней прошло с последнего матча. Состав
+сокращается до нескольких игроков по линиям.
+"""
+from datetime import date, datetime
+
+WIN = "В"
+DRAW = "Н"
+LOSS = "П"
+
+# Сколько игроков каждой линии оставлять в составе (в порядке важности линий)
+# и ключевые слова позиций TheSportsDB для линии
+KEY_PLAYERS_BY_POSITION = (
+    (("Forward", "Winger", "Striker"), 3),
+    (("Midfield",), 3),
+    (("Defender", "Back"), 2),
+    (("Goalkeeper",), 1),
+)
+# Позиции, не относящиеся к игрокам (тренеры и персонал)
+NON_PLAYER_POSITIONS = ("Manager", "Coach", "Assistant", "Staff", "Physio", "Director")
+
+def _score(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _event_date(event):
+    try:
+        return datetime.strptime(event.get("dateEvent") or "", "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+def team_results(events, team_id):
+    """
+    Результаты сыгранных матчей команды с ее точки зрения, новые первыми.
+
+    Args:
+        events: Матчи из ответа eventslast.php
+        team_id: ID команды в TheSportsDB
+
+    Returns:
+        list: Словари с ключами result, goals_for, goals_against, home, date, opponent
+    """
+    team_id = str(team_id)
+    results = []
+    for event in events or []:
+        home_score = _score(event.get("intHomeScore"))
+        away_score = _score(event.get("intAwayScore"))
+        if home_score is None or away_score is None:
+            continue
+
+        home = str(event.get("idHomeTeam", "")) == team_id
+        goals_for, goals_against = (home_score, away_score) if home else (away_score, home_score)
+        if goals_for > goals_against:
+            result = WIN
+        elif goals_for == goals_against:
+            result = DRAW
+        else:
+            result = LOSS
+
+        results.append({
+            "result": result,
+            "goals_for": goals_for,
+            "goals_against": goals_against,
+            "home": home,
+            "date": _event_date(event),
+            "opponent": event.get("strAwayTeam") if home else event.get("strHomeTeam"),
+        })
+
+    results.sort(key=lambda item: item["date"] or date.min, reverse=True)
+    return results
+
+def compute_form(results, today=None):
+    """
+    Показатели формы по результатам team_results.
+
+    Returns:
+        dict: Показатели формы или None, если сыгранных матчей нет
+    """
+    if not results:
+        return None
+    today = today or date.today()
+
+    streak_length = 1
+    while streak_length < len(results) and results[streak_length]["result"] == results[0]["result"]:
+        streak_length += 1
+
+    def record(items):
+        return tuple(sum(1 for item in items if item["result"] == result) for result in (WIN, DRAW, LOSS))
+
+    last_date = results[0]["date"]
+    return {
+        "sequence": "".join(item["result"] for item in results),
+        "streak": (results[0]["result"], streak_length),
+        "record": record(results),
+        "goals_for": sum(item["goals_for"] for item in results),
+        "goals_against": sum(item["goals_against"] for item in results),
+        "home_record": record([item for item in results if item["home"]]),
+        "away_record": record([item for item in results if not item["home"]]),
+        "days_since_last": (today - last_date).days if last_date else None,
+    }
+
+def format_form(form):
+    """Компактная текстовая сводка формы для промпта."""
+    result, length = form["streak"]
+    parts = [
+        f"{form['sequence']} (новые первыми, В-Н-П {'-'.join(map(str, form['record']))})",
+        f"серия {result}{length}",
+        f"мячи {form['goals_for']}:{form['goals_against']}",
+        f"дома {'-'.join(map(str, form['home_record']))}, в гостях {'-'.join(map(str, form['away_record']))}",
+    ]
+    if form["days_since_last"] is not None:
+        parts.append(f"последний матч {form['days_since_last']} дн. назад")
+    return "; ".join(parts)
+
+def format_head_to_head(events, team_id, team_name):
+    """
+    Компактная сводка личных встреч с точки зрения команды team_id.
+
+    Returns:
+        str: Сводка или None, если сыгранных встреч нет
+    """
+    results = team_results(events, team_id)
+    if not results:
+        return None
+    wins, draws, losses = (sum(1 for item in results if item["result"] == result) for result in (WIN, DRAW, LOSS))
+    games = [
+        f"{item['date'] or '?'} {team_name} {item['goals_for']}:{item['goals_against']} {item['opponent']} ({'дома' if item['home'] else 'в гостях'})"
+        for item in results
+    ]
+    return f"{team_name} В-Н-П {wins}-{draws}-{losses}; " + "; ".join(games)
+
+def _has_position(player, keywords):
+    position = (player.get("strPosition") or "").lower()
+    return any(keyword.lower() in position for keyword in keywords)
+
+def select_key_players(players):
+    """
+    Сокращает состав до ключевых игроков по линиям.
+
+    Args:
+        players: Игроки из ответа searchplayers.php
+
+    Returns:
+        list: Строки "Имя (позиция)"
+    """
+    selected = []
+    for keywords, limit in KEY_PLAYERS_BY_POSITION:
+        matching = [
+            player for player in players or []
+            if player not in selected and _has_position(player, keywords)
+        ]
+        selected.extend(matching[:limit])
+
+    # Если позиции не указаны, берем первых игроков списка
+    if not selected:
+        limit = sum(limit for _, limit in KEY_PLAYERS_BY_POSITION)
+        selected = [
+            player for player in players or []
+            if not _has_position(player, NON_PLAYER_POSITIONS)
+        ][:limit]
+
+    return [f"{player.get('strPlayer', 'Неизвестный игрок')} ({player.get('strPosition') or 'позиция неизвестна'})" for player in selected]
@@ -0,0 +1,201 @@
+"""
+Легковесная трассировка заданий.
+
+Каждое задание (сообщение пользователя) получает идентификатор
+"{user_id}_{message_id}", который добавляется ко всем строкам лога, пока
+задание обрабатывается. Этапы обработки и вложенные запросы к внешним API
+записываются как span'ы; по последним заданиям можно получить "водопад"
+с временем каждого этапа.
+
+Контекст задания хранится в contextvars, поэтому он переносится в
+asyncio-задачи. Для передачи в другие потоки используйте
+contextvars.copy_context().run. Если трассировка выключена
+(TRACING_ENABLED=false) или код выполняется вне задания, span() возвращает
+общий пустой контекст без каких-либо затрат на запись.
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from contextvars import ContextVar
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+# Количество последних заданий, для которых хранятся трассы
+TRACE_MAX_JOBS = int(os.getenv("TRACE_MAX_JOBS", 200))
+# Максимальное количество span'ов в одном задании (защита от роста памяти)
+TRACE_MAX_SPANS = 2000
+
+_current_trace = ContextVar("current_trace", default=None)
+_current_span = ContextVar("current_span", default=None)
+
+_recent_traces = OrderedDict()
+_recent_lock = threading.Lock()
+
+class Span:
+    """Один этап обработки задания."""
+
+    __slots__ = ("name", "attrs", "start", "end", "depth", "error")
+
+    def __init__(self, name, attrs, start, depth):
+        self.name = name
+        self.attrs = attrs
+        self.start = start
+        self.end = None
+        self.depth = depth
+        self.error = None
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+class JobTrace:
+    """Трасса одного задания."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.started_at = datetime.now()
+        self.t0 = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            if len(self.spans) < TRACE_MAX_SPANS:
+                self.spans.append(span)
+
+    @property
+    def duration(self):
+        with self._lock:
+            return self.spans[0].duration if self.spans else 0.0
+
+class _NullContext:
+    """Пустой контекст для выключенной трассировки."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_CONTEXT = _NullContext()
+
+class _SpanContext:
+    __slots__ = ("_trace", "_span", "_token")
+
+    def __init__(self, trace, name, attrs):
+        self._trace = trace
+        parent = _current_span.get()
+        depth = parent.depth + 1 if parent is not None else 0
+        self._span = Span(name, attrs, time.perf_counter(), depth)
+
+    def __enter__(self):
+        self._trace.add(self._span)
+        self._token = _current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        self._span.end = time.perf_counter()
+        if exc is not None:
+            self._span.error = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self._token)
+        return False
+
+class _JobContext:
+    __slots__ = ("_trace", "_token", "_span_context")
+
+    def __init__(self, job_id):
+        self._trace = JobTrace(job_id)
+
+    def __enter__(self):
+        with _recent_lock:
+            _recent_traces[self._trace.job_id] = self._trace
+            _recent_traces.move_to_end(self._trace.job_id)
+            while len(_recent_traces) > TRACE_MAX_JOBS:
+                _recent_traces.popitem(last=False)
+        self._token = _current_trace.set(self._trace)
+        self._span_context = _SpanContext(self._trace, "job", {})
+        self._span_context.__enter__()
+        return self._trace
+
+    def __exit__(self, exc_type, exc, tb):
+        self._span_context.__exit__(exc_type, exc, tb)
+        _current_trace.reset(self._token)
+        return False
+
+def job(job_id):
+    """
+    Контекст обработки задания: все span'ы и строки лога внутри него
+    помечаются идентификатором задания.
+    """
+    if not TRACING_ENABLED:
+        return _NULL_CONTEXT
+    return _JobContext(str(job_id))
+
+def span(name, **attrs):
+    """Контекст этапа обработки (вложенные span'ы отображаются с отступом)."""
+    trace = _current_trace.get()
+    if trace is None:
+        return _NULL_CONTEXT
+    return _SpanContext(trace, name, attrs)
+
+def current_job_id():
+    """Идентификатор текущего задания или None."""
+    trace = _current_trace.get()
+    return trace.job_id if trace is not None else None
+
+def get_trace(job_id):
+    with _recent_lock:
+        return _recent_traces.get(str(job_id))
+
+def recent_jobs():
+    """Последние задания: список (job_id, время начала, длительность), новые первыми."""
+    with _recent_lock:
+        traces = list(_recent_traces.values())
+    return [(trace.job_id, trace.started_at, trace.duration) for trace in reversed(traces)]
+
+def render_waterfall(job_id, width=40):
+    """
+    Текстовый "водопад" этапов задания.
+
+    Returns:
+        str: Отчет или None, если задание не найдено
+    """
+    trace = get_trace(job_id)
+    if trace is None:
+        return None
+
+    with trace._lock:
+        spans = list(trace.spans)
+    total = max((span.start + span.duration for span in spans), default=trace.t0) - trace.t0
+    scale = width / total if total > 0 else 0
+
+    lines = [f"Задание {trace.job_id} (начато {trace.started_at:%Y-%m-%d %H:%M:%S}, длительность {total:.3f} с)"]
+    for span in spans:
+        offset = span.start - trace.t0
+        bar_start = int(offset * scale)
+        bar_length = max(1, int(span.duration * scale))
+        bar = " " * bar_start + "█" * bar_length
+        attrs = " ".join(f"{key}={value}" for key, value in span.attrs.items())
+        title = ("  " * span.depth + span.name + (f" {attrs}" if attrs else ""))[:60]
+        status = " ОШИБКА" if span.error else ("" if span.end is not None else " ...")
+        lines.append(f"{offset:8.3f} с {span.duration:8.3f} с  {title:<60} |{bar:<{width}}|{status}")
+    return "\n".join(lines)
+
+def install_log_record_factory():
+    """Добавляет к каждой записи лога поле job_id (или "-" вне задания)."""
+    previous_factory = logging.getLogRecordFactory()
+    if getattr(previous_factory, "_adds_job_id", False):
+        return
+
+    def record_factory(*args, **kwargs):
+        record = previous_factory(*args, **kwargs)
+        trace = _current_trace.get()
+        record.job_id = trace.job_id if trace is not None else "-"
+        return record
+
+    record_factory._adds_job_id = True
+    logging.setLogRecordFactory(record_factory)
@@ -0,0 +1,69 @@
+"""
+Идемпотентная обработка обновлений Telegram.
+
+Если webhook отвечает медленно, Telegram повторно доставляет то же
+обновление. Обработанные update_id запоминаются на UPDATE_DEDUP_TTL секунд
+(не более UPDATE_DEDUP_MAX_SIZE записей), и повтор подтверждается сразу,
+без разбора JSON и создания объекта Update.
+"""
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+# Сколько помнить обработанные обновления (секунды)
+UPDATE_DEDUP_TTL = int(os.getenv("UPDATE_DEDUP_TTL", 3600))
+# Максимальное количество запоминаемых обновлений
+UPDATE_DEDUP_MAX_SIZE = 10000
+
+# Telegram передает update_id первым полем объекта
+_UPDATE_ID_PATTERN = re.compile(rb'^\s*\{\s*"update_id"\s*:\s*(\d+)')
+
+def peek_update_id(raw_body):
+    """
+    Извлекает update_id из начала тела запроса без разбора всего JSON.
+
+    Returns:
+        int: update_id или None, если он не в начале объекта
+    """
+    match = _UPDATE_ID_PATTERN.match(raw_body)
+    return int(match.group(1)) if match else None
+
+class RecentUpdates:
+    """Ограниченное по размеру и времени множество недавно полученных update_id."""
+
+    def __init__(self, max_size=UPDATE_DEDUP_MAX_SIZE, ttl=UPDATE_DEDUP_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, update_id):
+        """
+        Проверяет обновление и запоминает его.
+
+        Returns:
+            bool: True, если обновление уже было получено (повтор)
+        """
+        now = time.monotonic()
+        with self._lock:
+            # Записи упорядочены по времени получения: устаревшие - в начале
+            while self._seen:
+                oldest_id, received_at = next(iter(self._seen.items()))
+                if now - received_at < self.ttl and len(self._seen) < self.max_size:
+                    break
+                del self._seen[oldest_id]
+
+            if update_id in self._seen:
+                return True
+            self._seen[update_id] = now
+            return False
+
+    def forget(self, update_id):
+        """Забывает обновление, чтобы его повторная доставка была обработана (например, после ошибки)."""
+        with self._lock:
+            self._seen.pop(update_id, None)
+
+    def __len__(self):
+        return len(self._seen)
@@ -1,16 +1,29 @@
-import requests
-from bs4 import BeautifulSoup
+import os
 import logging
 import re
 from datetime import datetime
 import urllib.parse
 import time
 import json
+import asyncio
+
+import metrics
+import tracing
+import team_form
+import results_store
+from circuit_breaker import CircuitBreaker
+from concurrency_limit import AdaptiveLimiter
+from hedging import Hedger
+
+try:
+    import httpx  # Нужен только для асинхронного режима (async_bot.py)
+except ImportError:
+    httpx = None
 
 logger = logging.getLogger(__name__)
 
 # Константы для API TheSportsDB
-API_BASE_URL = "https://www.thesportsdb.com/api/v1/json"
+API_BASE_URL = os.getenv("THESPORTSDB_API_URL", "https://www.thesportsdb.com/api/v1/json")
 API_KEY = "3"  # Бесплатный тестовый ключ
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
@@ -22,6 +35,15 @@ RETRY_DELAY = 2  # секунды
 REQUEST_TIMEOUT = 10  # секунды
 MAX_RESPONSE_SIZE = 10 * 1024 * 1024  # 10 MB
 
+# Предохранитель: после серии ошибок запросы к API временно не выполняются
+api_breaker = CircuitBreaker("thesportsdb")
+# Адаптивный лимит одновременных запросов к TheSportsDB (начальное и максимальное значения)
+api_limiter = AdaptiveLimiter(
+    "thesportsdb", int(os.getenv("THESPORTSDB_CONCURRENCY", 8)), max_limit=int(os.getenv("THESPORTSDB_MAX_CONCURRENCY", 64))
+)
+# Дубликаты запросов, не получивших ответа за p95 задержки эндпоинта
+api_hedger = Hedger("thesportsdb", max_workers=2 * api_limiter.max_limit)
+
 # Словарь для преобразования названий турниров в правильные запросы к API
 TOURNAMENT_MAPPINGS = {
     "ЧМ-2026. Европа. Квалификация": "FIFA World Cup qualification (UEFA)",
@@ -65,6 +87,57 @@ def api_request(endpoint, params=None):
     Returns:
         dict: Ответ от API в формате JSON
     """
+    if not api_breaker.allow():
+        logger.warning(f"TheSportsDB временно недоступен, запрос {endpoint} пропущен")
+        return None
+    
+    started = time.perf_counter()
+    with tracing.span("thesportsdb", endpoint=endpoint[:100]):
+        data = _api_request(endpoint, params)
+    _record_api_result(endpoint, params, data, time.perf_counter() - started)
+    return data
+
+def _record_api_result(endpoint, params, data, duration):
+    """Учитывает результат запроса в метриках и предохранителе, сохраняет результаты матчей."""
+    if data is None:
+        api_breaker.record_failure()
+    else:
+        api_breaker.record_success()
+    outcome = "ok" if data is not None else "error"
+    metrics.THESPORTSDB_REQUEST_DURATION.observe(duration, endpoint=endpoint[:100], outcome=outcome)
+    
+    if data:
+        _store_results(endpoint, params, data)
+
+def _store_results(endpoint, params, data):
+    """Пополняет локальную базу результатов матчами из ответа eventslast.php или eventsday.php."""
+    try:
+        if endpoint == "eventslast.php":
+            results_store.store.record_events(data.get("results"), synced_team_id=(params or {}).get("id"))
+        elif endpoint == "eventsday.php":
+            results_store.store.record_events(data.get("events"))
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении результатов матчей ({endpoint}): {e}")
+
+class ResponseExcerpt:
+    """Начало тела ответа для лога: декодируется только если запись действительно пишется."""
+
+    __slots__ = ("response",)
+
+    def __init__(self, response):
+        self.response = response
+
+    def __str__(self):
+        return self.response.text[:500]
+
+def _is_ok_response(response):
+    return response.status_code == 200
+
+def _api_request(endpoint, params=None):
+    """Запрос к API с повторами (без учета метрик и предохранителя)."""
+    # requests импортируется при первом запросе, чтобы не замедлять запуск
+    import requests
+    
     # Проверяем и очищаем параметры
     validated_params = validate_api_params(params)
     
@@ -75,16 +148,26 @@ def api_request(endpoint, params=None):
             url = f"{API_BASE_URL}/{API_KEY}/{endpoint}"
             
             # Устанавливаем таймаут для защиты от зависаний
-            response = requests.get(
-                url, 
-                params=validated_params, 
-                headers=HEADERS, 
-                timeout=REQUEST_TIMEOUT
-            )
+            def get():
+                with api_limiter.slot():
+                    return requests.get(
+                        url, 
+                        params=validated_params, 
+                        headers=HEADERS, 
+                        timeout=REQUEST_TIMEOUT
+                    )
+            
+            # Запросы только читают данные, поэтому медленный можно продублировать
+            response = api_hedger.call(endpoint, get, accept=_is_ok_response)
             
             # Проверка статус-кода
+            if response.status_code == 429:
+                api_limiter.record_overload()
             if response.status_code != 200:
-                logger.error(f"Ошибка API: {response.status_code}, URL: {url}, Ответ: {response.text[:500]}")
+                logger.error(
+                    "Ошибка API: %s, URL: %s, Ответ: %s", response.status_code, url, ResponseExcerpt(response),
+                    extra={'log_type': 'api_error'}
+                )
                 if attempt < MAX_RETRIES - 1:
                     time.sleep(RETRY_DELAY)
                     continue
@@ -104,7 +187,9 @@ def api_request(endpoint, params=None):
                 return None
                 
         except requests.RequestException as e:
-            logger.error(f"Ошибка при запросе к API: {e}")
+            logger.error("Ошибка при запросе к API: %s", e, extra={'log_type': 'api_error'})
+            if isinstance(e, requests.Timeout):
+                api_limiter.record_overload()
             if attempt < MAX_RETRIES - 1:
                 time.sleep(RETRY_DELAY)
             else:
@@ -138,6 +223,10 @@ def search_team(team_name):
     
     data = api_request(endpoint, params)
     
+    return _extract_team(data, team_name)
+
+def _extract_team(data, team_name):
+    """Извлекает первую найденную команду из ответа searchteams.php."""
     if not data or "teams" not in data or not data["teams"]:
         logger.warning(f"Команда не найдена: {team_name}")
         return None
@@ -159,12 +248,19 @@ def get_team_last_matches(team_id):
     
     data = api_request(endpoint, params)
     
+    return _extract_last_matches(data, team_id)
+
+def _extract_last_events(data, team_id):
+    """Матчи из ответа eventslast.php в исходном виде."""
     if not data or "results" not in data or not data["results"]:
         logger.warning(f"Не найдены последние матчи для команды с ID: {team_id}")
         return []
-    
+    return data["results"]
+
+def _extract_last_matches(data, team_id):
+    """Преобразует ответ eventslast.php в список строк с результатами."""
     matches = []
-    for match in data["results"]:
+    for match in _extract_last_events(data, team_id):
         match_info = {
             "date": match.get("dateEvent", ""),
             "home_team": match.get("strHomeTeam", ""),
@@ -194,12 +290,19 @@ def get_team_players(team_name):
     
     data = api_request(endpoint, params)
     
+    return _extract_players(data, team_name)
+
+def _extract_player_entries(data, team_name):
+    """Игроки из ответа searchplayers.php в исходном виде."""
     if not data or "player" not in data or not data["player"]:
         logger.warning(f"Не найдены игроки для команды: {team_name}")
         return []
-    
+    return data["player"]
+
+def _extract_players(data, team_name):
+    """Преобразует ответ searchplayers.php в список игроков."""
     players = []
-    for player in data["player"]:
+    for player in _extract_player_entries(data, team_name):
         player_info = f"{player.get('strPlayer', 'Неизвестный игрок')} ({player.get('strPosition', 'Неизвестная позиция')})"
         players.append(player_info)
     
@@ -284,16 +387,21 @@ def get_league_by_tournament(tournament_name):
     # Возвращаем оригинальное название, если не нашли соответствия
     return tournament_name
 
-def get_team_info(team_name):
+def get_team_info(team_name, include_players=True):
     """
     Получает информацию о команде: последние матчи и состав.
     
     Args:
         team_name: Название команды
+        include_players: Запрашивать состав (searchplayers.php); без него lineup - заглушка
     
     Returns:
         dict: Словарь с информацией о команде
     """
+    with tracing.span("get_team_info", team=team_name):
+        return _get_team_info(team_name, include_players)
+
+def _get_team_info(team_name, include_players=True):
     try:
         # Ищем команду
         team = search_team(team_name)
@@ -301,38 +409,118 @@ def get_team_info(team_name):
         if not team:
             # Если не нашли, возвращаем заглушку
             logger.warning(f"Не удалось найти команду: {team_name}, используем заглушку")
-            return {
-                'last_matches': [f"Нет данных о последних матчах для {team_name}"],
-                'lineup': [f"Нет данных о составе для {team_name}"]
-            }
+            return _placeholder_team_info(team_name)
         
         # Получаем ID команды
         team_id = team.get("idTeam", "")
         
-        # Получаем последние матчи
-        last_matches = get_team_last_matches(team_id)
-        
-        # Получаем игроков
-        players = get_team_players(team_name)
-        
-        # Если не удалось получить данные, используем заглушки
-        if not last_matches:
-            last_matches = [f"Нет данных о последних матчах для {team_name}"]
-        
-        if not players:
-            players = [f"Нет данных о составе для {team_name}"]
+        # Получаем последние матчи (из локальной базы, если данные свежие) и игроков
+        last_data = _local_last_events(team_id) or api_request("eventslast.php", {"id": team_id})
+        players_data = api_request("searchplayers.php", {"t": team_name}) if include_players else None
         
-        return {
-            'last_matches': last_matches,
-            'lineup': players
-        }
+        return _build_team_profile(team_name, team_id, last_data, players_data, include_players)
     
     except Exception as e:
         logger.error(f"Ошибка при получении информации о команде {team_name}: {e}")
-        return {
-            'last_matches': [f"Ошибка при получении данных о последних матчах для {team_name}"],
-            'lineup': [f"Ошибка при получении данных о составе для {team_name}"]
-        }
+        return _error_team_info(team_name)
+
+def _placeholder_team_info(team_name):
+    """Заглушка для команды, которую не удалось найти."""
+    return {
+        'last_matches': [f"Нет данных о последних матчах для {team_name}"],
+        'lineup': [f"Нет данных о составе для {team_name}"]
+    }
+
+def _error_team_info(team_name):
+    """Заглушка для команды при ошибке получения данных."""
+    return {
+        'last_matches': [f"Ошибка при получении данных о последних матчах для {team_name}"],
+        'lineup': [f"Ошибка при получении данных о составе для {team_name}"]
+    }
+
+# Количество последних матчей для расчета формы (столько возвращает eventslast.php)
+FORM_MATCHES = 5
+
+def _local_last_events(team_id):
+    """
+    Последние матчи команды из локальной базы результатов.
+    
+    Returns:
+        dict: Данные в формате ответа eventslast.php или None, если локальные данные устарели
+    """
+    try:
+        fresh = bool(team_id) and results_store.store.is_fresh(team_id)
+        metrics.record_cache("results_db", fresh)
+        if fresh:
+            return {"results": results_store.store.team_events(team_id, FORM_MATCHES)}
+    except Exception as e:
+        logger.error(f"Ошибка при чтении локальной базы результатов: {e}")
+    return None
+
+def get_head_to_head(team1_id, team2_id, team1_name):
+    """
+    История личных встреч команд из локальной базы результатов (без запросов к API).
+    
+    Returns:
+        str: Сводка личных встреч или None, если данных нет
+    """
+    if not team1_id or not team2_id:
+        return None
+    try:
+        events = results_store.store.head_to_head(team1_id, team2_id, FORM_MATCHES)
+    except Exception as e:
+        logger.error(f"Ошибка при чтении локальной базы результатов: {e}")
+        return None
+    return team_form.format_head_to_head(events, team1_id, team1_name)
+
+def get_local_team_info(team_name):
+    """
+    Форма команды из локальной базы результатов по названию (без запросов к API).
+    
+    Returns:
+        dict: Информация о команде (last_matches, team_id) или None, если команды нет в базе
+    """
+    try:
+        team_id = results_store.store.find_team_id(team_name)
+        if not team_id:
+            return None
+        form = team_form.compute_form(team_form.team_results(results_store.store.team_events(team_id, FORM_MATCHES), team_id))
+    except Exception as e:
+        logger.error(f"Ошибка при чтении локальной базы результатов: {e}")
+        return None
+    if not form:
+        return None
+    return {'last_matches': team_form.format_form(form), 'form': form, 'team_id': team_id}
+
+def _build_team_profile(team_name, team_id, last_data, players_data, include_players=True):
+    """
+    Информация о команде для промпта из ответов eventslast.php и searchplayers.php.
+    
+    Вместо строк с результатами используется сводка формы (серия, мячи,
+    дома/в гостях, дней с последнего матча), состав сокращается до ключевых игроков.
+    """
+    form = team_form.compute_form(team_form.team_results(_extract_last_events(last_data, team_id), team_id))
+    last_matches = team_form.format_form(form) if form else None
+    players = team_form.select_key_players(_extract_player_entries(players_data, team_name)) if include_players else None
+    
+    team_info = _build_team_info(team_name, last_matches, players)
+    team_info['form'] = form
+    team_info['team_id'] = team_id
+    return team_info
+
+def _build_team_info(team_name, last_matches, players):
+    """Собирает информацию о команде, подставляя заглушки вместо пустых данных."""
+    # Если не удалось получить данные, используем заглушки
+    if not last_matches:
+        last_matches = [f"Нет данных о последних матчах для {team_name}"]
+    
+    if not players:
+        players = [f"Нет данных о составе для {team_name}"]
+    
+    return {
+        'last_matches': last_matches,
+        'lineup': players
+    }
 
 def search_matches_for_tournament(tournament, date_str):
     """
@@ -349,69 +537,233 @@ def search_matches_for_tournament(tournament, date_str):
         # Преобразуем дату в формат API (YYYY-MM-DD)
         formatted_date = convert_date_format(date_str)
         
-        # Преобразуем название турнира в формат для API
-        league_name = get_league_by_tournament(tournament)
-        
         # Делаем запрос на поиск матчей в этот день
         endpoint = "eventsday.php"
         params = {"d": formatted_date}
         
         data = api_request(endpoint, params)
         
-        matches = []
+        return _extract_tournament_matches(data, tournament, date_str, formatted_date)
+    
+    except Exception as e:
+        logger.error(f"Ошибка при поиске матчей для турнира {tournament} на дату {date_str}: {e}")
+        # В случае ошибки возвращаем примерные данные
+        return _placeholder_tournament_matches(tournament, date_str)
+
+def _placeholder_tournament_matches(tournament, date):
+    """Генерирует примерные матчи турнира (для примера или тестирования)."""
+    matches = []
+    for i in range(1, 7):  # Предполагаем, что нужно 6 матчей
+        matches.append({
+            'team1': f"Команда{i}A ({tournament})",
+            'team2': f"Команда{i}B ({tournament})",
+            'tournament': tournament,
+            'date': date
+        })
+    
+    return matches
+
+def _extract_tournament_matches(data, tournament, date_str, formatted_date):
+    """Отбирает из ответа eventsday.php матчи нужного турнира."""
+    # Проверяем есть ли данные о матчах
+    if not data or "events" not in data or not data["events"]:
+        logger.warning(f"Не найдены матчи для турнира {tournament} на дату {date_str}")
+        return _placeholder_tournament_matches(tournament, formatted_date)
+    
+    # Преобразуем название турнира в формат для API
+    league_name = get_league_by_tournament(tournament)
+    
+    matches = []
+    
+    # Фильтруем матчи по нужному турниру/лиге
+    for event in data["events"]:
+        event_league = event.get("strLeague", "")
         
-        # Проверяем есть ли данные о матчах
-        if not data or "events" not in data or not data["events"]:
-            logger.warning(f"Не найдены матчи для турнира {tournament} на дату {date_str}")
+        # Проверяем соответствие лиги/турнира
+        if league_name.lower() in event_league.lower() or event_league.lower() in league_name.lower():
+            match = {
+                'team1': event.get("strHomeTeam", ""),
+                'team2': event.get("strAwayTeam", ""),
+                'tournament': tournament,
+                'date': formatted_date
+            }
+            matches.append(match)
+    
+    # Если после фильтрации не осталось матчей, возвращаем примерные
+    if not matches:
+        logger.warning(f"После фильтрации не найдены матчи для {tournament} на {date_str}")
+        return _placeholder_tournament_matches(tournament, formatted_date)
+    
+    return matches
+
+# ---------------------------------------------------------------------------
+# Асинхронные варианты запросов (для async_bot.py)
+# ---------------------------------------------------------------------------
+
+# Общий асинхронный HTTP клиент, создается при первом запросе
+_async_client = None
+
+def _get_async_client():
+    """Возвращает общий асинхронный HTTP клиент, создавая его при необходимости."""
+    global _async_client
+    if httpx is None:
+        raise RuntimeError("Для асинхронного режима требуется пакет httpx")
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        )
+    return _async_client
+
+async def close_async_client():
+    """Закрывает общий асинхронный HTTP клиент."""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+async def async_api_request(endpoint, params=None):
+    """
+    Асинхронный вариант api_request с теми же проверками безопасности.
+    
+    Args:
+        endpoint: Эндпоинт API
+        params: Параметры запроса
+    
+    Returns:
+        dict: Ответ от API в формате JSON
+    """
+    if not api_breaker.allow():
+        logger.warning(f"TheSportsDB временно недоступен, запрос {endpoint} пропущен")
+        return None
+    
+    started = time.perf_counter()
+    try:
+        with tracing.span("thesportsdb", endpoint=endpoint[:100]):
+            data = await _async_api_request(endpoint, params)
+    except BaseException:
+        # Задание отменено (asyncio.CancelledError) - пробный запрос не дал результата
+        api_breaker.record_canceled()
+        raise
+    # Результаты матчей сохраняются в SQLite - не в цикле событий
+    await asyncio.to_thread(_record_api_result, endpoint, params, data, time.perf_counter() - started)
+    return data
+
+async def _async_api_request(endpoint, params=None):
+    """Асинхронный запрос к API с повторами (без учета метрик и предохранителя)."""
+    validated_params = validate_api_params(params)
+    endpoint = endpoint[:100]  # Ограничение длины эндпоинта
+    url = f"{API_BASE_URL}/{API_KEY}/{endpoint}"
+    
+    for attempt in range(MAX_RETRIES):
+        try:
+            async def get():
+                async with api_limiter.async_slot():
+                    return await _get_async_client().get(url, params=validated_params)
             
-            # Если данных нет, генерируем примерные матчи (для примера или тестирования)
-            for i in range(1, 7):  # Предполагаем, что нужно 6 матчей
-                matches.append({
-                    'team1': f"Команда{i}A ({tournament})",
-                    'team2': f"Команда{i}B ({tournament})",
-                    'tournament': tournament,
-                    'date': formatted_date
-                })
+            response = await api_hedger.async_call(endpoint, get, accept=_is_ok_response)
             
-            return matches
-        
-        # Фильтруем матчи по нужному турниру/лиге
-        for event in data["events"]:
-            event_league = event.get("strLeague", "")
+            if response.status_code == 429:
+                api_limiter.record_overload()
+            if response.status_code != 200:
+                logger.error(
+                    "Ошибка API: %s, URL: %s, Ответ: %s", response.status_code, url, ResponseExcerpt(response),
+                    extra={'log_type': 'api_error'}
+                )
+                if attempt < MAX_RETRIES - 1:
+                    await asyncio.sleep(RETRY_DELAY)
+                    continue
+                return None
             
-            # Проверяем соответствие лиги/турнира
-            if league_name.lower() in event_league.lower() or event_league.lower() in league_name.lower():
-                match = {
-                    'team1': event.get("strHomeTeam", ""),
-                    'team2': event.get("strAwayTeam", ""),
-                    'tournament': tournament,
-                    'date': formatted_date
-                }
-                matches.append(match)
+            if len(response.content) > MAX_RESPONSE_SIZE:
+                logger.error(f"Ответ API слишком большой: {len(response.content)} байт")
+                return None
+            
+            try:
+                return response.json()
+            except json.JSONDecodeError as e:
+                logger.error(f"Ошибка при разборе JSON: {e}")
+                return None
         
-        # Если после фильтрации не осталось матчей, возвращаем примерные
-        if not matches:
-            logger.warning(f"После фильтрации не найдены матчи для {tournament} на {date_str}")
-            for i in range(1, 7):
-                matches.append({
-                    'team1': f"Команда{i}A ({tournament})",
-                    'team2': f"Команда{i}B ({tournament})",
-                    'tournament': tournament,
-                    'date': formatted_date
-                })
+        except httpx.HTTPError as e:
+            logger.error("Ошибка при запросе к API: %s", e, extra={'log_type': 'api_error'})
+            if isinstance(e, httpx.TimeoutException):
+                api_limiter.record_overload()
+            if attempt < MAX_RETRIES - 1:
+                await asyncio.sleep(RETRY_DELAY)
+            else:
+                return None
+        except Exception as e:
+            logger.error(f"Непредвиденная ошибка при запросе к API: {e}")
+            return None
+    
+    return None
+
+async def async_search_team(team_name):
+    """Асинхронный вариант search_team."""
+    if not team_name or not isinstance(team_name, str):
+        logger.warning("Получено некорректное название команды")
+        return None
+    
+    team_name = team_name[:50]
+    data = await async_api_request("searchteams.php", {"t": team_name})
+    return _extract_team(data, team_name)
+
+async def async_get_team_last_matches(team_id):
+    """Асинхронный вариант get_team_last_matches."""
+    data = await async_api_request("eventslast.php", {"id": team_id})
+    return _extract_last_matches(data, team_id)
+
+async def async_get_team_players(team_name):
+    """Асинхронный вариант get_team_players."""
+    data = await async_api_request("searchplayers.php", {"t": team_name})
+    return _extract_players(data, team_name)
+
+async def async_get_team_info(team_name, include_players=True):
+    """
+    Асинхронный вариант get_team_info.
+    
+    Последние матчи и состав запрашиваются параллельно.
+    """
+    with tracing.span("get_team_info", team=team_name):
+        return await _async_get_team_info(team_name, include_players)
+
+async def _async_get_team_info(team_name, include_players=True):
+    try:
+        team = await async_search_team(team_name)
+        
+        if not team:
+            logger.warning(f"Не удалось найти команду: {team_name}, используем заглушку")
+            return _placeholder_team_info(team_name)
+        
+        team_id = team.get("idTeam", "")
+        last_data = await asyncio.to_thread(_local_last_events, team_id)
+        if not include_players:
+            players_data = None
+            if not last_data:
+                last_data = await async_api_request("eventslast.php", {"id": team_id})
+        elif last_data:
+            players_data = await async_api_request("searchplayers.php", {"t": team_name})
+        else:
+            last_data, players_data = await asyncio.gather(
+                async_api_request("eventslast.php", {"id": team_id}),
+                async_api_request("searchplayers.php", {"t": team_name})
+            )
         
-        return matches
+        return _build_team_profile(team_name, team_id, last_data, players_data, include_players)
+    
+    except Exception as e:
+        logger.error(f"Ошибка при получении информации о команде {team_name}: {e}")
+        return _error_team_info(team_name)
+
+async def async_search_matches_for_tournament(tournament, date_str):
+    """Асинхронный вариант search_matches_for_tournament."""
+    try:
+        formatted_date = convert_date_format(date_str)
+        data = await async_api_request("eventsday.php", {"d": formatted_date})
+        return _extract_tournament_matches(data, tournament, date_str, formatted_date)
     
     except Exception as e:
         logger.error(f"Ошибка при поиске матчей для турнира {tournament} на дату {date_str}: {e}")
-        # В случае ошибки возвращаем примерные данные
-        matches = []
-        for i in range(1, 7):
-            matches.append({
-                'team1': f"Команда{i}A ({tournament})",
-                'team2': f"Команда{i}B ({tournament})",
-                'tournament': tournament,
-                'date': date_str
-            })
-        
-        return matches 
\ No newline at end of file
+        return _placeholder_tournament_matches(tournament, date_str)